@@ -1,29 +1,61 @@
 import os
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
-from werkzeug.utils import secure_filename
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, stream_template, abort
 from werkzeug.security import generate_password_hash
 from datetime import datetime
-from models import db, Service, ServiceProfessional, ServiceRequest, ProfessionalStatus, User
+from models import db, Service, ServiceProfessional, ServiceRequest, ProfessionalStatus, User, request_history_model
+from archive import include_archived
+from catalog import catalog
+from conditional import conditional_view
+from images import ImageUploadError, process_image
+from instrumentation import DEFAULT_SLOW_QUERY_MS, endpoint_stats
+from matching import matcher
+from moderation import BULK_TARGETS, BulkActionError, apply_bulk, describe_bulk
+from pagination import StreamedRows, keyset_paginate, page_args
+from principal import current_principal, principals
+from query_budget import query_budget
+from rollups import average_ratings, daily_counts, rating_histogram, status_counts, status_counts_by_key, top_keys
+from search_index import SEARCH_RESULT_LIMIT, fts_match, fts_query, match_status
+from sqlite_profile import read_session
 
 admin_bp = Blueprint('admin', __name__)
 
+# Dashboard tabs: (model, primary key column, filters accepted from the query string)
+DASHBOARD_TABS = {
+    'services': (Service, Service.service_id, {'name': Service.name}),
+    'professionals': (ServiceProfessional, ServiceProfessional.prof_id,
+                      {'status': ServiceProfessional.status, 'service_type': ServiceProfessional.service_type}),
+    'customers': (User, User.user_id, {'status': User.status, 'pincode': User.pincode}),
+    'requests': (ServiceRequest, ServiceRequest.req_id,
+                 {'status': ServiceRequest.status, 'service_id': ServiceRequest.service_id,
+                  'prof_id': ServiceRequest.prof_id}),
+}
+
 # Admin dashboard home
 @admin_bp.route('/admin')
+@query_budget(2)
+@conditional_view('service_requests', 'users', 'service_professionals', 'service')
 def home():
-    services = Service.query.all()
-    professionals = ServiceProfessional.query.all()
-    service_requests = ServiceRequest.query.all()
-    customers = User.query.all()
-    return render_template('admin_panel/admin_dashboard.html', services=services, 
-                           professionals=professionals, service_requests=service_requests, customers=customers)
+    # Only the active tab is queried, one keyset page at a time, streamed into the page as it is read
+    tab = request.args.get('tab', 'services')
+    if tab not in DASHBOARD_TABS:
+        tab = 'services'
+    model, key_column, filter_columns = DASHBOARD_TABS[tab]
+
+    reader = read_session()
+    query = ServiceRequest.query_with_details(reader) if model is ServiceRequest else reader.query(model)
+    filters = {}
+    for name, column in filter_columns.items():
+        value = request.args.get(name, '').strip()
+        if value:
+            filters[name] = value
+            query = query.filter(column == value)
+
+    args = page_args()
+    page = keyset_paginate(query, key_column, stream=True, **args)
+    return stream_template('admin_panel/admin_dashboard.html', tab=tab, page=page, filters=filters,
+                           sort='desc' if args['descending'] else 'asc', per_page=args['per_page'])
 
 # Add new service
-# Configure allowed file extensions for image uploads
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 @admin_bp.route('/admin_dashboard/add_service', methods=['GET', 'POST'])
 def add_service():
     if request.method == 'POST':
@@ -53,36 +85,31 @@ def add_service():
             flash('Valid base price is required (non-negative number).', 'danger')
             return redirect(url_for('admin.add_service'))
 
-        # Handle image file upload
+        # Handle image file upload: resized JPEG/WebP variants, stored by content hash
         image_path = None  # Default to no image
+        image_variants = None
         file = request.files.get('image')
-        if file and allowed_file(file.filename):
+        if file and file.filename:
             try:
-                # Secure the filename and save the file
-                filename = secure_filename(file.filename)
-                upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)  # Create folder if it doesn't exist
-                file_path = os.path.join(upload_folder, filename)
-                file.save(file_path)
-                image_path = f'static/uploads/{filename}'  # Save relative path for database
-            except Exception as e:
-                flash(f'Error saving the image: {str(e)}', 'danger')
+                image_variants = process_image(file.stream)
+            except ImageUploadError as e:
+                flash(str(e), 'danger')
                 return redirect(url_for('admin.add_service'))
-        elif file:
-            flash('Invalid image file. Only PNG, JPG, JPEG, and GIF are allowed.', 'danger')
-            return redirect(url_for('admin.add_service'))
+            image_path = 'static/' + image_variants['variants']['full']['jpeg']  # Largest variant for plain <img> uses
 
         # Save service details to the database
         new_service = Service(
             name=name,  # Only the name attribute is used
             description=description,
             base_price=base_price,
-            image=image_path
+            image=image_path,
+            image_variants=image_variants
         )
 
         try:
             db.session.add(new_service)
             db.session.commit()
+            catalog.invalidate()
             flash('Service added successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -90,7 +117,7 @@ def add_service():
         return redirect(url_for('admin.home'))
 
     # Fetch all existing service names to populate dropdown
-    services = Service.query.with_entities(Service.name).distinct().all()
+    services = catalog.names()
     return render_template('admin_panel/add_service.html', services=services)
 
 
@@ -128,23 +155,15 @@ def edit_service(service_id):
             flash('Valid base price is required (non-negative number).', 'danger')
             return redirect(url_for('admin.edit_service', service_id=service_id))
 
-        # Handle image file upload
+        # Handle image file upload: resized JPEG/WebP variants, stored by content hash
         file = request.files.get('image')
-        if file and allowed_file(file.filename):
+        if file and file.filename:
             try:
-                # Secure the filename and save the file
-                filename = secure_filename(file.filename)
-                upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)  # Create folder if it doesn't exist
-                file_path = os.path.join(upload_folder, filename)
-                file.save(file_path)
-                service.image = f'static/uploads/{filename}'  # Update the service image
-            except Exception as e:
-                flash(f'Error saving the image: {str(e)}', 'danger')
+                service.image_variants = process_image(file.stream)
+            except ImageUploadError as e:
+                flash(str(e), 'danger')
                 return redirect(url_for('admin.edit_service', service_id=service_id))
-        elif file:
-            flash('Invalid image file. Only PNG, JPG, JPEG, and GIF are allowed.', 'danger')
-            return redirect(url_for('admin.edit_service', service_id=service_id))
+            service.image = 'static/' + service.image_variants['variants']['full']['jpeg']  # Update the service image
 
         # Update service details in the database
         service.name = name
@@ -153,6 +172,7 @@ def edit_service(service_id):
 
         try:
             db.session.commit()
+            catalog.invalidate()
             flash('Service updated successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -160,7 +180,7 @@ def edit_service(service_id):
         return redirect(url_for('admin.home'))
 
     # Fetch all existing service names to populate dropdown
-    services = Service.query.with_entities(Service.name).distinct().all()
+    services = catalog.names()
     return render_template('admin_panel/edit_service.html', service=service, services=services)
 
 
@@ -171,6 +191,7 @@ def delete_service(service_id):
     service = Service.query.get(service_id)
     db.session.delete(service)
     db.session.commit()
+    catalog.invalidate()
     flash('Service deleted successfully!', 'success')
     return redirect(url_for('main.admin_dashboard'))
 
@@ -230,7 +251,7 @@ def add_professional():
             return redirect(url_for('admin.add_professional'))
 
     # Query all available services to display in the form
-    services = Service.query.all()
+    services = catalog.services()
     return render_template('admin_panel/add_professional.html', services=services)
 
 
@@ -286,7 +307,7 @@ def add_customer():
             return redirect(url_for('admin.add_customer'))
 
     # Query all available services to display in the form
-    services = Service.query.all()
+    services = catalog.services()
 
     return render_template('admin_panel/add_customer.html', services=services)
 
@@ -300,6 +321,7 @@ def block_customer(customer_id):
         else:
             customer.status = 'Blocked'
             db.session.commit()
+            principals.invalidate('user', customer_id)  # Logged out on their next request
             flash('Customer blocked successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -317,6 +339,7 @@ def unblock_customer(customer_id):
         else:
             customer.status = 'Active'
             db.session.commit()
+            principals.invalidate('user', customer_id)
             flash('Customer unblocked successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -330,6 +353,7 @@ def delete_customer(customer_id):
     try:
         db.session.delete(customer)
         db.session.commit()
+        principals.invalidate('user', customer_id)
         flash('Customer deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -342,6 +366,8 @@ def approve_professional(professional_id):
     if professional:
         professional.status = ProfessionalStatus.APPROVED  
         db.session.commit()
+        matcher.professional_changed(professional)
+        principals.invalidate('professional', professional_id)
         flash("Professional approved successfully!", "success")
     else:
         flash("Professional not found.", "danger")
@@ -353,6 +379,8 @@ def reject_professional(professional_id):
     if professional:
         professional.status = ProfessionalStatus.REJECTED  
         db.session.commit()
+        matcher.professional_changed(professional)
+        principals.invalidate('professional', professional_id)
         flash("Professional rejected successfully!", "success")
     else:
         flash("Professional not found.", "danger")
@@ -365,91 +393,189 @@ def delete_professional(professional_id):
     try:
         db.session.delete(professional)
         db.session.commit()
+        matcher.professional_removed(professional_id)
+        principals.invalidate('professional', professional_id)
         flash('Professional deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting professional: {str(e)}', 'danger')
     return redirect(url_for('admin.home'))
 
+# Bulk moderation from the dashboard checkboxes: one statement per chunk of ids, one transaction
+@admin_bp.route('/admin_dashboard/bulk/<tab>', methods=['POST'])
+def bulk_action(tab):
+    principal = current_principal()
+    if principal is None or principal.role != 'admin':
+        flash('You must be logged in as an admin to do that.', 'danger')
+        return redirect(url_for('main.login'))
+    if tab not in BULK_TARGETS:
+        abort(404)
+
+    # The dashboard filters ride along, for "every row matching the filters" and the way back
+    _, _, filter_columns = DASHBOARD_TABS[tab]
+    filters = {name: request.form[name].strip() for name in filter_columns if request.form.get(name, '').strip()}
+    scope = request.form.get('scope')
+    try:
+        if scope in ('matching', 'all'):
+            summary = apply_bulk(tab, request.form.get('action'), filters=filters if scope == 'matching' else {},
+                                 match_all=scope == 'all')
+        else:
+            summary = apply_bulk(tab, request.form.get('action'), ids=request.form.getlist('ids'))
+        flash(describe_bulk(summary), 'success')
+    except BulkActionError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('admin.home', tab=tab, **filters))
+
 # Search functionality route
 @admin_bp.route('/admin_dashboard/search', methods=['GET'])
+@query_budget(3)  # one more when this worker's catalog snapshot is cold
+@conditional_view('service_requests', 'users', 'service_professionals', 'service')
 def search():
     search_by = request.args.get('search_by')
     query = request.args.get('query', '').strip().lower()
-    services = Service.query.all()
+    archived = include_archived()
+    reader = read_session()
+    services = catalog.services()
 
-    if search_by == "services":
-        # Filter by service name
-        results = Service.query.filter(Service.name.contains(query)).all()
+    if not fts_query(query):
+        results = None
 
-    elif search_by == "customers":
-        # Filter by user name, location, pincode, or status
+    elif search_by == "services":
+        # Full-text match on service name and description, best match first
+        matches = fts_match('service_fts', query)
         results = (
-            User.query.filter(
-                db.or_(
-                    User.user_name.contains(query),
-                    User.address.contains(query),
-                    User.pincode.contains(query),
-                    User.status.contains(query),
-                )
-            ).all()
+            reader.query(Service)
+            .join(matches, Service.service_id == matches.c.rowid)
+            .order_by(matches.c.rank)
+            .limit(SEARCH_RESULT_LIMIT)
         )
 
-    elif search_by == "professionals":
-    # Filter by professional name, location, pincode, status, or service name
-        results = (
-            db.session.query(
-                ServiceProfessional,
-                Service.name.label("service_name")  # Select service name explicitly
-            )
-            .join(ServiceProfessional, Service.service_id == Service.service_id)  # Join with Service table
-            .filter(
-                db.or_(
-                    ServiceProfessional.prof_name.contains(query),
-                    ServiceProfessional.address.contains(query),
-                    ServiceProfessional.pincode.contains(query),
-                    ServiceProfessional.status.contains(query),
-                    Service.name.contains(query),  # Filter by service name
-                )
+    elif search_by == "customers":
+        # Filter by status, or full-text match on user name, location and pincode
+        status = match_status(query, ['Active', 'Blocked'])
+        if status:
+            results = reader.query(User).filter(User.status == status).limit(SEARCH_RESULT_LIMIT)
+        else:
+            matches = fts_match('users_fts', query)
+            results = (
+                reader.query(User)
+                .join(matches, User.user_id == matches.c.rowid)
+                .order_by(matches.c.rank)
+                .limit(SEARCH_RESULT_LIMIT)
             )
-            .all()
-        )
 
+    elif search_by == "professionals":
+        # Filter by status, or full-text match on professional name, service, location and pincode
+        professionals = reader.query(
+            ServiceProfessional,
+            ServiceProfessional.service_type.label("service_name")
+        )
+        status = match_status(query, ['PENDING', 'APPROVED', 'REJECTED'])
+        if status:
+            results = professionals.filter(ServiceProfessional.status == status).limit(SEARCH_RESULT_LIMIT)
+        else:
+            matches = fts_match('professionals_fts', query)
+            results = (
+                professionals
+                .join(matches, ServiceProfessional.prof_id == matches.c.rowid)
+                .order_by(matches.c.rank)
+                .limit(SEARCH_RESULT_LIMIT)
+            )
 
     elif search_by == "requests":
-        # Filter by professional name, status, or rating
-        results = (
-            db.session.query(
-                ServiceRequest.req_id,
+        # Filter by status or rating, or full-text match on the assigned professional's name;
+        # archived requests only when asked for
+        history = request_history_model(archived)
+        requests = (
+            reader.query(
+                history.req_id,
                 ServiceProfessional.prof_name,
-                ServiceRequest.requested_date,
-                ServiceRequest.status,
-                ServiceRequest.rating,
+                history.requested_date,
+                history.status,
+                history.rating,
             )
-            .join(ServiceProfessional, ServiceRequest.prof_id == ServiceProfessional.prof_id)
-            .filter(
-                db.or_(
-                    ServiceProfessional.prof_name.contains(query),
-                    ServiceRequest.status.contains(query),
-                    ServiceRequest.rating.contains(query),
-                )
-            )
-            .all()
+            .join(ServiceProfessional, history.prof_id == ServiceProfessional.prof_id)
         )
+        status = match_status(query, ['Requested', 'Accepted', 'Rejected', 'Closed'])
+        if status:
+            requests = requests.filter(history.status == status).order_by(history.req_id.desc())
+        elif query.isdigit():
+            requests = requests.filter(history.rating == int(query)).order_by(history.req_id.desc())
+        else:
+            matches = fts_match('professionals_fts', query)
+            requests = (
+                requests
+                .join(matches, ServiceProfessional.prof_id == matches.c.rowid)
+                .order_by(matches.c.rank, history.req_id.desc())
+            )
+        results = requests.limit(SEARCH_RESULT_LIMIT)
 
     else:
-        results = []
+        results = None
 
-    # Pass results and query back to the template
-    return render_template(
+    # Pass results and query back to the template, which streams the rows as they are fetched
+    results = StreamedRows(results) if results is not None else []
+    return stream_template(
         'admin_panel/search.html', 
         results=results, 
         search_by=search_by, 
         query=query, 
-        services=services
+        services=services,
+        archived=archived
     )
 
 
 @admin_bp.route('/admin_dashboard/summary', methods=['GET'])
+@query_budget(9)  # one more when this worker's catalog snapshot is cold
+@conditional_view('request_rollups', 'rating_rollups', 'service_professionals', 'service')
 def summary():
-    return render_template('admin_panel/summary.html')
\ No newline at end of file
+    # Every table on this page is read from the pre-aggregated rollups
+    counts = status_counts('all')
+    histogram, rating_total, rating_average = rating_histogram('all')
+    by_service = status_counts_by_key('service')
+    service_ratings = average_ratings('service')
+    top_professionals = top_keys('professional', 'Closed')
+
+    service_names = {service.service_id: service.name for service in catalog.services()}
+    prof_ids = [int(key) for key, _ in top_professionals]
+    prof_names = dict(
+        db.session.query(ServiceProfessional.prof_id, ServiceProfessional.prof_name)
+        .filter(ServiceProfessional.prof_id.in_(prof_ids))
+        .all()
+    ) if prof_ids else {}
+
+    return render_template(
+        'admin_panel/summary.html',
+        counts=counts,
+        total=sum(counts.values()),
+        daily=daily_counts(14),
+        by_service=sorted(by_service.items(), key=lambda item: -sum(item[1].values())),
+        service_names={str(k): v for k, v in service_names.items()},
+        service_ratings=service_ratings,
+        top_professionals=[(prof_names.get(int(key), f'#{key}'), count) for key, count in top_professionals],
+        histogram=histogram,
+        rating_total=rating_total,
+        rating_average=rating_average
+    )
+
+
+# Per-endpoint timings and slow queries collected by instrumentation.py
+@admin_bp.route('/admin_dashboard/performance', methods=['GET', 'POST'])
+def performance():
+    principal = current_principal()
+    if principal is None or principal.role != 'admin':
+        flash('You must be logged in as an admin to view this page.', 'danger')
+        return redirect(url_for('main.login'))
+
+    if request.method == 'POST':
+        endpoint_stats.reset()
+        return redirect(url_for('admin.performance'))
+
+    return render_template(
+        'admin_panel/performance.html',
+        by_db_time=endpoint_stats.top('db_ms'),
+        by_queries=endpoint_stats.top('queries'),
+        slow_queries=list(endpoint_stats.slow_queries),
+        since=datetime.fromtimestamp(endpoint_stats.since),
+        threshold=current_app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    )
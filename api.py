@@ -0,0 +1,523 @@
+# api.py
+"""Versioned JSON API under ``/api/v1``, built on Flask-RESTful.
+
+Requests are authenticated with the same session as the HTML panels, and
+rows are scoped to the caller's role. Customers see their own requests,
+professionals see the requests assigned to them, and admins see
+everything.
+
+Every collection supports:
+
+* keyset pagination with the same ``after``/``before``/``per_page``/``sort``
+  arguments as the dashboards; the response carries ``next_cursor`` and
+  ``prev_cursor``,
+* ``fields=a,b`` to select only some columns,
+* equality filters on indexed columns, e.g. ``/requests?status=Accepted``.
+
+Writes take JSON. ``POST`` to a collection accepts one object or a list of
+up to :data:`MAX_BULK` objects. ``PATCH`` to a collection takes a list of
+objects that carry their primary key. A bulk write is applied in a single
+transaction, so either every item succeeds or none does. Rows outside the
+caller's scope are reported as not found, the same as rows that do not
+exist, so writes do not reveal which ids are taken.
+
+Only services and requests can be created here. Professionals and customers
+sign up through the registration pages, which hash their passwords; admins
+bring in accounts in bulk with ``flask data import`` (see bulk_data.py), so
+``POST /professionals`` and ``POST /customers`` answer 405.
+
+Admins moderate professionals and customers in bulk with ``POST
+/professionals/bulk`` and ``POST /customers/bulk`` (see moderation.py).
+"""
+from datetime import datetime
+
+from flask import Blueprint, request
+from flask_restful import Api, Resource, abort
+from sqlalchemy.exc import IntegrityError
+
+from catalog import catalog
+from matching import matcher
+from models import db, Service, ServiceProfessional, ServiceRequest, User, OPEN_REQUEST_STATUSES, REQUEST_TRANSITIONS
+from moderation import BulkActionError, apply_bulk
+from pagination import keyset_paginate, page_args
+from principal import current_principal, principals
+from rollups import record_rating, record_status_change
+from sqlite_profile import read_session
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+api = Api(api_bp)
+
+MAX_BULK = 100
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def require_principal(*roles):
+    """The calling principal, or a 401/403 JSON error."""
+    principal = current_principal()
+    if principal is None:
+        abort(401, message='Log in to use the API.')
+    if roles and principal.role not in roles:
+        abort(403, message='You are not allowed to do that.')
+    return principal
+
+
+def _json_items(bulk):
+    if not request.is_json:
+        abort(415, message='Send a JSON body.')
+    body = request.get_json(silent=True)
+    items = body if isinstance(body, list) else [body]
+    if not bulk and len(items) != 1:
+        abort(400, message='Send a single JSON object.')
+    if not items or len(items) > MAX_BULK or not all(isinstance(item, dict) for item in items):
+        abort(400, message=f'Send a JSON object or a list of 1 to {MAX_BULK} objects.')
+    return items
+
+
+class CollectionResource(Resource):
+    model = None
+    key = None  # name of the primary key field, the pagination cursor
+    fields = {}  # public name -> column, in output order
+    private_fields = ()  # names only admins may read
+    filters = {}  # query argument -> indexed column
+
+    def scope(self, query, principal):
+        """Restrict ``query`` to the rows ``principal`` may read."""
+        return query
+
+    def visible_fields(self, principal):
+        if principal.role == 'admin':
+            return list(self.fields)
+        return [name for name in self.fields if name not in self.private_fields]
+
+    def selected_fields(self, principal):
+        visible = self.visible_fields(principal)
+        requested = request.args.get('fields')
+        if not requested:
+            return visible
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in visible]
+        if unknown:
+            abort(400, message=f"Unknown field(s): {', '.join(unknown)}")
+        return names if self.key in names else [self.key] + names  # the cursor needs the key
+
+    def query(self, principal, names):
+        columns = [self.fields[name].label(name) for name in names]
+        return self.scope(read_session().query(*columns), principal)
+
+    def list(self):
+        principal = require_principal()
+        names = self.selected_fields(principal)
+        query = self.query(principal, names)
+        for arg, column in self.filters.items():
+            value = request.args.get(arg)
+            if value is not None:
+                query = query.filter(column == value)
+        page = keyset_paginate(query, self.fields[self.key], **page_args())
+        return {
+            'data': [{name: _serialize(value) for name, value in row._asdict().items()} for row in page],
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+        }
+
+    def one(self, id):
+        principal = require_principal()
+        names = self.selected_fields(principal)
+        row = self.query(principal, names).filter(self.fields[self.key] == id).first()
+        if row is None:
+            abort(404, message=f'{self.model.__name__} {id} not found.')
+        return {'data': {name: _serialize(value) for name, value in row._asdict().items()}}
+
+    # --- Writes ---------------------------------------------------------------
+
+    def dump(self, obj, principal):
+        return {name: _serialize(getattr(obj, column.key)) for name, column in self.fields.items()
+                if name in self.visible_fields(principal)}
+
+    def create(self, item, principal):
+        """Build (and add to the session) a new row from ``item``; return ``(obj, after_commit)``."""
+        abort(405, message='Rows of this kind cannot be created through the API.')
+
+    def update(self, obj, item, principal):
+        """Apply ``item`` to ``obj``; return a callable to run after commit, or ``None``."""
+        abort(405, message='Rows of this kind cannot be changed through the API.')
+
+    def undo(self, callbacks):
+        """Roll back in-memory side effects of a failed transaction."""
+
+    def commit(self, objs, callbacks, principal, status):
+        try:
+            db.session.flush()  # assigns primary keys to new rows
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            self.undo(callbacks)
+            abort(409, message=f'Conflicts with existing data: {e.orig}')
+        for callback in callbacks:
+            if callable(callback):
+                callback()
+        return {'data': [self.dump(obj, principal) for obj in objs]}, status
+
+    def bulk_create(self):
+        principal = require_principal()
+        created, callbacks = [], []
+        try:
+            for item in _json_items(bulk=True):
+                obj, callback = self.create(item, principal)
+                created.append(obj)
+                callbacks.append(callback)
+        except Exception:
+            db.session.rollback()
+            self.undo(callbacks)
+            raise
+        return self.commit(created, callbacks, principal, 201)
+
+    def bulk_update(self, id=None):
+        principal = require_principal()
+        items = _json_items(bulk=id is None)
+        key_name = self.key
+        if id is not None:
+            items[0][key_name] = id
+        ids = [item.get(key_name) for item in items]
+        if not all(isinstance(i, int) for i in ids) or len(set(ids)) != len(ids):
+            abort(400, message=f'Every item needs a distinct integer "{key_name}".')
+        # Rows the caller may not read are missing to them, whether or not they exist
+        query = self.scope(self.model.query, principal).filter(self.fields[key_name].in_(ids))
+        rows = {getattr(obj, key_name): obj for obj in query.all()}
+        missing = [i for i in ids if i not in rows]
+        if missing:
+            abort(404, message=f"{self.model.__name__} not found: {', '.join(map(str, missing))}")
+        callbacks = []
+        try:
+            for item in items:
+                callbacks.append(self.update(rows[item[key_name]], item, principal))
+        except Exception:
+            db.session.rollback()
+            self.undo(callbacks)
+            raise
+        return self.commit([rows[i] for i in ids], callbacks, principal, 200)
+
+
+def _reject_unknown(item, allowed):
+    unknown = sorted(set(item) - set(allowed))
+    if unknown:
+        abort(400, message=f"Read-only or unknown field(s): {', '.join(unknown)}")
+
+
+# --- Services ---------------------------------------------------------------
+
+class ServiceResource(CollectionResource):
+    model = Service
+    key = 'service_id'
+    fields = {
+        'service_id': Service.service_id,
+        'name': Service.name,
+        'description': Service.description,
+        'base_price': Service.base_price,
+        'image': Service.image,
+        'image_variants': Service.image_variants,
+        'date_created': Service.date_created,
+    }
+    filters = {'name': Service.name}
+    writable = ('name', 'description', 'base_price')
+
+    def _apply(self, service, item):
+        _reject_unknown(item, self.writable + ('service_id',))
+        for name in self.writable:
+            if name not in item:
+                continue
+            value = item[name]
+            if name == 'base_price':
+                if not isinstance(value, (int, float)) or value < 0:
+                    abort(400, message='base_price must be a non-negative number.')
+                value = float(value)
+            elif not isinstance(value, str) or not value.strip():
+                abort(400, message=f'{name} must be a non-empty string.')
+            setattr(service, name, value)
+        return catalog.invalidate
+
+    def create(self, item, principal):
+        require_principal('admin')
+        if not all(name in item for name in self.writable):
+            abort(400, message='name, description and base_price are required.')
+        service = Service()
+        callback = self._apply(service, item)
+        db.session.add(service)
+        return service, callback
+
+    def update(self, service, item, principal):
+        require_principal('admin')
+        return self._apply(service, item)
+
+
+class ServiceList(ServiceResource):
+    def get(self):
+        return self.list()
+
+    def post(self):
+        return self.bulk_create()
+
+    def patch(self):
+        return self.bulk_update()
+
+
+class ServiceItem(ServiceResource):
+    def get(self, id):
+        return self.one(id)
+
+    def patch(self, id):
+        return self.bulk_update(id)
+
+
+# --- Service requests -------------------------------------------------------
+
+class RequestResource(CollectionResource):
+    model = ServiceRequest
+    key = 'req_id'
+    fields = {
+        'req_id': ServiceRequest.req_id,
+        'service_id': ServiceRequest.service_id,
+        'user_id': ServiceRequest.user_id,
+        'prof_id': ServiceRequest.prof_id,
+        'status': ServiceRequest.status,
+        'rating': ServiceRequest.rating,
+        'remarks': ServiceRequest.remarks,
+        'requested_date': ServiceRequest.requested_date,
+        'close_date': ServiceRequest.close_date,
+    }
+    # All backed by ix_service_requests_prof_status / _user_service_status
+    filters = {'status': ServiceRequest.status, 'service_id': ServiceRequest.service_id,
+               'prof_id': ServiceRequest.prof_id, 'user_id': ServiceRequest.user_id}
+
+    def scope(self, query, principal):
+        if principal.role == 'admin':
+            return query
+        if principal.kind == 'professional':
+            return query.filter(ServiceRequest.prof_id == principal.id)
+        return query.filter(ServiceRequest.user_id == principal.id)
+
+    def create(self, item, principal):
+        # Same rules as booking from the subcategory page
+        require_principal('customer')
+        _reject_unknown(item, ('service_id',))
+        service = catalog.get(item.get('service_id'))
+        if service is None:
+            abort(400, message=f"Service {item.get('service_id')} does not exist.")
+        prof_id = matcher.assign(service.name, principal.pincode)
+        service_request = ServiceRequest(service_id=service.service_id, user_id=principal.id, prof_id=prof_id,
+                                         status='Requested', requested_date=datetime.utcnow())
+        if not service_request.book():
+            matcher.request_closed(prof_id)
+            abort(409, message=f'Service {service.service_id} is already requested (request {service_request.req_id}).')
+        record_status_change(service_request, None, 'Requested')
+        return service_request, ('assigned', prof_id)  # only needs undoing if the commit fails
+
+    def update(self, service_request, item, principal):
+        status = item.get('status')
+        old_status, prof_id = service_request.status, service_request.prof_id
+        if principal.kind == 'professional':
+            # Accept or reject a request assigned to you
+            _reject_unknown(item, ('req_id', 'status'))
+            if prof_id != principal.id:
+                abort(403, message=f'Request {service_request.req_id} is not assigned to you.')
+            if status not in ('Accepted', 'Rejected') or old_status not in REQUEST_TRANSITIONS[status]:
+                abort(400, message=f'Request {service_request.req_id} cannot move from {old_status} to {status}.')
+            values = {'close_date': datetime.utcnow()} if status == 'Rejected' else {}
+        elif principal.role == 'customer':
+            # Close your own request with a rating
+            _reject_unknown(item, ('req_id', 'status', 'rating', 'remarks'))
+            if service_request.user_id != principal.id:
+                abort(403, message=f'Request {service_request.req_id} is not yours.')
+            rating, remarks = item.get('rating'), item.get('remarks', service_request.remarks)
+            if status != 'Closed' or old_status not in REQUEST_TRANSITIONS[status]:
+                abort(400, message=f'Request {service_request.req_id} cannot move from {old_status} to {status}.')
+            if not isinstance(rating, int) or not 1 <= rating <= 5:
+                abort(400, message='rating must be an integer from 1 to 5.')
+            if remarks is not None and not isinstance(remarks, str):
+                abort(400, message='remarks must be a string.')
+            values = {'rating': rating, 'remarks': remarks, 'close_date': datetime.utcnow()}
+        else:
+            abort(403, message='Only the customer and the assigned professional can change a request.')
+
+        old_rating = service_request.rating
+        if not service_request.transition(status, **values):
+            # It could make this move when it was loaded, so someone else changed it since
+            abort(409, message=f'Request {service_request.req_id} was changed by someone else; reload and retry.')
+        record_status_change(service_request, old_status, status)
+        if status == 'Closed':
+            record_rating(service_request, rating, old_rating)
+        if old_status in OPEN_REQUEST_STATUSES and status not in OPEN_REQUEST_STATUSES:
+            return lambda: matcher.request_closed(prof_id)
+        return None
+
+    def undo(self, callbacks):
+        for callback in callbacks:
+            if isinstance(callback, tuple):
+                matcher.request_closed(callback[1])
+
+
+class RequestList(RequestResource):
+    def get(self):
+        return self.list()
+
+    def post(self):
+        return self.bulk_create()
+
+    def patch(self):
+        return self.bulk_update()
+
+
+class RequestItem(RequestResource):
+    def get(self, id):
+        return self.one(id)
+
+    def patch(self, id):
+        return self.bulk_update(id)
+
+
+# --- Professionals ----------------------------------------------------------
+
+class ProfessionalResource(CollectionResource):
+    model = ServiceProfessional
+    key = 'prof_id'
+    fields = {
+        'prof_id': ServiceProfessional.prof_id,
+        'prof_name': ServiceProfessional.prof_name,
+        'service_type': ServiceProfessional.service_type,
+        'experience': ServiceProfessional.experience,
+        'pincode': ServiceProfessional.pincode,
+        'status': ServiceProfessional.status,
+        'rating_count': ServiceProfessional.rating_count,
+        'rating_score': ServiceProfessional.rating_score,
+        'username': ServiceProfessional.username,
+        'address': ServiceProfessional.address,
+        'contact': ServiceProfessional.contact,
+        'date_created': ServiceProfessional.date_created,
+    }
+    private_fields = ('username', 'address', 'contact', 'date_created')
+    filters = {'service_type': ServiceProfessional.service_type, 'status': ServiceProfessional.status}
+
+    def scope(self, query, principal):
+        if principal.role == 'admin':
+            return query
+        return query.filter(ServiceProfessional.status == 'APPROVED')
+
+    def update(self, professional, item, principal):
+        require_principal('admin')
+        _reject_unknown(item, ('prof_id', 'status'))
+        if item.get('status') not in ('PENDING', 'APPROVED', 'REJECTED'):
+            abort(400, message='status must be PENDING, APPROVED or REJECTED.')
+        professional.status = item['status']
+
+        def after_commit():
+            matcher.professional_changed(professional)
+            principals.invalidate('professional', professional.prof_id)
+        return after_commit
+
+
+class ProfessionalList(ProfessionalResource):
+    def get(self):
+        return self.list()
+
+    def patch(self):
+        return self.bulk_update()
+
+
+class ProfessionalItem(ProfessionalResource):
+    def get(self, id):
+        return self.one(id)
+
+    def patch(self, id):
+        return self.bulk_update(id)
+
+
+# --- Customers --------------------------------------------------------------
+
+class CustomerResource(CollectionResource):
+    model = User
+    key = 'user_id'
+    fields = {
+        'user_id': User.user_id,
+        'username': User.username,
+        'user_name': User.user_name,
+        'address': User.address,
+        'contact': User.contact,
+        'pincode': User.pincode,
+        'status': User.status,
+        'date_created': User.date_created,
+    }
+    filters = {'status': User.status, 'username': User.username}
+
+    def scope(self, query, principal):
+        query = query.filter(User.role == 'customer')
+        if principal.role == 'admin':
+            return query
+        if principal.role == 'customer':
+            return query.filter(User.user_id == principal.id)
+        abort(403, message='You are not allowed to do that.')
+
+    def update(self, customer, item, principal):
+        require_principal('admin')
+        _reject_unknown(item, ('user_id', 'status'))
+        if customer.role != 'customer':
+            abort(400, message=f'User {customer.user_id} is not a customer.')
+        if item.get('status') not in ('Active', 'Blocked'):
+            abort(400, message='status must be Active or Blocked.')
+        customer.status = item['status']
+        return lambda: principals.invalidate('user', customer.user_id)
+
+
+class CustomerList(CustomerResource):
+    def get(self):
+        return self.list()
+
+    def patch(self):
+        return self.bulk_update()
+
+
+class CustomerItem(CustomerResource):
+    def get(self, id):
+        return self.one(id)
+
+    def patch(self, id):
+        return self.bulk_update(id)
+
+
+# --- Bulk moderation --------------------------------------------------------
+
+class BulkModeration(Resource):
+    """``POST /professionals/bulk`` or ``/customers/bulk`` with ``{"action": ..., "ids": [...]}``,
+    ``{"action": ..., "filter": {"status": ...}}`` or ``{"action": ..., "all": true}``; answers with a
+    summary of what changed."""
+
+    def post(self, target):
+        require_principal('admin')
+        item = _json_items(bulk=False)[0]
+        _reject_unknown(item, ('action', 'ids', 'filter', 'all'))
+        ids, filters, match_all = item.get('ids'), item.get('filter'), item.get('all')
+        if [ids, filters, match_all].count(None) != 2:
+            abort(400, message='Send one of "ids", "filter" or "all".')
+        if ids is not None and not isinstance(ids, list):
+            abort(400, message='"ids" must be a list of integers.')
+        if filters is not None and not isinstance(filters, dict):
+            abort(400, message='"filter" must be an object.')
+        if match_all is not None and match_all is not True:
+            abort(400, message='"all" must be true.')
+        try:
+            return {'data': apply_bulk(target, item.get('action'), ids=ids, filters=filters,
+                                       match_all=bool(match_all))}
+        except BulkActionError as e:
+            abort(400, message=str(e))
+
+
+api.add_resource(ServiceList, '/services')
+api.add_resource(ServiceItem, '/services/<int:id>')
+api.add_resource(RequestList, '/requests')
+api.add_resource(RequestItem, '/requests/<int:id>')
+api.add_resource(ProfessionalList, '/professionals')
+api.add_resource(ProfessionalItem, '/professionals/<int:id>')
+api.add_resource(CustomerList, '/customers')
+api.add_resource(CustomerItem, '/customers/<int:id>')
+api.add_resource(BulkModeration, '/<any(professionals, customers):target>/bulk')
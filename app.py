@@ -1,4 +1,7 @@
+import click
 from flask import Flask
+from flask.cli import with_appcontext
+from config import load_config
 from routes import main
 from admin_routes import admin_bp
 from models import db, User
@@ -6,27 +9,36 @@ from werkzeug.security import generate_password_hash
 from professional_routes import professional_bp
 from customer_routes import customer_bp
 from auth_routes import auth_bp
+from api import api_bp
 from flask_login import LoginManager
+from query_budget import init_query_budget
+from principal import init_principal, principals
+from migrations import schema_cli, upgrade
+from rollups import rollups_cli
+from sqlite_profile import init_sqlite, sqlite_engine_options
+from catalog import init_catalog
+from matching import init_matching
+from images import images_cli, init_images
+from assets import assets_cli, init_assets
+from conditional import init_conditional
+from instrumentation import init_instrumentation
+from jobs import init_jobs, jobs_cli
+from proximity import init_proximity, pincodes_cli
+from archive import archive_cli
+from bulk_data import data_cli
+from benchmark import bench_cli
 import os
 
-app = Flask(__name__)
-app.secret_key = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///services.db'
-app.config['SECRET_KEY'] = 'your_secret_key'
-
 # Initialize the LoginManager
 login_manager = LoginManager()
-login_manager.init_app(app)
 
 # Set the login view (redirect to login page if the user is not authenticated)
 login_manager.login_view = 'auth.login'  # Update 'auth.login' to your actual login route
 
-# User loader callback to get the user object based on user_id
+# User loader callback to get the user object based on user_id (served from the principal cache)
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-db.init_app(app)
+    return principals.get('user', int(user_id))
 
 
 # Create or overwrite the admin user
@@ -61,21 +73,70 @@ db.init_app(app)
 #     db.session.commit()
 
 
+def create_app(config=None):
+    """Build the application.
+
+    ``config`` is a profile name ('development', 'testing', 'production'; by
+    default ``APP_ENV``) or a dict of settings applied on top of it. See
+    config.py. The schema is not touched here: run ``flask --app app init-db``
+    once per database.
+    """
+    profile, overrides = (config, None) if isinstance(config, str) else (None, config)
+    app = Flask(__name__)
+    load_config(app, profile, overrides)
+    # WAL, busy timeout and pool sizing for SQLite; see sqlite_profile.py for the SQLITE_* settings
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(app.config)
+
+    login_manager.init_app(app)
+
+    db.init_app(app)
+    init_instrumentation(app)  # first, so the other request hooks are timed too
+    init_sqlite(app)
+    init_catalog(app)
+    init_matching(app)
+    init_images(app)
+    init_assets(app)
+    init_conditional(app)
+    init_jobs(app)
+    init_proximity(app)
+    init_principal(app)
+    init_query_budget(app)
+
+    #Register the blueprint
+    app.register_blueprint(main)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(customer_bp, url_prefix='/customer')
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(professional_bp)
+    app.register_blueprint(api_bp)
+
+    # Schema migrations: flask --app app schema upgrade
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(data_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(pincodes_cli)
+    app.cli.add_command(archive_cli)
+    return app
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create missing tables and apply pending migrations; run once before serving."""
+    db.create_all()  # Create tables if they don't exist
+    if not upgrade(echo=click.echo):  # Bring an existing database up to the current schema
+        click.echo('Schema is up to date.')
 
-#Register the blueprint
-app.register_blueprint(main)
-app.register_blueprint(admin_bp)
-app.register_blueprint(customer_bp, url_prefix='/customer')
-app.register_blueprint(auth_bp)
-app.register_blueprint(professional_bp)
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()  # Create tables if they don't exist
+    # Development server only; in production run gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
     
     # Get port from environment variable, default to 5000 for local development
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
-
-
-
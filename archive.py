@@ -0,0 +1,132 @@
+# archive.py
+"""Move old closed and rejected requests out of the hot ``service_requests`` table.
+
+Open requests are what booking, the dashboards and the status transitions
+work on, but closed and rejected ones pile up behind them forever. Requests
+that were closed or rejected more than ``ARCHIVE_AFTER_DAYS`` (180) days ago
+are moved to ``service_requests_archive``, so the hot table and its indexes
+only grow with recent work.
+
+Each batch is one short write transaction: ``INSERT ... SELECT ... RETURNING``
+copies up to ``batch_size`` requests, oldest first, and a ``DELETE`` removes
+exactly those. Nothing else can write in between, so a request is never in
+both tables or in neither. The archive is a table in the same database
+rather than an ATTACHed file: in WAL mode a transaction that spans two
+database files is not atomic across them.
+
+``close_date`` is the UTC time a request was closed or rejected. Requests
+rejected before rejections recorded it still carry their booking time
+there, so they become due 180 days after booking rather than after the
+rejection; their real rejection time was never stored.
+
+The newest request is never archived. SQLite hands out ``max(req_id) + 1``
+for new requests, so an archived id would otherwise be reused.
+
+Archived requests keep counting in the rollups and ratings, and history
+views show them when asked (``?archived=1``) through
+:class:`models.RequestHistory`. They are read-only: they can no longer be
+rated again.
+
+    flask --app app archive run --days 180
+    flask --app app archive status
+"""
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+
+from models import db, ArchivedServiceRequest, ServiceRequest, HISTORY_REQUEST_STATUSES
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 180
+DEFAULT_BATCH_SIZE = 500
+
+
+def include_archived():
+    """True if the current request asked for archived requests too (``?archived=1``)."""
+    return request.args.get('archived') == '1'
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = current_app.config.get('ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _due(cutoff):
+    newest = db.select(db.func.max(ServiceRequest.req_id)).scalar_subquery()
+    return (
+        ServiceRequest.status.in_(HISTORY_REQUEST_STATUSES),
+        ServiceRequest.close_date < cutoff,
+        ServiceRequest.req_id < newest,
+    )
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Move up to ``batch_size`` requests closed before ``cutoff`` into the archive and commit.
+
+    Returns how many were moved.
+    """
+    hot, archive = ServiceRequest.__table__, ArchivedServiceRequest.__table__
+    columns = [column.name for column in archive.columns if column.name != 'archived_at']
+    rows = (
+        db.select(*(hot.c[name] for name in columns), db.literal(datetime.utcnow(), db.DateTime))
+        .where(*_due(cutoff))
+        .order_by(hot.c.req_id)
+        .limit(batch_size)
+    )
+    try:
+        moved = db.session.execute(
+            archive.insert().from_select(columns + ['archived_at'], rows).returning(archive.c.req_id)
+        ).scalars().all()
+        if moved:
+            db.session.execute(hot.delete().where(hot.c.req_id.in_(moved)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(moved)
+
+
+def archive_old_requests(days=None, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, echo=None):
+    """Archive every request closed more than ``days`` days ago, one batch at a time; returns the total."""
+    cutoff = archive_cutoff(days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        total += moved
+        if echo and moved:
+            echo(f'Archived {total} request(s) so far.')
+        if moved < batch_size:
+            return total
+        time.sleep(pause)  # let web requests have the write lock between batches
+
+
+archive_cli = AppGroup('archive', help='Move old closed and rejected requests to the archive table.')
+
+
+@archive_cli.command('run')
+@click.option('--days', type=click.IntRange(0), default=None,
+              help=f'Archive requests closed more than DAYS days ago '
+                   f'[default: ARCHIVE_AFTER_DAYS, {DEFAULT_ARCHIVE_AFTER_DAYS}].')
+@click.option('--batch-size', type=click.IntRange(1, 5000), default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--pause', type=float, default=0.05, show_default=True, help='Seconds to wait between batches.')
+def run_command(days, batch_size, pause):
+    """Archive old closed and rejected requests in small transactions."""
+    total = archive_old_requests(days, batch_size, pause, echo=click.echo)
+    click.echo(f'Archived {total} request(s).')
+
+
+@archive_cli.command('status')
+@click.option('--days', type=click.IntRange(0), default=None, help='Age to count due requests against.')
+def status_command(days):
+    """Count hot, due and archived requests."""
+    hot = db.session.query(db.func.count(ServiceRequest.req_id)).scalar()
+    due = db.session.query(db.func.count(ServiceRequest.req_id)).filter(*_due(archive_cutoff(days))).scalar()
+    archived, last_run = db.session.query(
+        db.func.count(ArchivedServiceRequest.req_id), db.func.max(ArchivedServiceRequest.archived_at)
+    ).one()
+    click.echo(f'{"hot":<10} {hot:>10}')
+    click.echo(f'{"due":<10} {due:>10}')
+    click.echo(f'{"archived":<10} {archived:>10}' + (f'   last archived {last_run:%Y-%m-%d %H:%M}' if last_run else ''))
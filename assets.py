@@ -0,0 +1,219 @@
+# assets.py
+"""Locally vendored, fingerprinted and precompressed static assets.
+
+jQuery and Bootstrap are vendored under ``static/vendor``, so pages no longer
+depend on three third-party CDNs. ``flask assets build`` does three things:
+
+* concatenates each bundle in :data:`BUNDLES` into one file,
+* copies every file under :data:`FINGERPRINT_DIRS` to a content-hashed name
+  in ``static/dist``,
+* writes a ``.gz`` next to each text asset.
+
+It records the result in ``static/dist/manifest.json``. A build only adds
+files next to the ones already there, and it swaps the manifest in with
+one atomic rename, so pages that running workers have already rendered keep
+working while and after it runs. ``flask assets prune`` later deletes files
+that neither the current build nor the one before it refers to.
+
+Once the manifest exists, ``url_for('static', filename='css/login.css')``
+resolves to the fingerprinted copy. Fingerprinted URLs are served with a
+one-year ``Cache-Control: immutable``, so a repeat page view makes no asset
+requests. Without a build, :func:`bundle_urls` falls back to the individual
+vendored files.
+
+Usage::
+
+    flask --app app assets build
+    flask --app app assets prune
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+# Bundle name -> source files (relative to static/), concatenated in order
+BOOTSTRAP4_CSS = 'vendor/bootstrap-4.5.3/bootstrap.min.css'
+BUNDLES = {
+    'site.css': [BOOTSTRAP4_CSS],
+    'admin_panel.css': [BOOTSTRAP4_CSS],
+    'service_panel.css': [BOOTSTRAP4_CSS, 'css/panel.css'],
+    'user_panel.css': [BOOTSTRAP4_CSS, 'css/panel.css'],
+    'register.css': ['vendor/bootstrap-5.3.8/bootstrap.min.css', 'css/register.css'],
+    # One script bundle for every panel, so it is cached once; Bootstrap's bundle build includes Popper 1.16
+    'panel.js': ['vendor/jquery-3.5.1/jquery.min.js', 'vendor/bootstrap-4.5.3/bootstrap.bundle.min.js'],
+}
+FINGERPRINT_DIRS = ('css', 'image')
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+PREVIOUS_MANIFEST = 'manifest.previous.json'  # kept so prune spares what older pages still link to
+# URL prefixes (under /static) whose file names change whenever their content does
+IMMUTABLE_PREFIXES = (DIST_DIR + '/', 'uploads/services/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_SOURCE_MAP = re.compile(rb'\n?(/\*# sourceMappingURL=[^*]*\*/|//# sourceMappingURL=\S*)\s*$')
+
+_manifest = {'bundles': {}, 'files': {}}
+_manifest_version = ['']
+
+
+def _fingerprinted(relative, content):
+    stem, ext = os.path.splitext(relative)
+    return f'{DIST_DIR}/{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def _replace(path, content):
+    # Readers see the old file or the new one, never a half-written one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+def _write(static_folder, relative, content):
+    path = os.path.join(static_folder, relative)
+    if os.path.isfile(path):
+        return  # the name is the content hash, so it is already there
+    if relative.endswith(COMPRESS_EXTENSIONS):
+        # mtime=0 keeps the .gz byte-identical across builds
+        _replace(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    _replace(path, content)
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'bundles': {}, 'files': {}}
+
+
+def build_assets(static_folder):
+    """Write the current assets into ``static/dist``, switch the manifest over and return it."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {'bundles': {}, 'files': {}}
+
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), 'rb') as f:
+                # Source maps are not vendored; drop the references so browsers do not request them
+                parts.append(_SOURCE_MAP.sub(b'', f.read()))
+        content = (b';\n' if name.endswith('.js') else b'\n').join(parts) + b'\n'
+        target = _fingerprinted(f'bundles/{name}', content)
+        _write(static_folder, target, content)
+        manifest['bundles'][name] = target
+
+    for directory in FINGERPRINT_DIRS:
+        for root, _, files in os.walk(os.path.join(static_folder, directory)):
+            for filename in sorted(files):
+                relative = os.path.relpath(os.path.join(root, filename), static_folder).replace(os.sep, '/')
+                with open(os.path.join(static_folder, relative), 'rb') as f:
+                    content = f.read()
+                target = _fingerprinted(relative, content)
+                _write(static_folder, target, content)
+                manifest['files'][relative] = target
+
+    current = _read_manifest(os.path.join(dist, MANIFEST))
+    if current != manifest and (current['bundles'] or current['files']):
+        _replace(os.path.join(dist, PREVIOUS_MANIFEST), json.dumps(current, indent=2, sort_keys=True).encode())
+    _replace(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def prune_assets(static_folder):
+    """Delete built files that neither the current nor the previous manifest refers to; returns how many."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    keep = {MANIFEST, PREVIOUS_MANIFEST}
+    for name in (MANIFEST, PREVIOUS_MANIFEST):
+        manifest = _read_manifest(os.path.join(dist, name))
+        for target in [*manifest['bundles'].values(), *manifest['files'].values()]:
+            relative = os.path.relpath(os.path.join(static_folder, target), dist)
+            keep.update({relative, relative + '.gz'})
+    removed = 0
+    for root, _, files in os.walk(dist):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if os.path.relpath(path, dist) not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def load_manifest(static_folder):
+    manifest = _read_manifest(os.path.join(static_folder, DIST_DIR, MANIFEST))
+    _manifest.clear()
+    _manifest.update(manifest)
+    _manifest_version[0] = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:12]
+    return manifest
+
+
+def asset_version():
+    """Changes with every asset build that changes a URL, for caches of rendered pages."""
+    return _manifest_version[0]
+
+
+def bundle_urls(name):
+    """URLs to include for bundle ``name``: the built bundle, or its sources before a build."""
+    built = _manifest['bundles'].get(name)
+    sources = [built] if built else BUNDLES[name]
+    return [url_for('static', filename=source) for source in sources]
+
+
+def _fingerprint_static(endpoint, values):
+    # url_for('static', filename=...) picks up the fingerprinted copy when there is one
+    if endpoint == 'static':
+        filename = values.get('filename')
+        if filename in _manifest['files']:
+            values['filename'] = _manifest['files'][filename]
+
+
+def _serve_static(filename):
+    static_folder = current_app.static_folder
+    immutable = filename.startswith(IMMUTABLE_PREFIXES)
+    compressed = os.path.join(static_folder, filename + '.gz')
+    if immutable and 'gzip' in request.accept_encodings and os.path.isfile(compressed):
+        response = send_from_directory(static_folder, filename + '.gz',
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = current_app.send_static_file(filename)
+    if immutable:
+        response.vary.add('Accept-Encoding')
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    load_manifest(app.static_folder)
+    app.url_defaults(_fingerprint_static)
+    app.jinja_env.globals['bundle_urls'] = bundle_urls
+    app.view_functions['static'] = _serve_static
+
+
+assets_cli = AppGroup('assets', help='Build the fingerprinted static assets.')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Bundle, fingerprint and gzip static assets into static/dist."""
+    manifest = build_assets(current_app.static_folder)
+    load_manifest(current_app.static_folder)
+    click.echo(f"Built {len(manifest['bundles'])} bundle(s) and {len(manifest['files'])} fingerprinted file(s).")
+
+
+@assets_cli.command('prune')
+def prune_command():
+    """Delete built files that the current and the previous build no longer use."""
+    removed = prune_assets(current_app.static_folder)
+    click.echo(f'Removed {removed} file(s) from static/dist.')
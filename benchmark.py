@@ -0,0 +1,320 @@
+# benchmark.py
+"""Benchmark harness: drives the app through the Flask test client and compares runs.
+
+Every scenario is one HTTP request made as a sampled account against the
+configured database. The scenarios cover login, the customer dashboard,
+booking, feedback, the professional dashboard, accept and reject, every
+admin home tab and every search mode. Each scenario is run ``--iterations``
+times after ``--warmup`` untimed runs. The harness records:
+
+* p50, p95 and p99 latency;
+* the SQL statements per request, counted on every engine;
+* the peak Python memory of a request, measured with tracemalloc in a few
+  extra runs so it does not slow the timed ones.
+
+Results can be saved as a baseline and later runs compared against it. The
+command exits with status 1 when a scenario got slower than ``--tolerance``
+allows or started running more queries.
+
+Booking, feedback, accept and reject write to the database, so run the
+harness against a seeded copy, never the live ``services.db``::
+
+    flask --app app bench seed instance/bench.db
+    DATABASE_URL=sqlite:///bench.db flask --app app bench run --save-baseline bench-baseline.json
+    DATABASE_URL=sqlite:///bench.db flask --app app bench run --baseline bench-baseline.json
+"""
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from admin_routes import DASHBOARD_TABS
+from models import db, User, ServiceProfessional, Service, ServiceRequest
+from seed_data import seed_database
+
+SAMPLE_SIZE = 500
+DEFAULT_PASSWORD = 'password'
+
+# role: None (anonymous), 'customer', 'professional' or 'admin'
+# make(fixtures, rng) -> (account_id, method, url, form data) for one request
+Scenario = namedtuple('Scenario', 'name role make')
+
+_statements = [0]
+
+
+def _count_statement(*args):
+    _statements[0] += 1
+
+
+class Fixtures:
+    """Accounts, rows and search terms sampled from the database before the run."""
+
+    def __init__(self, rng, sample_size=SAMPLE_SIZE):
+        def ids(query):
+            return [row[0] for row in query.order_by(db.func.random()).limit(sample_size).all()]
+
+        self.admin_id = db.session.query(User.user_id).filter(User.role == 'admin').scalar()
+        self.customers = ids(db.session.query(User.user_id).filter(User.role == 'customer', User.status == 'Active'))
+        self.professionals = ids(db.session.query(ServiceProfessional.prof_id)
+                                 .filter(ServiceProfessional.status == 'APPROVED'))
+        self.services = [row[0] for row in db.session.query(Service.service_id).all()]
+        self.usernames = [row[0] for row in db.session.query(User.username).filter(User.user_id.in_(self.customers))]
+        open_requests = (
+            db.session.query(ServiceRequest.req_id, ServiceRequest.user_id, ServiceRequest.prof_id)
+            .join(User, ServiceRequest.user_id == User.user_id)
+            .filter(ServiceRequest.status == 'Requested', ServiceRequest.prof_id.isnot(None), User.status == 'Active')
+            .order_by(db.func.random())
+            .limit(sample_size * 3)
+            .all()
+        )
+        # Each request can only be closed, accepted or rejected once
+        self.to_close = [(r.user_id, r.req_id) for r in open_requests[0::3]]
+        self.to_accept = [(r.prof_id, r.req_id) for r in open_requests[1::3]]
+        self.to_reject = [(r.prof_id, r.req_id) for r in open_requests[2::3]]
+
+        names = [row[0] for row in db.session.query(User.user_name).filter(User.user_id.in_(self.customers))]
+        pincodes = [row[0] for row in db.session.query(User.pincode).filter(User.user_id.in_(self.customers))]
+        service_names = [row[0] for row in db.session.query(Service.name).all()]
+        self.terms = {
+            'people': [name.split()[0] for name in names if name] or ['a'],
+            'pincodes': pincodes or ['1'],
+            'services': [name.split()[0] for name in service_names if name] or ['a'],
+        }
+        self.rng = rng
+
+    def term(self, kind):
+        return self.rng.choice(self.terms[kind])
+
+
+def _get(url):
+    return lambda f, rng: (None, 'GET', url, None)
+
+
+def _search(role, endpoint, search_by, term_kind):
+    def make(f, rng):
+        account = rng.choice(f.customers if role == 'customer' else f.professionals)
+        return account, 'GET', f'{endpoint}?search_by={search_by}&query={f.term(term_kind)}', None
+    return make
+
+
+def _pop(items):
+    if not items:
+        raise click.ClickException('Ran out of sampled open requests; lower --iterations or seed more data.')
+    return items.pop()
+
+
+def _feedback(f, rng):
+    user_id, req_id = _pop(f.to_close)
+    return user_id, 'POST', f'/customer/service_feedback/{req_id}', {'rating': str(rng.randint(1, 5)),
+                                                                     'remarks': 'benchmark'}
+
+
+def _respond(action, pool):
+    def make(f, rng):
+        prof_id, req_id = _pop(getattr(f, pool))
+        return prof_id, 'GET', f'/{action}/{req_id}', None
+    return make
+
+
+SCENARIOS = [
+    Scenario('login', None, lambda f, rng: (
+        None, 'POST', '/login',
+        {'username': rng.choice(f.usernames), 'password': DEFAULT_PASSWORD, 'role': 'customer'})),
+    Scenario('customer_dashboard', 'customer', lambda f, rng: (
+        rng.choice(f.customers), 'GET', '/customer/dashboard', None)),
+    Scenario('book_service', 'customer', lambda f, rng: (
+        rng.choice(f.customers), 'GET', f'/customer/subcategory/{rng.choice(f.services)}?action=book_service', None)),
+    Scenario('feedback', 'customer', _feedback),
+    Scenario('professional_dashboard', 'professional', lambda f, rng: (
+        rng.choice(f.professionals), 'GET', '/professional_dashboard', None)),
+    Scenario('accept', 'professional', _respond('accept', 'to_accept')),
+    Scenario('reject', 'professional', _respond('reject', 'to_reject')),
+    *(Scenario(f'admin_home_{tab}', 'admin', _get(f'/admin?tab={tab}')) for tab in DASHBOARD_TABS),
+    Scenario('customer_search_services', 'customer',
+             _search('customer', '/customer/search', 'services', 'services')),
+    Scenario('customer_search_professionals', 'customer',
+             _search('customer', '/customer/search', 'professionals', 'people')),
+    Scenario('customer_search_requests', 'customer',
+             _search('customer', '/customer/search', 'requests', 'services')),
+    Scenario('professional_search_customers', 'professional',
+             _search('professional', '/professional_dashboard/search', 'customers', 'people')),
+    Scenario('professional_search_requests', 'professional',
+             _search('professional', '/professional_dashboard/search', 'requests', 'pincodes')),
+    *(Scenario(f'admin_search_{mode}', 'admin', _get(f'/admin_dashboard/search?search_by={mode}&query={query}'))
+      for mode, query in [('services', 'cleaning'), ('customers', 'sharma'),
+                          ('professionals', 'approved'), ('requests', 'closed')]),
+]
+
+
+def _log_in(client, role, account_id, fixtures):
+    with client.session_transaction() as session:
+        session.clear()
+        if role == 'professional':
+            session['prof_id'] = account_id
+            session['role'] = 'service_professional'
+        elif role in ('customer', 'admin'):
+            session['user_id'] = fixtures.admin_id if role == 'admin' else account_id
+            session['role'] = role
+
+
+def _one_request(client, scenario, fixtures, rng):
+    account_id, method, url, data = scenario.make(fixtures, rng)
+    _log_in(client, scenario.role, account_id, fixtures)
+    _statements[0] = 0
+    started = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    response.get_data()  # a streamed page only queries and renders while its body is read
+    elapsed = time.perf_counter() - started
+    response.close()
+    return elapsed, _statements[0], response.status_code < 400
+
+
+def _percentile(cuts, p):
+    return cuts[p - 1] if cuts else None
+
+
+def run_scenario(client, scenario, fixtures, rng, iterations, warmup, memory_runs):
+    for _ in range(warmup):
+        _one_request(client, scenario, fixtures, rng)
+    timings, queries, errors = [], [], 0
+    for _ in range(iterations):
+        elapsed, statements, ok = _one_request(client, scenario, fixtures, rng)
+        timings.append(elapsed * 1000)
+        queries.append(statements)
+        errors += not ok
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(memory_runs):
+            tracemalloc.reset_peak()
+            _one_request(client, scenario, fixtures, rng)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    cuts = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+    return {
+        'n': iterations,
+        'p50_ms': round(_percentile(cuts, 50), 3),
+        'p95_ms': round(_percentile(cuts, 95), 3),
+        'p99_ms': round(_percentile(cuts, 99), 3),
+        'queries': round(statistics.mean(queries), 2),
+        'peak_kib': round(peak / 1024, 1),
+        'errors': errors,
+    }
+
+
+def run_benchmarks(app, iterations=50, warmup=3, memory_runs=3, seed=42, only=None):
+    """Run every scenario (or those named in ``only``) and return ``{name: stats}``."""
+    rng = random.Random(seed)
+    fixtures = Fixtures(rng)
+    client = app.test_client()
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+    try:
+        return {
+            scenario.name: run_scenario(client, scenario, fixtures, rng, iterations, warmup, memory_runs)
+            for scenario in SCENARIOS if not only or scenario.name in only
+        }
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count_statement)
+
+
+def compare(results, baseline, tolerance):
+    """``[(name, message)]`` for scenarios that regressed against ``baseline``."""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'p99_ms', 'peak_kib'):
+            # Ignore sub-millisecond noise on very fast requests
+            if stats[metric] > base[metric] * (1 + tolerance) and stats[metric] - base[metric] > 1:
+                regressions.append((name, f'{metric} {base[metric]} -> {stats[metric]}'))
+        if stats['queries'] > base['queries']:
+            regressions.append((name, f"queries {base['queries']} -> {stats['queries']}"))
+        if stats['errors'] > base['errors']:
+            regressions.append((name, f"errors {base['errors']} -> {stats['errors']}"))
+    return regressions
+
+
+def _delta(value, base):
+    if base is None:
+        return ''
+    if not base:
+        return ' (new)' if value else ''
+    return f' ({(value - base) / base:+.0%})'
+
+
+def format_report(results, baseline=None):
+    baseline = baseline or {}
+    header = f"{'scenario':<32}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}{'queries':>10}{'peak KiB':>18}{'errors':>8}"
+    lines = [header, '-' * len(header)]
+    for name, stats in results.items():
+        base = baseline.get(name, {})
+        cells = [f"{stats[m]:.2f}{_delta(stats[m], base.get(m))}" for m in ('p50_ms', 'p95_ms', 'p99_ms')]
+        lines.append(f'{name:<32}{cells[0]:>16}{cells[1]:>16}{cells[2]:>16}{stats["queries"]:>10}'
+                     f'{str(stats["peak_kib"]) + _delta(stats["peak_kib"], base.get("peak_kib")):>18}'
+                     f'{stats["errors"]:>8}')
+    return '\n'.join(lines)
+
+
+bench_cli = AppGroup('bench', help='Seed benchmark fixtures and run the benchmark harness.')
+
+
+@bench_cli.command('seed')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--users', type=click.IntRange(1), default=100_000, show_default=True)
+@click.option('--professionals', type=click.IntRange(1), default=10_000, show_default=True)
+@click.option('--requests', type=click.IntRange(0), default=1_000_000, show_default=True)
+@click.option('--seed', type=int, default=42, show_default=True)
+@click.option('--password', default=DEFAULT_PASSWORD, show_default=True, help='Password of every seeded account.')
+def seed_command(path, users, professionals, requests, seed, password):
+    """Create a synthetic database at PATH (which must not exist yet)."""
+    started = time.monotonic()
+    try:
+        seed_database(path, users, professionals, requests, seed, password, echo=click.echo)
+    except FileExistsError:
+        raise click.ClickException(f'{path} already exists.')
+    click.echo(f'Seeded {path} in {time.monotonic() - started:.0f}s.')
+
+
+@bench_cli.command('run')
+@click.option('--iterations', type=click.IntRange(2), default=50, show_default=True)
+@click.option('--warmup', type=click.IntRange(0), default=3, show_default=True)
+@click.option('--memory-runs', type=click.IntRange(1), default=3, show_default=True,
+              help='Extra runs per scenario under tracemalloc.')
+@click.option('--seed', type=int, default=42, show_default=True)
+@click.option('--scenario', 'only', multiple=True, help='Run only this scenario (repeatable).')
+@click.option('--baseline', type=click.File(), default=None, help='Compare against a saved baseline.')
+@click.option('--tolerance', type=float, default=0.2, show_default=True,
+              help='Allowed slowdown against the baseline before failing.')
+@click.option('--save-baseline', type=click.Path(dir_okay=False), default=None, help='Write the results here.')
+def run_command(iterations, warmup, memory_runs, seed, only, baseline, tolerance, save_baseline):
+    """Benchmark every scenario against the configured database."""
+    click.echo(f"Benchmarking {current_app.config['SQLALCHEMY_DATABASE_URI']}")
+    results = run_benchmarks(current_app._get_current_object(), iterations, warmup, memory_runs, seed, only)
+    base = json.load(baseline)['scenarios'] if baseline else None
+    click.echo(format_report(results, base))
+
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump({'iterations': iterations, 'seed': seed, 'scenarios': results}, f, indent=2, sort_keys=True)
+        click.echo(f'Saved baseline to {save_baseline}.')
+
+    if base:
+        regressions = compare(results, base, tolerance)
+        for name, message in regressions:
+            click.echo(f'REGRESSION {name}: {message}', err=True)
+        if regressions:
+            raise SystemExit(1)
+        click.echo('No regressions against the baseline.')
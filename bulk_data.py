@@ -0,0 +1,480 @@
+# bulk_data.py
+"""Streaming CSV/JSONL import and export of users, professionals, services and requests.
+
+Imports read the file one line at a time and work in chunks of
+``--batch-size`` rows. Each chunk goes through four steps:
+
+1. Every row is validated, and duplicates and dangling references are checked
+   with one ``IN (...)`` query per column.
+2. Plain-text passwords are hashed across a process pool. Hashing is
+   CPU-bound and dominates an import of accounts.
+3. The whole chunk is inserted with one executemany.
+4. The chunk is committed in its own transaction.
+
+Invalid rows are reported with their line number and skipped. A failed chunk
+rolls back on its own and stops the import, and the chunks before it stay
+committed.
+
+Exports stream rows out of the read-only session with ``yield_per``, so
+memory stays flat however large the table is. An export includes password
+hashes and primary keys, so its output can be imported into another database
+as-is.
+
+Usage::
+
+    flask --app app data import users customers.csv
+    flask --app app data import professionals pros.jsonl --batch-size 1000 --workers 4
+    flask --app app data export requests requests.jsonl
+    flask --app app data export users - > users.csv
+"""
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from catalog import catalog
+from images import DEFAULT_IMAGE
+from matching import matcher
+from models import db, User, ServiceProfessional, Service, ServiceRequest, OPEN_REQUEST_STATUSES
+from rollups import REQUEST_STATUSES, RATINGS, rebuild_rollups
+from sqlite_profile import read_session
+
+DEFAULT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 20
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+# parse(value) -> python value, raising ValueError; default is a value or a callable
+Field = namedtuple('Field', 'name parse required default')
+
+
+class ImportAborted(Exception):
+    """A chunk failed to insert; the chunks before it are committed."""
+
+
+# --- Field parsers ------------------------------------------------------------
+
+def _text(max_length=None):
+    def parse(value):
+        value = str(value)
+        if max_length and len(value) > max_length:
+            raise ValueError(f'longer than {max_length} characters')
+        return value
+    return parse
+
+
+def _choice(*choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"must be one of {', '.join(map(str, choices))}")
+        return value
+    return parse
+
+
+def _integer(value):
+    if isinstance(value, float) or not str(value).lstrip('-').isdigit():
+        raise ValueError('must be a whole number')
+    return int(value)
+
+
+def _rating(value):
+    value = _integer(value)
+    if value not in RATINGS:
+        raise ValueError('must be between 1 and 5')
+    return value
+
+
+def _price(value):
+    value = float(value)
+    if value < 0:
+        raise ValueError('must not be negative')
+    return value
+
+
+def _timestamp(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+# --- Kinds ------------------------------------------------------------------
+
+class DataKind:
+    """How one table is validated, imported and exported.
+
+    ``unique`` columns are checked against the file and the database before a
+    chunk is inserted, and so is each ``(fields, status_field, statuses)`` in
+    ``unique_while``: those fields are unique together among rows whose
+    ``status_field`` is in ``statuses``, like a partial unique index.
+    ``references`` maps a field to the column it must exist in. ``passwords`` adds a write-only ``password`` field next to the
+    ``password_hash`` that exports carry.
+    """
+
+    def __init__(self, model, key, fields, unique=(), unique_while=(), references=None, passwords=False,
+                 after_import=None):
+        self.model = model
+        self.key = key
+        self.fields = [Field(key, _integer, False, None)] + list(fields)
+        self.unique = (key,) + tuple(unique)
+        self.unique_while = tuple(unique_while)
+        self.references = references or {}
+        self.passwords = passwords
+        self.after_import = after_import
+
+    def column(self, name):
+        return getattr(self.model, name)
+
+    def export_names(self):
+        return [field.name for field in self.fields] + (['password_hash'] if self.passwords else [])
+
+    def export_columns(self):
+        columns = [self.column(field.name) for field in self.fields]
+        if self.passwords:
+            columns.append(self.model.password.label('password_hash'))
+        return columns
+
+
+def _after_requests_import():
+    # Imported requests bypass record_status_change, so recount everything
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn)
+    matcher.reset()
+
+
+KINDS = {
+    'users': DataKind(User, 'user_id', [
+        Field('username', _text(255), True, None),
+        Field('user_name', _text(250), True, None),
+        Field('address', _text(), True, None),
+        Field('contact', _text(15), True, None),
+        Field('pincode', _text(10), True, None),
+        Field('status', _choice('Active', 'Blocked'), False, 'Active'),
+        Field('role', _choice('customer', 'admin'), False, 'customer'),
+        Field('date_created', _timestamp, False, datetime.utcnow),
+    ], unique=('username',), passwords=True),
+    'professionals': DataKind(ServiceProfessional, 'prof_id', [
+        Field('username', _text(255), True, None),
+        Field('prof_name', _text(250), True, None),
+        Field('service_type', _text(100), True, None),
+        Field('experience', _text(100), False, ''),
+        Field('address', _text(), True, None),
+        Field('contact', _text(15), True, None),
+        Field('pincode', _text(10), True, None),
+        Field('status', _choice('PENDING', 'APPROVED', 'REJECTED'), False, 'PENDING'),
+        Field('date_created', _timestamp, False, datetime.utcnow),
+    ], unique=('username',), references={'service_type': Service.name}, passwords=True,
+        after_import=matcher.reset),
+    'services': DataKind(Service, 'service_id', [
+        Field('name', _text(100), True, None),
+        Field('description', _text(), False, None),
+        Field('base_price', _price, True, None),
+        Field('image', _text(255), False, 'static/' + DEFAULT_IMAGE),
+        Field('image_variants', _json, False, None),
+        Field('date_created', _timestamp, False, datetime.utcnow),
+    ], after_import=catalog.invalidate),
+    'requests': DataKind(ServiceRequest, 'req_id', [
+        Field('user_id', _integer, True, None),
+        Field('service_id', _integer, True, None),
+        Field('prof_id', _integer, False, None),
+        Field('status', _choice(*REQUEST_STATUSES), False, 'Requested'),
+        Field('rating', _rating, False, None),
+        Field('remarks', _text(255), False, None),
+        Field('requested_date', _timestamp, False, datetime.utcnow),
+        Field('close_date', _timestamp, False, datetime.utcnow),
+    ], unique_while=[(('user_id', 'service_id'), 'status', OPEN_REQUEST_STATUSES)],  # ux_service_requests_open
+        references={'user_id': User.user_id, 'service_id': Service.service_id,
+                   'prof_id': ServiceProfessional.prof_id},
+        after_import=_after_requests_import),
+}
+
+
+# --- Import -----------------------------------------------------------------
+
+def read_records(stream, fmt):
+    """Yield ``(line, record, error)`` from a CSV or JSONL stream, one line at a time."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            record.pop(None, None)  # cells beyond the header
+            yield reader.line_num, record, None
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            yield line, None, f'invalid JSON: {e}'
+            continue
+        if isinstance(record, dict):
+            yield line, record, None
+        else:
+            yield line, None, 'not a JSON object'
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validate(kind, record):
+    """``(row, plain_password)`` for a valid record; raises ValueError naming every problem."""
+    row, errors = {}, []
+    for field in kind.fields:
+        value = record.get(field.name)
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            if field.required:
+                errors.append(f'{field.name} is required')
+            row[field.name] = field.default() if callable(field.default) else field.default
+            continue
+        try:
+            row[field.name] = field.parse(value)
+        except (TypeError, ValueError) as e:
+            errors.append(f'{field.name} {e}')
+
+    password = None
+    if kind.passwords:
+        password_hash = str(record.get('password_hash') or '').strip()
+        if password_hash:
+            if not password_hash.startswith(HASH_PREFIXES):
+                errors.append('password_hash is not a Werkzeug password hash')
+            row['password'] = password_hash
+        elif record.get('password') not in (None, ''):
+            password = str(record['password'])
+        else:
+            errors.append('password or password_hash is required')
+
+    if errors:
+        raise ValueError('; '.join(errors))
+    return row, password
+
+
+def _existing(column, values):
+    values = {value for value in values if value is not None}
+    if not values:
+        return set()
+    return {value for (value,) in db.session.query(column).filter(column.in_(values))}
+
+
+def _existing_while(kind, names, status_field, statuses, keys):
+    if not keys:
+        return set()
+    columns = [kind.column(name) for name in names]
+    return set(
+        db.session.query(*columns)
+        .filter(db.tuple_(*columns).in_(keys), kind.column(status_field).in_(statuses))
+        .all()
+    )
+
+
+def _check_chunk(kind, valid):
+    """``{line: reason}`` for rows that clash with each other or the database, or dangle."""
+    rejected = {}
+    for name in kind.unique:
+        existing = _existing(kind.column(name), (row[name] for _, row, _ in valid))
+        seen = set()
+        for line, row, _ in valid:
+            value = row[name]
+            if value is None:
+                continue
+            if value in existing:
+                rejected.setdefault(line, f'{name} {value!r} already exists')
+            elif value in seen:
+                rejected.setdefault(line, f'{name} {value!r} repeats an earlier row')
+            seen.add(value)
+    for names, status_field, statuses in kind.unique_while:
+        keys = [
+            (line, tuple(row[name] for name in names)) for line, row, _ in valid
+            if row[status_field] in statuses and all(row[name] is not None for name in names)
+        ]
+        existing = _existing_while(kind, names, status_field, statuses, {key for _, key in keys})
+        seen = set()
+        for line, key in keys:
+            described = ', '.join(f'{name} {value!r}' for name, value in zip(names, key))
+            if key in existing:
+                rejected.setdefault(line, f'{described} already has a {"/".join(statuses)} row')
+            elif key in seen:
+                rejected.setdefault(line, f'{described} repeats an earlier {"/".join(statuses)} row')
+            seen.add(key)
+    for name, column in kind.references.items():
+        existing = _existing(column, (row[name] for _, row, _ in valid))
+        for line, row, _ in valid:
+            if row[name] is not None and row[name] not in existing:
+                rejected.setdefault(line, f'{name} {row[name]!r} does not exist')
+    return rejected
+
+
+def _hash_passwords(rows, pool, workers):
+    pending = [(row, password) for row, password in rows if password is not None]
+    if not pending:
+        return
+    passwords = [password for _, password in pending]
+    if pool is None:
+        hashes = map(generate_password_hash, passwords)
+    else:
+        hashes = pool.map(generate_password_hash, passwords, chunksize=max(1, len(passwords) // (workers * 4)))
+    for (row, _), password_hash in zip(pending, hashes):
+        row['password'] = password_hash
+
+
+def import_records(kind, records, batch_size=DEFAULT_BATCH_SIZE, workers=1, report=None, progress=None):
+    """Import ``(line, record, error)`` tuples one transaction per chunk.
+
+    ``report(line, message)`` is called for every skipped row and
+    ``progress(read, imported, skipped)`` after every chunk. Returns
+    ``(imported, skipped)``; raises :class:`ImportAborted` if a chunk fails to
+    insert.
+    """
+    read = imported = skipped = 0
+    pool = ProcessPoolExecutor(workers) if kind.passwords and workers > 1 else None
+    try:
+        for chunk in _chunks(records, batch_size):
+            read += len(chunk)
+            valid = []
+            for line, record, error in chunk:
+                if error is None:
+                    try:
+                        valid.append((line,) + _validate(kind, record))
+                        continue
+                    except ValueError as e:
+                        error = str(e)
+                if report:
+                    report(line, error)
+
+            rejected = _check_chunk(kind, valid)
+            if report:
+                for line, reason in sorted(rejected.items()):
+                    report(line, reason)
+            rows = [(row, password) for line, row, password in valid if line not in rejected]
+            _hash_passwords(rows, pool, workers)
+
+            if rows:
+                try:
+                    db.session.execute(insert(kind.model), [row for row, _ in rows])
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    raise ImportAborted(f'Chunk starting at line {chunk[0][0]} failed, '
+                                        f'{imported} row(s) before it were imported: {e}') from e
+            imported += len(rows)
+            skipped += len(chunk) - len(rows)
+            if progress:
+                progress(read, imported, skipped)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if imported and kind.after_import:
+            kind.after_import()
+    return imported, skipped
+
+
+# --- Export -----------------------------------------------------------------
+
+def export_records(kind, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield every row of ``kind`` as a dict in key order, fetching ``batch_size`` rows at a time."""
+    query = (
+        read_session().query(*kind.export_columns())
+        .order_by(kind.column(kind.key))
+        .yield_per(batch_size)
+    )
+    for row in query:
+        yield row._asdict()
+
+
+def _dump(value, fmt):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if fmt == 'csv' and isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+# --- CLI --------------------------------------------------------------------
+
+def _format_for(path, fmt):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+data_cli = AppGroup('data', help='Bulk import and export of users, professionals, services and requests.')
+
+_kind_argument = click.argument('kind', type=click.Choice(sorted(KINDS)))
+_format_option = click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+                              help='File format; guessed from the extension by default.')
+_batch_option = click.option('--batch-size', type=click.IntRange(1, 5000), default=DEFAULT_BATCH_SIZE,
+                             show_default=True, help='Rows per transaction (import) or per fetch (export).')
+
+
+@data_cli.command('import')
+@_kind_argument
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@_format_option
+@_batch_option
+@click.option('--workers', type=click.IntRange(1), default=os.cpu_count() or 1, show_default='CPU count',
+              help='Processes that hash plain-text passwords.')
+def import_command(kind, path, fmt, batch_size, workers):
+    """Import KIND rows from a CSV or JSONL file at PATH (- for stdin)."""
+    started = time.monotonic()
+    invalid = [0]
+
+    def report(line, message):
+        invalid[0] += 1
+        if invalid[0] <= MAX_REPORTED_ERRORS:
+            click.echo(f'line {line}: {message}', err=True)
+
+    def progress(read, imported, skipped):
+        rate = read / max(time.monotonic() - started, 1e-6)
+        click.echo(f'{kind}: {read} read, {imported} imported, {skipped} skipped ({rate:.0f} rows/s)', err=True)
+
+    with click.open_file(path, encoding='utf-8-sig') as stream:
+        try:
+            imported, skipped = import_records(KINDS[kind], read_records(stream, _format_for(path, fmt)),
+                                               batch_size, workers, report, progress)
+        except ImportAborted as e:
+            raise click.ClickException(str(e))
+    if invalid[0] > MAX_REPORTED_ERRORS:
+        click.echo(f'... and {invalid[0] - MAX_REPORTED_ERRORS} more skipped row(s).', err=True)
+    click.echo(f'Imported {imported} {kind}, skipped {skipped}.')
+
+
+@data_cli.command('export')
+@_kind_argument
+@click.argument('path', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@_format_option
+@_batch_option
+def export_command(kind, path, fmt, batch_size):
+    """Export every KIND row to a CSV or JSONL file at PATH (- for stdout)."""
+    data_kind = KINDS[kind]
+    fmt = _format_for(path, fmt)
+    count = 0
+    # atomic: a failed export never leaves a truncated file behind
+    with click.open_file(path, 'w', encoding='utf-8', atomic=path != '-') as out:
+        if fmt == 'csv':
+            writer = csv.DictWriter(out, fieldnames=data_kind.export_names(), lineterminator='\n')
+            writer.writeheader()
+        for record in export_records(data_kind, batch_size):
+            record = {name: _dump(value, fmt) for name, value in record.items()}
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                out.write(json.dumps(record) + '\n')
+            count += 1
+    click.echo(f'Exported {count} {kind}.', err=True)
@@ -0,0 +1,95 @@
+# catalog.py
+"""Read-through, versioned cache of the service catalog.
+
+Almost every page lists the services, but the catalog only changes through the
+admin add/edit/delete service routes. Each worker keeps an immutable snapshot
+of the ``service`` table and serves it without touching the database. Writers
+call :meth:`ServiceCatalog.invalidate` after committing. That rewrites a stamp
+file in the instance folder, so every worker process sees the change with one
+``stat()`` and reloads on its next read.
+
+The snapshot's ``etag`` is a hash of its contents. It is identical in every
+process and changes only when the catalog does.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+from models import Service
+from sqlite_profile import read_session
+from stamps import read_stamp, touch_stamp
+
+_COLUMNS = [column.name for column in Service.__table__.columns]
+
+# Read-only stand-in for a Service row with the same attribute names
+CatalogEntry = namedtuple('CatalogEntry', _COLUMNS)
+
+
+class CatalogSnapshot:
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.by_id = {entry.service_id: entry for entry in self.entries}
+        payload = json.dumps([list(entry) for entry in self.entries], default=str, separators=(',', ':'))
+        self.etag = hashlib.sha1(payload.encode()).hexdigest()
+        self.version = self.etag[:12]
+
+    def as_dicts(self):
+        return [entry._asdict() for entry in self.entries]
+
+
+class ServiceCatalog:
+    def __init__(self, stamp_path=None):
+        self.stamp_path = stamp_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stamp = None
+
+    def snapshot(self):
+        """The current :class:`CatalogSnapshot`, reloaded only after an invalidation."""
+        stamp = read_stamp(self.stamp_path)
+        snapshot = self._snapshot
+        if snapshot is not None and stamp == self._stamp:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or stamp != self._stamp:
+                rows = read_session().query(*Service.__table__.columns).order_by(Service.service_id).all()
+                self._snapshot = CatalogSnapshot(CatalogEntry(*row) for row in rows)
+                self._stamp = stamp
+            return self._snapshot
+
+    def services(self):
+        return list(self.snapshot().entries)
+
+    def get(self, service_id):
+        return self.snapshot().by_id.get(service_id)
+
+    def names(self):
+        """One entry per distinct service name, for the service type dropdowns."""
+        seen = {}
+        for entry in self.snapshot().entries:
+            seen.setdefault(entry.name, entry)
+        return list(seen.values())
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    def invalidate(self):
+        """Drop this worker's snapshot and tell the other workers to drop theirs."""
+        with self._lock:
+            self._snapshot = None
+            touch_stamp(self.stamp_path)
+
+
+catalog = ServiceCatalog()
+
+
+def init_catalog(app):
+    catalog.stamp_path = app.config.get('CATALOG_STAMP_PATH') or os.path.join(app.instance_path, 'catalog.stamp')
+
+    @app.context_processor
+    def _service_catalog():
+        # Lazy: templates that never touch service_catalog cost nothing
+        return {'service_catalog': catalog}
@@ -0,0 +1,150 @@
+# conditional.py
+"""Conditional GET and gzip for the dashboard and search pages.
+
+Triggers from migration 5 bump a counter in ``table_versions`` on every
+insert, update or delete in the tables the pages read. A view decorated with
+:func:`conditional_view` reads the counters it depends on in a single
+primary-key lookup. It hashes them together with the viewer, the query
+string and the asset build into a weak ETag. A browser that already holds
+that version gets a ``304 Not Modified`` before the view runs any of its own
+queries or renders anything.
+
+A table without a ``table_versions`` row has no triggers either (both come
+from :func:`migrations.create_version_triggers`), as in a database made with
+``db.create_all()`` alone. Its counter would never move, so views that read
+it are served without an ETag until ``flask --app app schema upgrade`` runs.
+
+:func:`init_conditional` also gzips HTML and JSON bodies over
+``GZIP_MIN_SIZE`` bytes for clients that accept it. Streamed pages, whose
+size is not known up front, are compressed as they are sent. The compressor
+is flushed every ``GZIP_STREAM_FLUSH_SIZE`` bytes of input, so the browser
+still gets the top of the page before the rows below it are fetched.
+"""
+import gzip
+import hashlib
+import zlib
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request, session
+
+from assets import asset_version
+from models import TableVersion
+from principal import current_principal
+from sqlite_profile import read_session
+
+# Tables whose changes are counted in table_versions (see migrations 5 and 6)
+VERSIONED_TABLES = ('users', 'service_professionals', 'service', 'service_requests',
+                    'request_rollups', 'rating_rollups')
+GZIP_MIN_SIZE = 1024
+GZIP_STREAM_FLUSH_SIZE = 8192
+GZIP_MIMETYPES = {'text/html', 'application/json', 'text/plain', 'text/csv'}
+
+
+def table_versions(tables):
+    """``{table: version}`` for the ``tables`` that have a counter; untracked tables are left out."""
+    return dict(
+        read_session().query(TableVersion.table_name, TableVersion.version)
+        .filter(TableVersion.table_name.in_(tables))
+        .all()
+    )
+
+
+def _etag_for(tables):
+    """The ETag for the current request, or None if any of ``tables`` is not tracked."""
+    versions = table_versions(tables)
+    if len(versions) < len(tables):
+        return None
+    principal = current_principal()
+    parts = [
+        current_app.config.get('ETAG_SALT', ''),
+        asset_version(),
+        request.endpoint,
+        request.query_string.decode('latin-1'),
+        f'{principal.kind}:{principal.id}:{principal.role}',
+        datetime.utcnow().date().isoformat(),  # summaries count "today" and the last 14 days
+        *(f'{table}={versions[table]}' for table in sorted(versions)),
+    ]
+    return hashlib.sha1('\x1f'.join(parts).encode()).hexdigest()
+
+
+def conditional_view(*tables):
+    """Answer repeat GETs with 304 while none of ``tables`` has changed.
+
+    Costs one indexed query on every request, which the view's query budget
+    must allow for. Skipped for anonymous users and while flashed messages are
+    waiting to be shown, since the page would then differ without any table
+    changing.
+    """
+    for table in tables:
+        if table not in VERSIONED_TABLES:
+            raise ValueError(f'{table} has no version counter')
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (request.method != 'GET' or current_principal() is None or session.get('_flashes')
+                    or not current_app.config.get('CONDITIONAL_GET_ENABLED', True)):
+                return view(*args, **kwargs)
+
+            etag = _etag_for(tables)
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)  # weak: the gzip and identity bodies differ
+            response.cache_control.private = True
+            response.cache_control.no_cache = True  # always revalidate, which is cheap
+            return response
+        return wrapper
+    return decorator
+
+
+def _gzip_stream(chunks, level, flush_size):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip header and trailer
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _gzip_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in GZIP_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response, current_app.config.get('GZIP_LEVEL', 6),
+                                         current_app.config.get('GZIP_STREAM_FLUSH_SIZE', GZIP_STREAM_FLUSH_SIZE))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers.pop('Content-Length', None)
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config.get('GZIP_MIN_SIZE', GZIP_MIN_SIZE):
+        return response
+    response.set_data(gzip.compress(body, compresslevel=current_app.config.get('GZIP_LEVEL', 6)))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_conditional(app):
+    app.after_request(_gzip_response)
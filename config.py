@@ -0,0 +1,56 @@
+# config.py
+"""Configuration profiles for :func:`app.create_app`.
+
+``APP_ENV`` picks the profile: ``development`` (the default), ``testing`` or
+``production``. Settings are applied in this order, later ones winning:
+
+1. ``BASE_CONFIG``, then the profile's entries;
+2. ``SECRET_KEY`` and ``DATABASE_URL`` from the environment;
+3. any ``FLASK_<NAME>`` environment variable, as setting ``<NAME>``. Values
+   are parsed as JSON when they can be, e.g. ``FLASK_JOBS_WORKER_THREADS=0``
+   or ``FLASK_SQLITE_READONLY_POOL=false``;
+4. the overrides passed to ``create_app``.
+
+Production refuses to start without a real ``SECRET_KEY``, so sessions are
+never signed with the development key.
+"""
+import os
+
+DEFAULT_PROFILE = 'development'
+DEVELOPMENT_SECRET_KEY = 'your_secret_key'
+
+BASE_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///services.db',  # relative paths resolve in the instance folder
+    'SECRET_KEY': DEVELOPMENT_SECRET_KEY,
+}
+
+CONFIG_PROFILES = {
+    'development': {},
+    'testing': {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db',
+        'JOBS_WORKER_THREADS': 0,  # tests run jobs themselves with JobWorker.run_pending()
+    },
+    'production': {
+        'SECRET_KEY': None,  # must come from the environment
+        'PREFERRED_URL_SCHEME': 'https',
+    },
+}
+
+
+def load_config(app, profile=None, overrides=None):
+    """Fill ``app.config`` from ``profile`` (default: ``APP_ENV``), the environment and ``overrides``."""
+    profile = profile or os.environ.get('APP_ENV', DEFAULT_PROFILE)
+    if profile not in CONFIG_PROFILES:
+        raise ValueError(f'Unknown config profile {profile!r}; expected one of {", ".join(CONFIG_PROFILES)}')
+    app.config.from_mapping(BASE_CONFIG)
+    app.config.from_mapping(CONFIG_PROFILES[profile])
+    for setting, variable in [('SECRET_KEY', 'SECRET_KEY'), ('SQLALCHEMY_DATABASE_URI', 'DATABASE_URL')]:
+        if os.environ.get(variable):
+            app.config[setting] = os.environ[variable]
+    app.config.from_prefixed_env()
+    app.config.update(overrides or {})
+    app.config['APP_ENV'] = profile
+
+    if profile == 'production' and app.config.get('SECRET_KEY') in (None, '', DEVELOPMENT_SECRET_KEY):
+        raise RuntimeError('Set SECRET_KEY in the environment to run with the production profile')
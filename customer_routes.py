@@ -1,34 +1,53 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session
-from models import db, Service, ServiceRequest, ServiceProfessional, User # Import necessary models
+from models import db, Service, ServiceRequest, ServiceProfessional, User, OPEN_REQUEST_STATUSES, request_history_model # Import necessary models
 from datetime import datetime
 from flask_login import login_required, current_user
+from archive import include_archived
+from catalog import catalog
+from conditional import conditional_view
+from matching import matcher
+from principal import current_principal, principals
+from proximity import MAX_RADIUS_KM, NEAR_RADIUS_KM, centroids
+from rollups import record_rating, record_status_change, status_counts
+from query_budget import query_budget
+from search_index import SEARCH_RESULT_LIMIT, fts_match, fts_query, match_status
+from sqlite_profile import read_session
 
 
 customer_bp = Blueprint('customer', __name__)
 
+TOP_RATED_LIMIT = 5
+
 # Route for viewing the customer dashboard
 @customer_bp.route('/dashboard')
+@query_budget(3)  # one more when this worker's catalog snapshot is cold
+@conditional_view('service_requests', 'service_professionals', 'service')
 def dashboard():
     user_id = session.get('user_id')
     if not user_id:
         flash('You must log in to access the dashboard.', 'danger')
         return redirect(url_for('main.login'))  # Replace with your login route
 
-    # Fetch service history for the current user
-    service_history = ServiceRequest.query.filter_by(user_id=user_id).all()
+    # Fetch service history for the current user, with service and professional joined in;
+    # archived requests only when asked for
+    archived = include_archived()
+    history_model = request_history_model(archived)
+    service_history = history_model.query_with_details(read_session()).filter_by(user_id=user_id).all()
 
     # Query all available services
-    services = Service.query.all()
+    services = catalog.services()
 
     return render_template(
         'user_panel/customer_dashboard.html',
         services=services,
-        service_history=service_history
+        service_history=service_history,
+        archived=archived
     )
 
 
 # Route for closing a service request
 @customer_bp.route('/service_feedback/<int:request_id>', methods=['GET', 'POST'])
+@query_budget(4)
 def service_feedback(request_id):
     # Check if the user is logged in
     user_id = session.get('user_id')
@@ -37,7 +56,7 @@ def service_feedback(request_id):
         return redirect(url_for('main.login'))  # Replace 'main.login' with your login route
 
     # Fetch the service request
-    service_request = ServiceRequest.query.get_or_404(request_id)
+    service_request = ServiceRequest.query_with_details().filter_by(req_id=request_id).first_or_404()
 
     # Ensure that the logged-in user owns the service request
     if service_request.user_id != user_id:
@@ -54,12 +73,18 @@ def service_feedback(request_id):
             flash('Invalid rating. Please select a valid rating between 1 and 5.', 'danger')
             return redirect(url_for('customer.service_feedback', request_id=request_id))
 
-        # Update the service request with feedback
-        service_request.rating = int(rating)
-        service_request.remarks = remarks
-        service_request.status = 'Closed'  # Update status to "Closed"
-        service_request.close_date = datetime.now()  # Record closure date
+        # Close the service request with the feedback, unless it was rejected or changed meanwhile
+        old_status, old_rating, prof_id = service_request.status, service_request.rating, service_request.prof_id
+        was_open = old_status in OPEN_REQUEST_STATUSES
+        if not service_request.transition('Closed', rating=int(rating), remarks=remarks, close_date=datetime.utcnow()):
+            db.session.rollback()
+            flash(f'This service request is {service_request.status} and cannot be closed.', 'warning')
+            return redirect(url_for('customer.dashboard'))
+        record_status_change(service_request, old_status, 'Closed')
+        record_rating(service_request, int(rating), old_rating)
         db.session.commit()
+        if was_open:
+            matcher.request_closed(prof_id)
 
         flash('Your feedback has been submitted successfully!', 'success')
         return redirect(url_for('customer.dashboard'))
@@ -75,9 +100,10 @@ def service_feedback(request_id):
 #Sub-Category
 
 @customer_bp.route('/subcategory/<int:service_id>', methods=['GET'])
+@query_budget(8)
 def subcategory(service_id):
     # Fetch the selected service
-    service = Service.query.get(service_id)
+    service = catalog.get(service_id)
     if not service:
         flash("Service not found!", "error")
         return redirect(url_for('customer.dashboard'))
@@ -88,20 +114,11 @@ def subcategory(service_id):
         return redirect(url_for('main.login'))  # Redirect to login page
 
     if request.args.get('action') == 'book_service':
-        prof_id = None  # Initialize prof_id to None
-
-        # Check if the service has already been requested by the user
-        existing_request = ServiceRequest.query.filter_by(service_id=service_id, user_id=user_id, status='Requested').first()
-        if existing_request:
-            flash('This service has already been requested.', 'warning')
-            return redirect(url_for('customer.subcategory', service_id=service_id))
-
-        # Fetch a professional dynamically (adjust this query as needed)
-        professional = ServiceProfessional.query.filter_by(service_type=service.name).first()  # Ensure 'service.name' exists in both models
-        if professional:
-            prof_id = professional.prof_id
+        # Assign the least-loaded approved professional closest to the customer (None if nobody offers it)
+        customer = current_principal()
+        prof_id = matcher.assign(service.name, customer.pincode if customer else None)
 
-        # Create a new service request
+        # Create a new service request, unless one is already open (a double click lands here)
         new_request = ServiceRequest(
             service_id=service_id,
             user_id=user_id,
@@ -110,25 +127,42 @@ def subcategory(service_id):
             requested_date=datetime.utcnow()
         )
         try:
-            db.session.add(new_request)
-            db.session.commit()
-            flash(f'The {service.name} service has been successfully requested!', 'success')
+            if new_request.book():
+                record_status_change(new_request, None, 'Requested')
+                db.session.commit()
+                flash(f'The {service.name} service has been successfully requested!', 'success')
+            else:
+                db.session.rollback()
+                matcher.request_closed(prof_id)
+                flash('This service has already been requested.', 'warning')
         except Exception as e:
             db.session.rollback()
+            matcher.request_closed(prof_id)
             flash(f'Error requesting the service: {str(e)}', 'danger')
 
         # Stay on the same subcategory page after booking
         return redirect(url_for('customer.subcategory', service_id=service_id))
 
     # Fetch related services and service history
-    services = Service.query.filter(Service.service_id == service_id).all()
-    service_history = ServiceRequest.query.filter_by(service_id=service_id, user_id=user_id).all()
+    services = [service]
+    service_history = ServiceRequest.query_with_details().filter_by(service_id=service_id, user_id=user_id).all()
+
+    # Best-rated approved professionals: one backwards range read of ix_service_professionals_type_status_score
+    top_rated = (
+        read_session().query(ServiceProfessional.prof_name, ServiceProfessional.experience,
+                             ServiceProfessional.rating_score, ServiceProfessional.rating_count)
+        .filter(ServiceProfessional.service_type == service.name, ServiceProfessional.status == 'APPROVED')
+        .order_by(ServiceProfessional.rating_score.desc(), ServiceProfessional.prof_id.desc())
+        .limit(TOP_RATED_LIMIT)
+        .all()
+    )
 
     return render_template(
         'user_panel/subcategory.html',
         service=service,
         services=services,
-        service_history=service_history
+        service_history=service_history,
+        top_rated=top_rated
     )
 
 
@@ -136,10 +170,13 @@ def subcategory(service_id):
 #Search
 
 @customer_bp.route('/search', methods=['GET'])
+@query_budget(6)  # near me with a cold catalog snapshot and matcher; the other modes run at most 3
+@conditional_view('service_requests', 'service_professionals', 'service', 'users')  # users: near me uses your pincode
 def search():
     search_by = request.args.get('search_by')
     query = request.args.get('query', '').strip().lower()
-    services = Service.query.all()
+    reader = read_session()
+    services = catalog.services()
 
     # Get the logged-in user's ID
     user_id = session.get('user_id')  # Assuming `user_id` is stored in the session
@@ -148,38 +185,69 @@ def search():
         flash("Please log in to view your data.", "danger")
         return redirect(url_for('customer.login'))
 
-    if search_by == "services":
-        # Search for services the customer has requested
+    # Everything the customer can find is scoped to their own requests
+    own_requests = db.select(ServiceRequest.service_id, ServiceRequest.prof_id).where(ServiceRequest.user_id == user_id)
+
+    if not fts_query(query):
+        results = []
+    elif search_by == "services":
+        # Full-text search over the services the customer has requested
+        matches = fts_match('service_fts', query)
         results = (
-            db.session.query(ServiceRequest)
-            .join(Service, ServiceRequest.service_id == Service.id)
-            .filter(
-                ServiceRequest.user_id == user_id,  # Restrict to logged-in user
-                Service.name.contains(query)
-            )
+            reader.query(Service)
+            .join(matches, Service.service_id == matches.c.rowid)
+            .filter(Service.service_id.in_(own_requests.with_only_columns(ServiceRequest.service_id)))
+            .order_by(matches.c.rank)
+            .limit(SEARCH_RESULT_LIMIT)
             .all()
         )
     elif search_by == "professionals":
-        # Search for professionals associated with services the customer has requested
+        # Full-text search over professionals associated with services the customer has requested
+        matches = fts_match('professionals_fts', query)
         results = (
-            db.session.query(ServiceProfessional)
-            .join(ServiceRequest, ServiceRequest.prof_id == ServiceProfessional.prof_id)
-            .filter(
-                ServiceRequest.user_id == user_id,  # Restrict to logged-in user
-                ServiceProfessional.prof_name.contains(query)
-            )
+            reader.query(ServiceProfessional)
+            .join(matches, ServiceProfessional.prof_id == matches.c.rowid)
+            .filter(ServiceProfessional.prof_id.in_(own_requests.with_only_columns(ServiceRequest.prof_id)))
+            .order_by(matches.c.rank)
+            .limit(SEARCH_RESULT_LIMIT)
             .all()
         )
     elif search_by == "requests":
-        # Search for service requests by their status
-        results = (
-            ServiceRequest.query
-            .filter(
-                ServiceRequest.user_id == user_id,  # Restrict to logged-in user
-                ServiceRequest.status.contains(query)
+        # Search the customer's requests by status, or by service or professional name
+        requests = (
+            reader.query(
+                ServiceRequest.req_id,
+                ServiceProfessional.prof_name,
+                ServiceRequest.requested_date,
+                ServiceRequest.status,
+                ServiceRequest.rating,
             )
-            .all()
+            .outerjoin(ServiceProfessional, ServiceRequest.prof_id == ServiceProfessional.prof_id)
+            .filter(ServiceRequest.user_id == user_id)  # Restrict to logged-in user
         )
+        status = match_status(query, ['Requested', 'Accepted', 'Rejected', 'Closed'])
+        if status:
+            requests = requests.filter(ServiceRequest.status == status)
+        else:
+            service_matches = db.select(fts_match('service_fts', query).c.rowid)
+            professional_matches = db.select(fts_match('professionals_fts', query).c.rowid)
+            requests = requests.filter(db.or_(
+                ServiceRequest.service_id.in_(service_matches),
+                ServiceRequest.prof_id.in_(professional_matches),
+            ))
+        results = requests.order_by(ServiceRequest.req_id.desc()).limit(SEARCH_RESULT_LIMIT).all()
+    elif search_by == "nearby":
+        # Approved professionals offering the matching services, nearest to the customer's pincode first
+        radius = min(max(request.args.get('radius', NEAR_RADIUS_KM, type=float), 1), MAX_RADIUS_KM)
+        service_ids = reader.execute(db.select(fts_match('service_fts', query).c.rowid)).scalars()
+        service_types = {entry.name for entry in map(catalog.get, service_ids) if entry}
+        customer = current_principal()
+        nearby = matcher.nearby(service_types, customer.pincode, radius, limit=SEARCH_RESULT_LIMIT)
+        professionals = {}
+        if nearby:
+            rows = reader.query(ServiceProfessional).filter(ServiceProfessional.prof_id.in_([p for _, p in nearby]))
+            professionals = {professional.prof_id: professional for professional in rows}
+        results = [(professionals[prof_id], distance) for distance, prof_id in nearby if prof_id in professionals]
     else:
         results = []
 
@@ -189,22 +257,32 @@ def search():
         results=results,
         search_by=search_by,
         query=query,
-        services=services
+        services=services,
+        nearby_available=centroids.available
     )
 
 
 @customer_bp.route('/summary')
+@query_budget(2)
+@conditional_view('request_rollups')
 def summary():
-    return render_template('user_panel/summary.html')
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("You must be logged in to view your summary.", "danger")
+        return redirect(url_for('main.login'))
+
+    # Read straight from the rollups instead of counting service_requests
+    counts = status_counts('customer', user_id)
+    return render_template('user_panel/summary.html', counts=counts, total=sum(counts.values()))
 
 @customer_bp.route('/profile', methods=['GET', 'POST'])
 def profile():
-    user_id = session.get('user_id')  # Fetch logged-in user's ID from the session
-    if not user_id:
+    principal = current_principal()  # Resolved once per request from the principal cache
+    if not principal or principal.kind != 'user':
         flash("You must be logged in to update your profile.", "danger")
         return redirect(url_for('main.login'))  # Redirect to login if not logged in
 
-    user = User.query.get_or_404(user_id)  # Fetch the user's details
+    user = User.query.get_or_404(principal.id)  # Fetch the user's details for the form
 
     if request.method == 'POST':
         # Update the user's profile details
@@ -219,6 +297,7 @@ def profile():
             user.password = request.form['password']  # Add proper password hashing!
 
         db.session.commit()
+        principals.invalidate('user', user.user_id)  # Username or pincode may have changed
         flash("Profile updated successfully!", "success")
         return redirect(url_for('main.customer_dashboard'))
 
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+"""Gunicorn settings for serving ``wsgi:app`` on every core.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is imported once in the master (``preload_app``) and the workers are
+forked from it, so they start in milliseconds and share its memory pages.
+Each worker then drops any database connection it inherited
+(:func:`sqlite_profile.dispose_engines`), and starts its own job worker
+threads on its first request.
+
+SQLite allows one writer at a time no matter how many processes there are;
+WAL and the busy timeout in sqlite_profile.py queue them. Reads scale with
+the workers.
+
+Environment: ``PORT`` (5000), ``WEB_CONCURRENCY`` (workers, default
+2 x cores + 1), ``GUNICORN_THREADS`` (threads per worker, 4) and
+``GUNICORN_TIMEOUT`` (seconds, 30).
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+
+# Recycle workers now and then so a slow leak cannot grow without bound
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading belong to the master
+    from sqlite_profile import dispose_engines
+    dispose_engines(server.app.wsgi())
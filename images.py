@@ -0,0 +1,212 @@
+# images.py
+"""Upload pipeline for service images.
+
+An upload is streamed to a temporary file in 64 KiB chunks. The stream is
+capped at ``SERVICE_IMAGE_MAX_BYTES`` and hashed with SHA-256 as it goes. The
+image is then decoded once with Pillow and written as thumb/card/full
+variants in JPEG and WebP under a directory named after its hash::
+
+    static/uploads/services/ab/ab12.../card.jpg
+
+Uploading the same picture twice reuses the existing directory, and two
+different files called ``photo.jpg`` can no longer overwrite each other. The
+returned manifest is stored on ``Service.image_variants``, and the
+``service_picture`` macro turns it into a responsive ``<picture>``.
+
+Usage::
+
+    flask --app app images backfill
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from PIL import Image, ImageOps
+
+from catalog import catalog
+from models import db, Service
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+# Variant name -> longest edge in pixels (never upscaled)
+VARIANT_SIZES = {'thumb': 160, 'card': 480, 'full': 1200}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_IMAGE = 'uploads/default-service-image.jpg'
+
+
+class ImageUploadError(ValueError):
+    """The upload is too large, not an image, or in an unsupported format."""
+
+
+def _services_root():
+    return os.path.join(current_app.static_folder, 'uploads', 'services')
+
+
+def _stream_to_temp(stream, directory, max_bytes):
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageUploadError(f'Image is larger than {max_bytes // (1024 * 1024)} MB.')
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    if size == 0:
+        os.remove(temp_path)
+        raise ImageUploadError('The uploaded image is empty.')
+    return temp_path, digest.hexdigest()
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent images onto white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _write_variants(source_path, target_dir):
+    try:
+        with Image.open(source_path) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ImageUploadError('Only PNG, JPG, JPEG, GIF and WebP images are allowed.')
+            image.seek(0)  # first frame of animated GIF/WebP
+            image = _flatten(ImageOps.exif_transpose(image))
+    except (Image.DecompressionBombError, OSError) as e:
+        raise ImageUploadError('The uploaded file is not a readable image.') from e
+
+    width, height = image.size
+    variants = {}
+    for name, edge in VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((edge, edge), Image.LANCZOS)
+        base = os.path.join(target_dir, name)
+        variant.save(base + '.jpg', 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        variant.save(base + '.webp', 'WEBP', quality=WEBP_QUALITY, method=4)
+        variants[name] = {'width': variant.width, 'height': variant.height}
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _manifest(digest, info):
+    prefix = f'uploads/services/{digest[:2]}/{digest}'
+    return {
+        'sha256': digest,
+        'width': info['width'],
+        'height': info['height'],
+        'variants': {
+            name: dict(size, jpeg=f'{prefix}/{name}.jpg', webp=f'{prefix}/{name}.webp')
+            for name, size in info['variants'].items()
+        },
+    }
+
+
+def process_image(stream, max_bytes=None):
+    """Store an uploaded image stream and return its variant manifest.
+
+    Raises :class:`ImageUploadError` for anything that is not a usable image.
+    """
+    max_bytes = max_bytes or current_app.config.get('SERVICE_IMAGE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    root = _services_root()
+    os.makedirs(root, exist_ok=True)
+    temp_path, digest = _stream_to_temp(stream, root, max_bytes)
+    try:
+        target_dir = os.path.join(root, digest[:2], digest)
+        manifest_path = os.path.join(target_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                return json.load(f)  # same content uploaded before
+
+        # Build in a scratch directory and rename it into place, so readers never see half a set
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        scratch = tempfile.mkdtemp(dir=root, suffix='.variants')
+        try:
+            manifest = _manifest(digest, _write_variants(temp_path, scratch))
+            with open(os.path.join(scratch, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+            try:
+                os.rename(scratch, target_dir)
+            except OSError:
+                if not os.path.exists(manifest_path):  # not a concurrent upload of the same file
+                    raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        return manifest
+    finally:
+        os.remove(temp_path)
+
+
+def process_file(path, max_bytes=None):
+    with open(path, 'rb') as f:
+        return process_image(f, max_bytes=max_bytes)
+
+
+def legacy_image_path(service_image):
+    """Filesystem path of a pre-pipeline ``Service.image`` value such as ``static/uploads/x.jpg``."""
+    relative = service_image[len('static/'):] if service_image.startswith('static/') else service_image
+    return os.path.join(current_app.static_folder, relative)
+
+
+_default_manifest = {}
+
+
+def default_image_manifest():
+    """Variants of the placeholder image, once ``flask images backfill`` has produced them."""
+    if 'manifest' not in _default_manifest:
+        path = os.path.join(_services_root(), 'default.json')
+        try:
+            with open(path) as f:
+                _default_manifest['manifest'] = json.load(f)
+        except FileNotFoundError:
+            return None  # not cached, so a later backfill is picked up
+    return _default_manifest['manifest']
+
+
+def init_images(app):
+    # Reject oversized request bodies before Werkzeug spools them to disk
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = 2 * app.config.get('SERVICE_IMAGE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    app.jinja_env.globals['default_image_manifest'] = default_image_manifest
+
+
+images_cli = AppGroup('images', help='Maintain service image variants.')
+
+
+@images_cli.command('backfill')
+@click.option('--force', is_flag=True, help='Regenerate variants for services that already have them.')
+def backfill_command(force):
+    """Generate variants for services uploaded before the image pipeline existed."""
+    manifest = process_file(os.path.join(current_app.static_folder, DEFAULT_IMAGE), max_bytes=2**31)
+    with open(os.path.join(_services_root(), 'default.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    done = failed = 0
+    for service in Service.query.filter(Service.image.isnot(None)).all():
+        if service.image_variants and not force:
+            continue
+        try:
+            service.image_variants = process_file(legacy_image_path(service.image), max_bytes=2**31)
+            done += 1
+        except (ImageUploadError, OSError) as e:
+            failed += 1
+            click.echo(f'Service {service.service_id} ({service.image}): {e}', err=True)
+    db.session.commit()
+    catalog.invalidate()
+    click.echo(f'Backfilled {done} service image(s), {failed} failed.')
@@ -0,0 +1,190 @@
+# instrumentation.py
+"""Per-request SQL and template timing, the Server-Timing header and a slow-query log.
+
+Cursor hooks on every engine time each SQL statement, and Flask's template
+signals time each ``render_template``. Both add to totals kept on ``g`` for
+the current request. After the request these happen:
+
+* the totals are sent as a ``Server-Timing`` header, which browser devtools
+  show next to the request;
+* the totals are added to per-endpoint aggregates in this process, which the
+  admin performance page ranks;
+* statements slower than ``SLOW_QUERY_MS`` have already been logged to the
+  ``slow_query`` logger while they ran. Each entry has the statement, its
+  parameters and SQLite's ``EXPLAIN QUERY PLAN``. The most recent ones are
+  also kept in memory for the admin page.
+
+Streamed pages (``stream_template``) keep counting while the body is sent
+and are added to the aggregates once it has been. Their header can only
+cover the time up to the headers.
+
+Settings: ``INSTRUMENTATION_ENABLED`` (default on), ``SERVER_TIMING_ENABLED``
+(default on) and ``SLOW_QUERY_MS`` (default 100).
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_QUERY_MS = 100
+SLOW_QUERY_HISTORY = 50
+
+slow_query_log = logging.getLogger('slow_query')
+
+
+class EndpointStats:
+    """Running totals of every request one worker process has served, by endpoint."""
+
+    FIELDS = ('requests', 'total_ms', 'db_ms', 'queries', 'render_ms', 'max_ms')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_HISTORY)
+        self.since = time.time()
+
+    def record(self, endpoint, total_ms, db_ms, queries, render_ms):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, dict.fromkeys(self.FIELDS, 0))
+            stats['requests'] += 1
+            stats['total_ms'] += total_ms
+            stats['db_ms'] += db_ms
+            stats['queries'] += queries
+            stats['render_ms'] += render_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+
+    def top(self, key, limit=15):
+        """``[(endpoint, stats)]`` with the largest ``key`` total first, plus per-request means."""
+        with self._lock:
+            rows = [(endpoint, dict(stats)) for endpoint, stats in self._stats.items()]
+        for _, stats in rows:
+            for field in ('total_ms', 'db_ms', 'queries', 'render_ms'):
+                stats[f'avg_{field}'] = stats[field] / stats['requests']
+        return sorted(rows, key=lambda row: row[1][key], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries.clear()
+            self.since = time.time()
+
+
+endpoint_stats = EndpointStats()
+
+
+def _enabled():
+    return has_request_context() and 'timing_started' in g
+
+
+# --- SQL --------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _enabled() and context is not None:
+        # On the statement's own context, so a statement that raises leaves nothing behind
+        context._query_started = time.perf_counter()
+
+
+def _explain(cursor, statement, parameters):
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        # Straight on the DB-API connection, so this is neither counted nor timed
+        rows = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+    except Exception as e:  # a plan is a nice-to-have; never fail the request over it
+        return f'(no plan: {e})'
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None or not _enabled():
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    g.db_ms += elapsed_ms
+    g.db_queries += 1
+
+    threshold = current_app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    if threshold is not None and elapsed_ms >= threshold:
+        plan = None if executemany else _explain(cursor, statement, parameters)
+        entry = {
+            'at': time.time(),
+            'endpoint': request.endpoint,
+            'ms': elapsed_ms,
+            'statement': statement,
+            'parameters': repr(parameters)[:500],
+            'plan': plan,
+        }
+        endpoint_stats.slow_queries.appendleft(entry)
+        slow_query_log.warning('%.1f ms in %s: %s\nparameters: %s\nplan:\n%s',
+                               elapsed_ms, request.endpoint, statement, entry['parameters'], plan or '-')
+
+
+# --- Templates --------------------------------------------------------------
+
+def _before_render(sender, template, context, **extra):
+    if _enabled():
+        g.render_started.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    if _enabled() and g.render_started:
+        g.render_ms += (time.perf_counter() - g.render_started.pop()) * 1000
+
+
+# --- Requests ---------------------------------------------------------------
+
+def _start_timing():
+    if not current_app.config.get('INSTRUMENTATION_ENABLED', True) or request.endpoint == 'static':
+        return
+    g.timing_started = time.perf_counter()
+    g.db_ms = 0.0
+    g.db_queries = 0
+    g.render_ms = 0.0
+    g.render_started = []
+
+
+def _record(endpoint, timings):
+    total_ms = (time.perf_counter() - timings.pop('timing_started')) * 1000
+    endpoint_stats.record(endpoint, total_ms, timings.db_ms, timings.db_queries, timings.render_ms)
+    return total_ms
+
+
+def _finish_timing(response):
+    if not _enabled():
+        return response
+    endpoint = request.endpoint or '(unmatched)'
+    if response.is_streamed:
+        # A streamed template queries and renders while the body is sent, after this
+        # hook: the header can only cover the time to headers, the stats the lot
+        timings = g._get_current_object()
+        response.call_on_close(lambda: _record(endpoint, timings))
+        total_ms = (time.perf_counter() - g.timing_started) * 1000
+        header = (f'db;dur={g.db_ms:.1f};desc="{g.db_queries} queries before streaming", '
+                  f'headers;dur={total_ms:.1f}')
+    else:
+        total_ms = _record(endpoint, g)
+        header = (f'db;dur={g.db_ms:.1f};desc="{g.db_queries} queries", render;dur={g.render_ms:.1f}, '
+                  f'total;dur={total_ms:.1f}')
+    if current_app.config.get('SERVER_TIMING_ENABLED', True):
+        response.headers.add('Server-Timing', header)
+    return response
+
+
+def init_instrumentation(app):
+    """Time SQL and templates for every request.
+
+    Call this before the other ``init_*`` functions so that their
+    ``before_request`` hooks (such as the principal lookup) are timed too.
+    """
+    for name, listener in [('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)]:
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_timing)
+    app.after_request(_finish_timing)
@@ -0,0 +1,299 @@
+# jobs.py
+"""Durable background jobs for work that can wait until after a request commits.
+
+:func:`enqueue` adds a row to ``jobs`` in the caller's session. The job is
+committed or rolled back together with the change that caused it, so a
+request never loses a job it committed and never runs one it rolled back.
+The request itself just returns.
+
+A worker claims the oldest due job with one atomic ``UPDATE ... RETURNING``,
+so any number of threads and processes can share the queue. It then runs the
+registered handler. The handler's writes and the job's ``done`` mark commit
+in one transaction, so database-only jobs take effect exactly once. The mark
+is fenced on the claim: a job whose lease expired and was claimed again
+cannot be finished twice.
+
+A handler that raises is retried with jittered exponential backoff. After
+``max_attempts`` failures the job is left ``failed`` until
+``flask jobs retry``.
+
+A job with an ``idempotency_key`` is enqueued at most once per key.
+
+By default every web process runs ``JOBS_WORKER_THREADS`` (1) worker
+threads, started on its first request and woken as soon as a request
+commits a job. Set it to 0 and run dedicated workers instead::
+
+    flask --app app jobs worker --threads 4
+    flask --app app jobs status
+"""
+import random
+import signal
+import threading
+import traceback
+import weakref
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import db, Job
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 3600
+
+# kind -> handler(payload)
+JOB_HANDLERS = {}
+
+_workers = weakref.WeakSet()
+
+
+def job(kind):
+    """Register the decorated ``fn(payload)`` as the handler for jobs of ``kind``."""
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue(kind, payload=None, key=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue a ``kind`` job in the current transaction; it runs once the caller commits.
+
+    With ``key``, a job that was already enqueued under the same key (in any
+    state) is kept and this call does nothing.
+    """
+    now = datetime.utcnow()
+    stmt = insert(Job).values(
+        kind=kind,
+        payload=payload or {},
+        idempotency_key=key,
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+    )
+    if key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['idempotency_key'])
+    db.session.execute(stmt)
+    db.session.info['jobs_enqueued'] = True
+
+
+def backoff_seconds(attempts):
+    """Delay before retry number ``attempts``: doubling from 2s, capped at an hour, with jitter."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_job(lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Atomically take the oldest due job (or one whose lease ran out) and return it, or ``None``."""
+    now = datetime.utcnow()
+    due = (
+        db.select(Job.id)
+        .where(db.or_(
+            db.and_(Job.status == 'queued', Job.run_at <= now),
+            db.and_(Job.status == 'running', Job.locked_until < now),  # its worker died
+        ))
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        db.update(Job)
+        .where(Job.id == due)
+        .values(status='running', attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=lease_seconds))
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+    ).first()
+    db.session.commit()
+    return row
+
+
+def _settle(claimed, **values):
+    # Only the worker holding the current claim may settle a job
+    result = db.session.execute(
+        db.update(Job)
+        .where(Job.id == claimed.id, Job.status == 'running', Job.attempts == claimed.attempts)
+        .values(locked_until=None, **values)
+    )
+    return result.rowcount == 1
+
+
+def run_job(claimed):
+    """Run a claimed job's handler and record the outcome; returns True if it succeeded."""
+    try:
+        handler = JOB_HANDLERS.get(claimed.kind)
+        if handler is None:
+            raise LookupError(f'No handler registered for {claimed.kind!r} jobs')
+        handler(claimed.payload)
+        if _settle(claimed, status='done', finished_at=datetime.utcnow(), last_error=None):
+            db.session.commit()
+        else:
+            db.session.rollback()  # lease lost: whoever holds it now does the work
+        return True
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        current_app.logger.warning('Job %s (%s) attempt %s failed:\n%s',
+                                   claimed.id, claimed.kind, claimed.attempts, error)
+        if claimed.attempts >= claimed.max_attempts:
+            _settle(claimed, status='failed', finished_at=datetime.utcnow(), last_error=error)
+        else:
+            retry_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(claimed.attempts))
+            _settle(claimed, status='queued', run_at=retry_at, last_error=error)
+        db.session.commit()
+        return False
+
+
+class JobWorker:
+    """A pool of threads that claim and run jobs until stopped."""
+
+    def __init__(self, app, threads=1, poll_interval=1.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads = []
+        _workers.add(self)
+
+    def run_one(self):
+        """Claim and run one due job; returns False when the queue has nothing due."""
+        with self.app.app_context():
+            claimed = claim_job(self.app.config.get('JOBS_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+            if claimed is None:
+                return False
+            run_job(claimed)
+            return True
+
+    def run_pending(self, limit=None):
+        """Run due jobs in this thread until none are left (or ``limit`` ran); returns how many ran."""
+        count = 0
+        while (limit is None or count < limit) and self.run_one():
+            count += 1
+        return count
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_one():
+                    continue
+            except Exception:
+                self.app.logger.exception('Job worker error')  # e.g. database locked; try again later
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        self._stop.clear()
+        for number in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """Stop claiming jobs and wait for the running ones to finish."""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    # A request just committed a job: let this process's workers pick it up now
+    if session.info.pop('jobs_enqueued', False):
+        for worker in list(_workers):
+            worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+def init_jobs(app):
+    worker = JobWorker(app)
+    app.extensions['job_worker'] = worker
+    started = threading.Lock()
+
+    @app.before_request
+    def _start_worker():
+        # Started lazily, in the process that serves requests (not before a fork)
+        if not started.acquire(blocking=False):
+            return
+        worker.threads = app.config.get('JOBS_WORKER_THREADS', 1)
+        worker.poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1.0)
+        if worker.threads > 0:
+            worker.start()
+
+
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+
+@jobs_cli.command('worker')
+@click.option('--threads', type=click.IntRange(1), default=4, show_default=True)
+@click.option('--poll-interval', type=float, default=1.0, show_default=True, help='Seconds between polls when idle.')
+@click.option('--burst', is_flag=True, help='Run every due job, then exit.')
+def worker_command(threads, poll_interval, burst):
+    """Run background jobs until interrupted."""
+    worker = JobWorker(current_app._get_current_object(), threads, poll_interval)
+    if burst:
+        click.echo(f'Ran {worker.run_pending()} job(s).')
+        return
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    worker.start()
+    click.echo(f'Job worker running with {threads} thread(s); Ctrl+C to stop.')
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    click.echo('Stopping; waiting for running jobs to finish.')
+    worker.stop()
+
+
+@jobs_cli.command('status')
+def status_command():
+    """Count jobs by kind and status."""
+    rows = (
+        db.session.query(Job.kind, Job.status, db.func.count())
+        .group_by(Job.kind, Job.status)
+        .order_by(Job.kind, Job.status)
+        .all()
+    )
+    for kind, status, count in rows:
+        click.echo(f'{kind:<32} {status:<8} {count:>8}')
+    if not rows:
+        click.echo('No jobs.')
+
+
+@jobs_cli.command('retry')
+@click.option('--kind', default=None, help='Only jobs of this kind.')
+def retry_command(kind):
+    """Queue failed jobs again with a fresh set of attempts."""
+    query = db.update(Job).where(Job.status == 'failed')
+    if kind:
+        query = query.where(Job.kind == kind)
+    result = db.session.execute(query.values(status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None))
+    db.session.commit()
+    click.echo(f'Requeued {result.rowcount} job(s).')
+
+
+@jobs_cli.command('prune')
+@click.option('--days', type=click.IntRange(0), default=7, show_default=True)
+def prune_command(days):
+    """Delete jobs that finished successfully more than DAYS days ago."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.session.execute(db.delete(Job).where(Job.status == 'done', Job.finished_at < cutoff))
+    db.session.commit()
+    click.echo(f'Deleted {result.rowcount} job(s).')
@@ -0,0 +1,226 @@
+# matching.py
+"""Load-aware assignment of new bookings to approved professionals.
+
+The matcher keeps every APPROVED professional in per-(service type, location)
+min-heaps ordered by their number of open ('Requested'/'Accepted') requests.
+A booking pops the least-loaded professional nearest to the customer in
+O(log n): same pincode first, then the same 3-digit pincode area, then
+anyone offering the service. When the pincode centroid table is available
+(see ``proximity.py``), the least-loaded professional within
+``NEAR_RADIUS_KM`` is tried before the 3-digit area, so a neighbouring
+pincode with a different prefix still counts as near. Loads are updated incrementally as requests are
+booked, rejected and closed; the whole index is rebuilt from the database
+every ``max_age`` seconds so per-worker copies cannot drift for long.
+
+Approvals, rejections, deletions and profile edits must not wait that long:
+a rejected professional could still be handed bookings. Besides updating
+this worker's index, they replace the ``matcher.stamp`` file in the instance
+folder, and every worker rebuilds its index before the next assignment once
+the stamp has changed.
+"""
+import heapq
+import os
+import threading
+import time
+
+from models import db, ServiceProfessional, ServiceRequest, OPEN_REQUEST_STATUSES
+from proximity import NEAR_RADIUS_KM, ProximityIndex, centroids
+from stamps import read_stamp, touch_stamp
+
+
+def _location_keys(service_type, pincode):
+    pincode = (pincode or '').strip()
+    return [
+        ('pincode', service_type, pincode),
+        ('area', service_type, pincode[:3]),
+        ('any', service_type),
+    ]
+
+
+class ProfessionalMatcher:
+    def __init__(self, max_age=60, stamp_path=None):
+        self.max_age = max_age
+        self.stamp_path = stamp_path
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._stamp = None
+        self._professionals = {}  # prof_id -> (service_type, pincode) for approved professionals
+        self._load = {}  # prof_id -> open request count
+        self._heaps = {}  # location key -> [(load, prof_id)], stale entries skipped lazily
+        self._members = {}  # location key -> number of approved professionals under it
+        self._proximity = None  # ProximityIndex of the approved professionals, built on first use
+
+    # --- Index maintenance --------------------------------------------------
+
+    def reset(self):
+        """Drop the index in every worker; each rebuilds it from the database on next use."""
+        with self._lock:
+            self._loaded_at = None
+        touch_stamp(self.stamp_path)
+
+    def _ensure_loaded(self):
+        stamp = read_stamp(self.stamp_path)
+        if (self._loaded_at is not None and stamp == self._stamp
+                and time.monotonic() - self._loaded_at < self.max_age):
+            return
+        professionals = (
+            db.session.query(ServiceProfessional.prof_id, ServiceProfessional.service_type, ServiceProfessional.pincode)
+            .filter(ServiceProfessional.status == 'APPROVED')
+            .all()
+        )
+        loads = (
+            db.session.query(ServiceRequest.prof_id, db.func.count())
+            .filter(ServiceRequest.prof_id.isnot(None), ServiceRequest.status.in_(OPEN_REQUEST_STATUSES))
+            .group_by(ServiceRequest.prof_id)
+            .all()
+        )
+        self._professionals = {p.prof_id: (p.service_type, p.pincode) for p in professionals}
+        self._load = dict(loads)
+        self._heaps = {}
+        self._members = {}
+        self._proximity = None
+        for prof_id in self._professionals:
+            self._track(prof_id, +1)
+            self._push(prof_id)
+        self._loaded_at = time.monotonic()
+        self._stamp = stamp
+
+    def _push(self, prof_id):
+        entry = (self._load.get(prof_id, 0), prof_id)
+        for key in _location_keys(*self._professionals[prof_id]):
+            heap = self._heaps.setdefault(key, [])
+            heapq.heappush(heap, entry)
+            if len(heap) > 2 * self._members.get(key, 0) + 32:
+                self._compact(key)
+
+    def _track(self, prof_id, delta):
+        for key in _location_keys(*self._professionals[prof_id]):
+            self._members[key] = self._members.get(key, 0) + delta
+
+    def _is_current(self, key, entry):
+        # An entry is stale once the load changed or the professional moved or left
+        load, prof_id = entry
+        profile = self._professionals.get(prof_id)
+        return (profile is not None and self._load.get(prof_id, 0) == load
+                and key in _location_keys(*profile))
+
+    def _compact(self, key):
+        heap = [entry for entry in self._heaps[key] if self._is_current(key, entry)]
+        heapq.heapify(heap)
+        self._heaps[key] = heap
+
+    def _peek(self, key):
+        heap = self._heaps.get(key)
+        while heap and not self._is_current(key, heap[0]):
+            heapq.heappop(heap)
+        return heap[0][1] if heap else None
+
+    def _proximity_index(self):
+        if self._proximity is None and centroids.available:
+            points = []
+            for prof_id, (service_type, pincode) in self._professionals.items():
+                location = centroids.get(pincode)
+                if location is not None:
+                    points.append((prof_id, service_type, *location))
+            self._proximity = ProximityIndex(points)
+        return self._proximity
+
+    def _nearby(self, service_type, pincode, radius_km, limit=None):
+        index = self._proximity_index()
+        location = centroids.get(pincode) if index is not None else None
+        if location is None:
+            return []
+        return index.near(service_type, *location, radius_km, limit)
+
+    def _adjust(self, prof_id, delta):
+        if prof_id is None:
+            return
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._load[prof_id] = max(0, self._load.get(prof_id, 0) + delta)
+            if prof_id in self._professionals:
+                self._push(prof_id)
+
+    # --- Public API ---------------------------------------------------------
+
+    def assign(self, service_type, pincode):
+        """Pick the least-loaded approved professional nearest ``pincode`` and count the booking.
+
+        Returns ``None`` when nobody offers ``service_type``. Call
+        :meth:`request_closed` if the booking is not committed after all.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            same_pincode, *wider = _location_keys(service_type, pincode)
+            prof_id = self._peek(same_pincode)
+            if prof_id is None:
+                nearby = self._nearby(service_type, pincode, NEAR_RADIUS_KM)
+                if nearby:
+                    # Least loaded within the radius, the closer one on a tie
+                    prof_id = min(nearby, key=lambda found: (self._load.get(found[1], 0), found[0]))[1]
+            for key in wider:
+                if prof_id is not None:
+                    break
+                prof_id = self._peek(key)
+            if prof_id is not None:
+                self._adjust(prof_id, +1)
+            return prof_id
+
+    def nearby(self, service_types, pincode, radius_km=NEAR_RADIUS_KM, limit=None):
+        """``[(distance_km, prof_id)]`` of approved professionals offering any of ``service_types``.
+
+        Nearest first, within ``radius_km`` of ``pincode``. Empty when the pincode
+        cannot be located.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            found = []
+            for service_type in service_types:
+                found.extend(self._nearby(service_type, pincode, radius_km))
+        found.sort()
+        return found[:limit] if limit else found
+
+    def request_opened(self, prof_id):
+        self._adjust(prof_id, +1)
+
+    def request_closed(self, prof_id):
+        """A request left the open statuses (rejected or closed)."""
+        self._adjust(prof_id, -1)
+
+    def professional_changed(self, *professionals):
+        """Re-index professionals after approval, rejection or a profile change, in every worker."""
+        with self._lock:
+            if self._loaded_at is not None:
+                for professional in professionals:
+                    prof_id = professional.prof_id
+                    if prof_id in self._professionals:
+                        self._track(prof_id, -1)
+                        del self._professionals[prof_id]
+                    if professional.status == 'APPROVED':
+                        self._professionals[prof_id] = (professional.service_type, professional.pincode)
+                        self._track(prof_id, +1)
+                        self._push(prof_id)
+                self._proximity = None
+        if professionals:
+            touch_stamp(self.stamp_path)
+
+    def professional_removed(self, *prof_ids):
+        """Drop deleted professionals from the index, in every worker."""
+        with self._lock:
+            for prof_id in prof_ids:
+                if prof_id in self._professionals:
+                    self._track(prof_id, -1)
+                    del self._professionals[prof_id]
+                self._load.pop(prof_id, None)
+            self._proximity = None
+        if prof_ids:
+            touch_stamp(self.stamp_path)
+
+
+matcher = ProfessionalMatcher()
+
+
+def init_matching(app):
+    matcher.max_age = app.config.get('MATCHER_MAX_AGE', matcher.max_age)
+    matcher.stamp_path = app.config.get('MATCHER_STAMP_PATH') or os.path.join(app.instance_path, 'matcher.stamp')
@@ -0,0 +1,222 @@
+# migrations.py
+"""Versioned schema migrations for an existing SQLite database.
+
+``db.create_all()`` only creates missing tables, so anything added to an
+existing table (indexes, columns, triggers) ships as a numbered migration
+here. Each migration runs in its own ``BEGIN IMMEDIATE`` transaction together
+with the row that records it, so a live database is never left half-migrated
+and readers keep working while it runs.
+
+Usage::
+
+    flask --app app schema status
+    flask --app app schema upgrade
+"""
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from models import db, ArchivedServiceRequest, Job, RequestRollup, RatingRollup, TableVersion, RATING_PRIOR_MEAN
+from rollups import rebuild_professional_ratings, rebuild_rollups
+from search_index import create_search_index
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register ``fn(conn)`` as schema migration number ``version``."""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def column_exists(conn, table, column):
+    rows = conn.exec_driver_sql(f'PRAGMA table_info("{table}")').fetchall()
+    return any(row[1] == column for row in rows)
+
+
+def add_column(conn, table, column, ddl):
+    """``ALTER TABLE ... ADD COLUMN`` unless the column is already there."""
+    if not column_exists(conn, table, column):
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}')
+
+
+def create_version_triggers(conn, tables):
+    """Count every insert, update and delete on ``tables`` in ``table_versions``."""
+    for table in tables:
+        conn.exec_driver_sql(
+            'INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)', (table,)
+        )
+        bump = f"UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}'"
+        for suffix, event in [('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')]:
+            conn.exec_driver_sql(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON "{table}" '
+                f'BEGIN {bump}; END'
+            )
+
+
+# --- Migrations -------------------------------------------------------------
+
+@migration(1, 'Secondary indexes for the dashboard, booking and admin filter queries')
+def _hot_path_indexes(conn):
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_service_requests_prof_status '
+        'ON service_requests (prof_id, status)'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_service_requests_user_service_status '
+        'ON service_requests (user_id, service_id, status)'
+    )
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_service_professionals_type_status '
+        'ON service_professionals (service_type, status)'
+    )
+
+
+@migration(2, 'FTS5 search index over services, customers and professionals')
+def _search_index(conn):
+    create_search_index(conn)
+
+
+@migration(3, 'Summary rollup tables, backfilled from service_requests')
+def _summary_rollups(conn):
+    RequestRollup.__table__.create(conn, checkfirst=True)
+    RatingRollup.__table__.create(conn, checkfirst=True)
+    rebuild_rollups(conn)
+
+
+@migration(4, 'Resized image variants for service images')
+def _service_image_variants(conn):
+    add_column(conn, 'service', 'image_variants', 'JSON')
+
+
+@migration(5, 'Change counters for conditional GET on the dashboards')
+def _table_versions(conn):
+    TableVersion.__table__.create(conn, checkfirst=True)
+    create_version_triggers(conn, ('users', 'service_professionals', 'service', 'service_requests'))
+
+
+@migration(6, 'Background job queue; change counters on the rollup tables it updates')
+def _jobs(conn):
+    Job.__table__.create(conn, checkfirst=True)
+    # Summary pages now change when a rollup job lands, not when the request commits
+    create_version_triggers(conn, ('request_rollups', 'rating_rollups'))
+
+
+@migration(7, 'One open request per customer and service; version counter for status transitions')
+def _open_request_uniqueness(conn):
+    add_column(conn, 'service_requests', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    # The old duplicate check only looked at 'Requested', so a customer could book
+    # again once a request was Accepted. Keep the most advanced (then the oldest)
+    # open request of each pair and reject the rest, or the index cannot be built.
+    duplicates = conn.exec_driver_sql(
+        "UPDATE service_requests SET status = 'Rejected', version = version + 1 "
+        "WHERE req_id IN ("
+        "  SELECT req_id FROM ("
+        "    SELECT req_id, ROW_NUMBER() OVER ("
+        "      PARTITION BY user_id, service_id ORDER BY status = 'Accepted' DESC, req_id) AS n "
+        "    FROM service_requests WHERE status IN ('Requested', 'Accepted')"
+        "  ) WHERE n > 1"
+        ")"
+    ).rowcount
+    if duplicates:
+        rebuild_rollups(conn)
+    conn.exec_driver_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_service_requests_open '
+        "ON service_requests (user_id, service_id) WHERE status IN ('Requested', 'Accepted')"
+    )
+
+
+@migration(8, 'Rating count, sum and Bayesian score per professional, indexed for top-rated lists')
+def _professional_ratings(conn):
+    add_column(conn, 'service_professionals', 'rating_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'service_professionals', 'rating_sum', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'service_professionals', 'rating_score', f'FLOAT NOT NULL DEFAULT {RATING_PRIOR_MEAN}')
+    rebuild_professional_ratings(conn)
+    # (service_type, status) lookups use a prefix of the new index
+    conn.exec_driver_sql('DROP INDEX IF EXISTS ix_service_professionals_type_status')
+    conn.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_service_professionals_type_status_score '
+        'ON service_professionals (service_type, status, rating_score)'
+    )
+
+
+@migration(9, 'Archive table for old closed and rejected requests')
+def _request_archive(conn):
+    ArchivedServiceRequest.__table__.create(conn, checkfirst=True)
+
+
+# --- Runner -----------------------------------------------------------------
+
+def _ensure_version_table(conn):
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL)'
+    )
+
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        _ensure_version_table(conn)
+        conn.commit()
+        return {row[0] for row in conn.exec_driver_sql('SELECT version FROM schema_migrations')}
+
+
+def pending_migrations(engine, target=None):
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in applied and (target is None or m[0] <= target)]
+
+
+def upgrade(engine=None, target=None, busy_timeout_ms=30000, echo=None):
+    """Apply every pending migration up to ``target`` and return the versions applied."""
+    engine = engine or db.engine
+    done = []
+    for version, description, fn in pending_migrations(engine, target):
+        with engine.connect() as conn:
+            # Drive the transaction ourselves: pysqlite would otherwise autocommit DDL
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.exec_driver_sql(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            try:
+                fn(conn)
+                conn.exec_driver_sql(
+                    'INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, datetime.utcnow().isoformat(sep=' ', timespec='seconds')),
+                )
+                conn.exec_driver_sql('COMMIT')
+            except Exception:
+                conn.exec_driver_sql('ROLLBACK')
+                raise
+        done.append(version)
+        if echo:
+            echo(f'Applied migration {version}: {description}')
+
+    if done:
+        # Let the query planner pick up statistics for any new indexes
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA optimize')
+    return done
+
+
+schema_cli = AppGroup('schema', help='Inspect and migrate the database schema.')
+
+
+@schema_cli.command('status')
+def status_command():
+    """Show applied and pending migrations."""
+    applied = applied_versions(db.engine)
+    for version, description, _ in MIGRATIONS:
+        mark = 'applied' if version in applied else 'pending'
+        click.echo(f'{version:>4}  {mark:<8} {description}')
+
+
+@schema_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this migration version.')
+def upgrade_command(target):
+    """Apply pending migrations to the configured database."""
+    done = upgrade(db.engine, target=target, echo=click.echo)
+    if not done:
+        click.echo('Schema is up to date.')
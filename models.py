@@ -1,6 +1,8 @@
 # models.py
 from sqlalchemy import ForeignKey
 from sqlalchemy import func, Enum
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm.attributes import set_committed_value
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash
 from datetime import datetime
@@ -31,8 +33,25 @@ class ProfessionalStatus(Enum):
     APPROVED = "APPROVED"
     REJECTED = "REJECTED"
 
+# Ratings are ranked by a Bayesian average: every professional starts with
+# RATING_PRIOR_WEIGHT imaginary ratings of RATING_PRIOR_MEAN, so one 5-star
+# review does not outrank fifty 4.8-star ones
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+
+
+def bayesian_rating(rating_sum, rating_count):
+    """The smoothed score; works on plain numbers and on SQL column expressions."""
+    return (RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT + rating_sum) / (RATING_PRIOR_WEIGHT + rating_count)
+
+
 class ServiceProfessional(UserMixin, db.Model):
     __tablename__ = 'service_professionals'
+    __table_args__ = (
+        # Booking looks professionals up by service type; admin filters add the status;
+        # the top-rated list reads the approved ones of a service best score first
+        db.Index('ix_service_professionals_type_status_score', 'service_type', 'status', 'rating_score'),
+    )
     
     prof_id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)  # Auto-increment primary key
     username = db.Column(db.String(255), unique=True, nullable=False)  # Unique username
@@ -46,6 +65,11 @@ class ServiceProfessional(UserMixin, db.Model):
     date_created = db.Column(db.DateTime, default=func.now(), nullable=False)  # Automatically set to current timestamp
     status = db.Column(db.Text, default=ProfessionalStatus.PENDING, nullable=False)  # Status stored as text
     role = db.Column(db.String(50), default='service_professional', nullable=False)
+    # Kept current by the rating rollup job (rollups.py); rating_score is the Bayesian average
+    rating_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_score = db.Column(db.Float, default=RATING_PRIOR_MEAN, server_default=str(RATING_PRIOR_MEAN),
+                             nullable=False)
 
     service_requests = db.relationship('ServiceRequest', backref='service_professionals', lazy=True)
 
@@ -89,6 +113,7 @@ class Service(db.Model):
     base_price = db.Column(db.Float, nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
     image = db.Column(db.String(255), nullable=True)
+    image_variants = db.Column(db.JSON, nullable=True)  # manifest written by images.process_image
 
     # professionals = db.relationship('ServiceProfessional', backref='service', lazy=True)
 
@@ -96,8 +121,37 @@ class Service(db.Model):
         return f"<Service {self.name}>"
 
 
+class TableVersion(db.Model):
+    # Change counters bumped by triggers (migration 5), read by conditional.conditional_view
+    __tablename__ = 'table_versions'
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Requests a professional still has to act on; everything else is history
+OPEN_REQUEST_STATUSES = ('Requested', 'Accepted')
+HISTORY_REQUEST_STATUSES = ('Closed', 'Rejected')
+
+# The statuses a request may move to, and the ones it may move from
+REQUEST_TRANSITIONS = {
+    'Accepted': ('Requested',),
+    'Rejected': OPEN_REQUEST_STATUSES,
+    'Closed': OPEN_REQUEST_STATUSES + ('Closed',),  # a closed request can be rated again
+}
+
+
 class ServiceRequest(db.Model):
     __tablename__ = 'service_requests'
+    __table_args__ = (
+        # Professional dashboard and history: prof_id + status (req_id rides along as the rowid)
+        db.Index('ix_service_requests_prof_status', 'prof_id', 'status'),
+        # Customer dashboard (user_id), subcategory history (+ service_id) and the
+        # status filters (+ status) all seek on a prefix of this one index
+        db.Index('ix_service_requests_user_service_status', 'user_id', 'service_id', 'status'),
+        # At most one open request per customer and service (migration 7)
+        db.Index('ux_service_requests_open', 'user_id', 'service_id', unique=True,
+                 sqlite_where=db.text("status IN ('Requested', 'Accepted')")),
+    )
     req_id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=True)
     service_id = db.Column(db.Integer, db.ForeignKey('service.service_id'), nullable=True)
@@ -107,14 +161,192 @@ class ServiceRequest(db.Model):
     remarks = db.Column(db.String(255))
     requested_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     close_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped by every status transition
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     # Relationships
     service = db.relationship('Service', backref='requests')
     professional = db.relationship('ServiceProfessional', backref='requests')
 
+    def book(self):
+        """Insert this new request unless the customer already has an open one for the service.
+
+        One ``INSERT ... ON CONFLICT DO NOTHING`` against ``ux_service_requests_open``,
+        so of two concurrent bookings exactly one inserts. Returns True if this
+        request was inserted; otherwise ``req_id`` is set to the open request
+        that already exists. The request is not added to the session.
+        """
+        values = {column.key: getattr(self, column.key) for column in self.__table__.columns
+                  if getattr(self, column.key) is not None}
+        values['status'] = self.status = 'Requested'
+        columns = self.__table__.columns
+        for _ in range(2):
+            row = db.session.execute(
+                insert(ServiceRequest).values(**values).on_conflict_do_nothing(
+                    index_elements=['user_id', 'service_id'],
+                    index_where=ServiceRequest.status.in_(OPEN_REQUEST_STATUSES),
+                ).returning(*columns)
+            ).first()
+            if row is not None:
+                for column, value in zip(columns, row):  # req_id and the column defaults
+                    set_committed_value(self, column.key, value)
+                return True
+            self.req_id = db.session.execute(
+                db.select(ServiceRequest.req_id).where(
+                    ServiceRequest.user_id == self.user_id, ServiceRequest.service_id == self.service_id,
+                    ServiceRequest.status.in_(OPEN_REQUEST_STATUSES),
+                )
+            ).scalar()
+            if self.req_id is not None:
+                return False
+            # The open request was closed in between: try the insert again
+        return False
+
+    def transition(self, status, **values):
+        """Move this request to ``status``, setting ``values`` too; returns False if it may not.
+
+        A single ``UPDATE ... WHERE status IN (...) AND version = ?``: it only
+        succeeds if ``REQUEST_TRANSITIONS`` allows the move and nobody else has
+        changed the request since it was loaded, so two racing transitions
+        cannot both win and nothing is locked in the meantime.
+        """
+        allowed = REQUEST_TRANSITIONS[status]
+        if self.status not in allowed:
+            return False
+        result = db.session.execute(
+            db.update(ServiceRequest)
+            .where(ServiceRequest.req_id == self.req_id, ServiceRequest.version == self.version,
+                   ServiceRequest.status.in_(allowed))
+            .values(status=status, version=ServiceRequest.version + 1, **values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            return False
+        values.update(status=status, version=self.version + 1)
+        for key, value in values.items():
+            set_committed_value(self, key, value)
+        return True
+
+    @classmethod
+    def query_with_details(cls, session=None):
+        """Query requests with their service and professional joined in, for listings."""
+        query = cls.query  # configures the mappers, which creates the service_professionals backref
+        if session is not None:
+            query = session.query(cls)
+        return query.options(db.joinedload(cls.service), db.joinedload(cls.service_professionals))
 
     def __repr__(self):
         return f"<ServiceRequest {self.id}>"
+
+
+class ArchivedServiceRequest(db.Model):
+    """A Closed or Rejected request moved out of ``service_requests`` by archive.py; never changed again."""
+    __tablename__ = 'service_requests_archive'
+    __table_args__ = (
+        # The same lookups as the hot table, when a history view asks for archived requests
+        db.Index('ix_service_requests_archive_prof_status', 'prof_id', 'status'),
+        db.Index('ix_service_requests_archive_user', 'user_id'),
+        db.Index('ix_service_requests_archive_status', 'status'),
+    )
+    req_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # kept from service_requests
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('service.service_id'), nullable=True)
+    prof_id = db.Column(db.Integer, db.ForeignKey('service_professionals.prof_id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False)
+    rating = db.Column(db.Integer)
+    remarks = db.Column(db.String(255))
+    requested_date = db.Column(db.DateTime, nullable=False)
+    close_date = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+REQUEST_HISTORY_COLUMNS = ('req_id', 'user_id', 'service_id', 'prof_id', 'status', 'rating', 'remarks',
+                           'requested_date', 'close_date')
+
+
+class RequestHistory(db.Model):
+    """Read-only view of hot and archived requests together, for history views that ask for both.
+
+    Mapped onto ``service_requests UNION ALL service_requests_archive``, with
+    the same column names and listing relationships as :class:`ServiceRequest`,
+    so a view can query either one. SQLite pushes the WHERE terms down into
+    both halves, so each still seeks on its own indexes.
+    """
+    __table__ = db.union_all(
+        db.select(*(ServiceRequest.__table__.c[name] for name in REQUEST_HISTORY_COLUMNS)),
+        db.select(*(ArchivedServiceRequest.__table__.c[name] for name in REQUEST_HISTORY_COLUMNS)),
+    ).subquery('request_history')
+    __mapper_args__ = {'primary_key': [__table__.c.req_id]}
+
+    service = db.relationship(
+        'Service', primaryjoin='foreign(RequestHistory.service_id) == Service.service_id', viewonly=True)
+    service_professionals = db.relationship(
+        'ServiceProfessional', primaryjoin='foreign(RequestHistory.prof_id) == ServiceProfessional.prof_id',
+        viewonly=True)
+
+    @classmethod
+    def query_with_details(cls, session=None):
+        """Query requests with their service and professional joined in, for listings."""
+        query = (session or db.session).query(cls)
+        return query.options(db.joinedload(cls.service), db.joinedload(cls.service_professionals))
+
+
+def request_history_model(include_archived):
+    """:class:`RequestHistory` if archived requests were asked for, else :class:`ServiceRequest`."""
+    return RequestHistory if include_archived else ServiceRequest
     
 
     
+
+
+class RequestRollup(db.Model):
+    """Pre-aggregated request counts per status, kept current as requests are booked and updated.
+
+    ``dimension`` is one of 'all', 'day', 'service', 'professional' or 'customer'
+    and ``key`` the matching id (or ISO date). 'day' rows count the requests that
+    entered a status on that day; the others hold how many requests are in each
+    status right now.
+    """
+    __tablename__ = 'request_rollups'
+    __table_args__ = (
+        # "Top professionals/services by closed requests" on the admin summary
+        db.Index('ix_request_rollups_rank', 'dimension', 'status', 'count'),
+    )
+
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RatingRollup(db.Model):
+    """Histogram of feedback ratings for the 'all', 'service' and 'professional' dimensions."""
+    __tablename__ = 'rating_rollups'
+
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(32), primary_key=True)
+    rating = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """A unit of background work, queued by jobs.enqueue and run by a jobs.JobWorker."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Workers claim the oldest due job in a status
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)  # lease of the worker running it
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,187 @@
+# moderation.py
+"""Set-based moderation actions on professionals and customers.
+
+An action (approve, reject, block, unblock, delete) applies to a set of rows
+chosen either by id or by the equality filters the admin dashboard offers.
+Ids are applied as one ``UPDATE``/``DELETE ... WHERE id IN (...)`` per chunk
+of :data:`BULK_CHUNK_SIZE`, and a filter as a single statement. Either way
+everything happens in one transaction, so an action applies to every chosen
+row or to none of them. Rows already in the target state are left alone,
+and admin accounts are never touched.
+
+The statements ``RETURNING`` the rows they changed. Once the transaction
+commits, those rows are dropped from this process's principal cache and
+matcher.
+"""
+from models import db, ArchivedServiceRequest, ServiceProfessional, ServiceRequest, User
+from matching import matcher
+from principal import principals
+
+BULK_CHUNK_SIZE = 500
+MAX_BULK_IDS = 10000
+
+
+class BulkActionError(ValueError):
+    """The action, ids or filters of a bulk request are not acceptable."""
+
+
+def _forget_users(user_ids):
+    def after_commit():
+        principals.invalidate('user', *user_ids)  # blocked users are logged out on their next request
+    return after_commit
+
+
+def _set_professional_status(status):
+    def apply(where):
+        rows = db.session.execute(
+            db.update(ServiceProfessional)
+            .where(where, ServiceProfessional.status != status)
+            .values(status=status)
+            .returning(ServiceProfessional.prof_id, ServiceProfessional.service_type,
+                       ServiceProfessional.pincode, ServiceProfessional.status)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        def after_commit():
+            matcher.professional_changed(*rows)
+            principals.invalidate('professional', *(row.prof_id for row in rows))
+        return len(rows), after_commit
+    return apply
+
+
+def _delete_professionals(where):
+    # Like the ORM delete of one professional: their requests stay, unassigned
+    doomed = db.select(ServiceProfessional.prof_id).where(where)
+    for model in (ServiceRequest, ArchivedServiceRequest):
+        db.session.execute(
+            db.update(model).where(model.prof_id.in_(doomed)).values(prof_id=None)
+            .execution_options(synchronize_session=False)
+        )
+    prof_ids = db.session.execute(
+        db.delete(ServiceProfessional).where(where).returning(ServiceProfessional.prof_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    def after_commit():
+        matcher.professional_removed(*prof_ids)
+        principals.invalidate('professional', *prof_ids)
+    return len(prof_ids), after_commit
+
+
+def _set_customer_status(status):
+    def apply(where):
+        user_ids = db.session.execute(
+            db.update(User).where(where, User.status != status).values(status=status)
+            .returning(User.user_id).execution_options(synchronize_session=False)
+        ).scalars().all()
+        return len(user_ids), _forget_users(user_ids)
+    return apply
+
+
+def _delete_customers(where):
+    user_ids = db.session.execute(
+        db.delete(User).where(where).returning(User.user_id).execution_options(synchronize_session=False)
+    ).scalars().all()
+    return len(user_ids), _forget_users(user_ids)
+
+
+# target -> (primary key, filters by name, scope every statement is limited to, {action: apply(where)})
+BULK_TARGETS = {
+    'professionals': (
+        ServiceProfessional.prof_id,
+        {'status': ServiceProfessional.status, 'service_type': ServiceProfessional.service_type},
+        db.true(),
+        {
+            'approve': _set_professional_status('APPROVED'),
+            'reject': _set_professional_status('REJECTED'),
+            'delete': _delete_professionals,
+        },
+    ),
+    'customers': (
+        User.user_id,
+        {'status': User.status, 'pincode': User.pincode},
+        User.role == 'customer',
+        {
+            'block': _set_customer_status('Blocked'),
+            'unblock': _set_customer_status('Active'),
+            'delete': _delete_customers,
+        },
+    ),
+}
+
+
+def _chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def apply_bulk(target, action, ids=None, filters=None, match_all=False, chunk_size=BULK_CHUNK_SIZE):
+    """Apply ``action`` to the ``target`` rows with ``ids``, or else to those matching ``filters``.
+
+    ``filters`` maps filter names to string values. Without filters nothing is
+    selected unless ``match_all`` is set, so a lost filter can never turn into
+    an action on every row. Commits, and returns a summary dict with how many
+    rows were ``changed`` (and, for ids, how many were ``skipped`` as already
+    in that state or missing).
+    """
+    if target not in BULK_TARGETS:
+        raise BulkActionError(f'Unknown bulk target {target!r}.')
+    key_column, filter_columns, scope, actions = BULK_TARGETS[target]
+    if action not in actions:
+        raise BulkActionError(f'{target.capitalize()} can be: {", ".join(actions)}.')
+    apply = actions[action]
+
+    if ids is not None:
+        try:
+            ids = sorted({int(i) for i in ids})
+        except (TypeError, ValueError):
+            raise BulkActionError('Ids must be integers.') from None
+        if not ids:
+            raise BulkActionError('Select at least one row.')
+        if len(ids) > MAX_BULK_IDS:
+            raise BulkActionError(f'At most {MAX_BULK_IDS} ids at a time.')
+        clauses = [db.and_(scope, key_column.in_(chunk)) for chunk in _chunks(ids, chunk_size)]
+    else:
+        filters = filters or {}
+        unknown = sorted(set(filters) - set(filter_columns))
+        if unknown:
+            raise BulkActionError(f'Unknown filter(s): {", ".join(unknown)}.')
+        not_text = sorted(name for name, value in filters.items() if not isinstance(value, str))
+        if not_text:
+            raise BulkActionError(f'Filter values must be strings: {", ".join(not_text)}.')
+        if not filters and not match_all:
+            raise BulkActionError(f'Choose at least one filter, or apply the action to all {target}.')
+        clauses = [db.and_(scope, *(filter_columns[name] == value for name, value in filters.items()))]
+
+    changed, callbacks = 0, []
+    try:
+        for where in clauses:
+            count, after_commit = apply(where)
+            changed += count
+            callbacks.append(after_commit)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for after_commit in callbacks:
+        after_commit()
+
+    summary = {'target': target, 'action': action, 'changed': changed}
+    if ids is not None:
+        summary.update(requested=len(ids), skipped=len(ids) - changed)
+    return summary
+
+
+_PAST_TENSE = {'approve': 'Approved', 'reject': 'Rejected', 'block': 'Blocked', 'unblock': 'Unblocked',
+               'delete': 'Deleted'}
+
+
+def describe_bulk(summary):
+    """One line for a flash message, e.g. 'Approved 37 professionals; 3 skipped (already approved or not found).'"""
+    verb = _PAST_TENSE[summary['action']]
+    noun = summary['target'] if summary['changed'] != 1 else summary['target'][:-1]
+    text = f"{verb} {summary['changed']} {noun}"
+    if summary.get('skipped'):
+        reason = 'not found' if summary['action'] == 'delete' else f'already {verb.lower()} or not found'
+        text += f"; {summary['skipped']} skipped ({reason})"
+    return text + '.'
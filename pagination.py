@@ -0,0 +1,143 @@
+# pagination.py
+from itertools import chain, islice
+
+from flask import request
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+STREAM_BATCH_SIZE = 50
+
+
+class KeysetPage:
+    """One page of rows plus the cursors needed to seek to its neighbours.
+
+    An empty page reached with ``after`` (say, its rows were deleted since)
+    seeks back from ``after`` itself.
+    """
+
+    def __init__(self, items, key, has_next, has_prev, after=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = getattr(items[-1], key) if has_next and items else None
+        self.prev_cursor = (getattr(items[0], key) if items else after) if has_prev else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StreamedRows:
+    """The rows of ``query``, fetched ``batch_size`` at a time while a streamed template iterates them.
+
+    Nothing runs until the template gets to the rows, so the page above them
+    has already been sent. Truth-testing fetches the first batch, so templates
+    can still write ``{% if results %}``. The rows can be iterated once.
+    """
+
+    def __init__(self, query, batch_size=STREAM_BATCH_SIZE):
+        self.query = query
+        self.batch_size = batch_size
+        self._rows = None
+        self._first = []
+
+    def _iterator(self):
+        if self._rows is None:
+            self._rows = iter(self.query.yield_per(self.batch_size))
+        return self._rows
+
+    def __bool__(self):
+        if not self._first:
+            self._first = list(islice(self._iterator(), 1))
+        return bool(self._first)
+
+    def __iter__(self):
+        first, self._first = self._first, []
+        return chain(first, self._iterator())
+
+
+class StreamedKeysetPage:
+    """A forward :class:`KeysetPage` whose rows are fetched while the template iterates it.
+
+    ``has_next``, the cursors and ``len()`` are only final once the rows have
+    been iterated, so templates must use them after the loop.
+    """
+
+    def __init__(self, query, key, per_page, after=None):
+        self.rows = StreamedRows(query.limit(per_page + 1))
+        self.key = key
+        self.per_page = per_page
+        self.has_next = False
+        self.has_prev = after is not None
+        self.next_cursor = None
+        self.prev_cursor = after  # replaced by the first row's key; kept when the page is empty
+        self.count = 0
+
+    def __iter__(self):
+        last = None
+        for row in self.rows:
+            if self.count == self.per_page:
+                self.has_next = True  # the extra row only tells us there is a next page
+                continue
+            if self.count == 0 and self.has_prev:
+                self.prev_cursor = getattr(row, self.key)
+            self.count += 1
+            last = row
+            yield row
+        if self.has_next:
+            self.next_cursor = getattr(last, self.key)
+
+    def __len__(self):
+        return self.count
+
+
+def page_args(default_sort='asc'):
+    """Read the ``after``/``before``/``per_page``/``sort`` cursor arguments from the request."""
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    sort = request.args.get('sort', default_sort)
+    return {
+        'after': request.args.get('after', type=int),
+        'before': request.args.get('before', type=int),
+        'per_page': max(1, min(per_page, MAX_PER_PAGE)),
+        'descending': sort == 'desc',
+    }
+
+
+def keyset_paginate(query, key_column, after=None, before=None, per_page=DEFAULT_PER_PAGE, descending=False,
+                    stream=False):
+    """Seek to the page of ``query`` that follows ``after`` (or precedes ``before``).
+
+    Rows are ordered by ``key_column``, which must be unique (normally the primary
+    key), so each page is a single index range scan of ``per_page + 1`` rows no
+    matter how deep into the table it is.
+
+    With ``stream``, forward pages are a :class:`StreamedKeysetPage` for
+    ``stream_template``. Backward pages are read the other way round and
+    have to be reversed, so they are always loaded up front.
+    """
+    key = key_column.key
+    backwards = before is not None
+
+    if backwards:
+        # Walk the index the other way from the cursor, then flip the rows back
+        if descending:
+            query = query.filter(key_column > before).order_by(key_column.asc())
+        else:
+            query = query.filter(key_column < before).order_by(key_column.desc())
+    else:
+        if after is not None:
+            query = query.filter(key_column < after if descending else key_column > after)
+        query = query.order_by(key_column.desc() if descending else key_column.asc())
+        if stream:
+            return StreamedKeysetPage(query, key, per_page, after=after)
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+        return KeysetPage(rows, key, has_next=True, has_prev=has_more)
+    return KeysetPage(rows, key, has_next=has_more, has_prev=after is not None, after=after)
@@ -0,0 +1,140 @@
+# principal.py
+"""The account behind the current request, resolved once and cached.
+
+Customers and admins live in ``users`` and professionals in
+``service_professionals``; :class:`Principal` gives both the same shape.
+Principals are cached per process for ``PRINCIPAL_CACHE_TTL`` seconds. The
+routes that block, approve, reject, delete or edit an account invalidate it
+after committing, which also replaces the ``principals.stamp`` file in the
+instance folder. Every worker compares that stamp (one ``stat()``) before
+reading its cache and drops the whole cache when it changed, so a blocked
+account is logged out on its next request whichever worker serves it.
+"""
+import os
+import threading
+import time
+
+from flask import flash, g, redirect, request, session, url_for
+from flask_login import UserMixin
+
+from models import db, User, ServiceProfessional
+from stamps import read_stamp, touch_stamp
+
+# Account statuses that may not use the application
+BLOCKED_STATUSES = {'Blocked': "Your account has been blocked. Please contact support.",
+                    'REJECTED': "Your account has been Rejected."}
+
+
+class Principal(UserMixin):
+    def __init__(self, kind, id, username, role, status, pincode):
+        self.kind = kind  # 'user' or 'professional'
+        self.id = id
+        self.username = username
+        self.role = role
+        self.status = status
+        self.pincode = pincode
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def is_blocked(self):
+        return self.status in BLOCKED_STATUSES
+
+    def __repr__(self):
+        return f"<Principal {self.kind}:{self.id} role={self.role} status={self.status}>"
+
+
+class PrincipalCache:
+    def __init__(self, ttl=30, stamp_path=None):
+        self.ttl = ttl
+        self.stamp_path = stamp_path
+        self._entries = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def get(self, kind, id):
+        """Return the cached principal for ``(kind, id)``, loading it on a miss."""
+        stamp = read_stamp(self.stamp_path)
+        if stamp != self._stamp:
+            # Some worker invalidated an account since this cache was filled
+            with self._lock:
+                self._entries.clear()
+                self._stamp = stamp
+        now = time.monotonic()
+        entry = self._entries.get((kind, id))
+        if entry and entry[0] > now:
+            return entry[1]
+
+        principal = self._load(kind, id)
+        if principal is not None:
+            with self._lock:
+                self._entries[(kind, id)] = (now + self.ttl, principal)
+        return principal
+
+    def _load(self, kind, id):
+        if kind == 'professional':
+            row = (
+                db.session.query(ServiceProfessional.prof_id, ServiceProfessional.username, ServiceProfessional.role,
+                                 ServiceProfessional.status, ServiceProfessional.pincode)
+                .filter(ServiceProfessional.prof_id == id)
+                .first()
+            )
+        else:
+            row = (
+                db.session.query(User.user_id, User.username, User.role, User.status, User.pincode)
+                .filter(User.user_id == id)
+                .first()
+            )
+        return Principal(kind, *row) if row else None
+
+    def invalidate(self, kind, *ids):
+        """Forget the ``kind`` principals with ``ids`` here and in every other worker."""
+        if not ids:
+            return
+        with self._lock:
+            for id in ids:
+                self._entries.pop((kind, id), None)
+        touch_stamp(self.stamp_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def current_principal():
+    """The :class:`Principal` for this request, or ``None`` when nobody is logged in."""
+    return g.get('principal')
+
+
+def _resolve_principal():
+    g.principal = None
+    if request.endpoint == 'static':
+        return None  # assets are public; reading the session would also add Vary: Cookie
+    # The role picked at login says which id counts; the other one may be left over from an earlier login
+    role = session.get('role')
+    if role == 'service_professional' and session.get('prof_id'):
+        kind, id = 'professional', session['prof_id']
+    elif role in ('customer', 'admin') and session.get('user_id'):
+        kind, id = 'user', session['user_id']
+    else:
+        return None
+
+    principal = principals.get(kind, id)
+    if principal is None or principal.is_blocked:
+        # Deleted, blocked or rejected since login: end the session now
+        session.clear()
+        flash(BLOCKED_STATUSES.get(principal.status) if principal else "Please log in again.", "danger")
+        return redirect(url_for('main.login'))
+    g.principal = principal
+    return None
+
+
+def init_principal(app):
+    principals.ttl = app.config.get('PRINCIPAL_CACHE_TTL', principals.ttl)
+    principals.stamp_path = (app.config.get('PRINCIPAL_STAMP_PATH')
+                             or os.path.join(app.instance_path, 'principals.stamp'))
+    app.before_request(_resolve_principal)
@@ -2,19 +2,27 @@ from flask import Blueprint, render_template, session, redirect, url_for, flash,
 from models import db, Service, ServiceProfessional, ServiceRequest, User
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from catalog import catalog
+from conditional import conditional_view
+from matching import matcher
+from principal import current_principal, principals
+from query_budget import query_budget
+from rollups import rating_histogram, record_status_change, status_counts
+from search_index import SEARCH_RESULT_LIMIT, fts_match, fts_query, match_status
+from sqlite_profile import read_session
 
 professional_bp = Blueprint('professional', __name__)
 
 @professional_bp.route('/professional_dashboard/profile', methods=['GET', 'POST'])
 def profile():
-    # Fetch logged-in professional's ID from session
-    prof_id = session.get('prof_id')
-    if not prof_id:
+    # Logged-in professional, resolved once per request from the principal cache
+    principal = current_principal()
+    if not principal or principal.kind != 'professional':
         flash("You must be logged in to access your profile.", "danger")
         return redirect(url_for('main.login'))
 
-    # Fetch the professional's details from the database
-    professional = ServiceProfessional.query.get_or_404(prof_id)
+    # Fetch the professional's details from the database for the form
+    professional = ServiceProfessional.query.get_or_404(principal.id)
 
     if request.method == 'POST':
         # Update profile fields
@@ -31,6 +39,8 @@ def profile():
             professional.password = generate_password_hash(request.form['password'])  # Use password hashing
 
         db.session.commit()
+        matcher.professional_changed(professional)  # Service type or pincode may have changed
+        principals.invalidate('professional', professional.prof_id)
         flash("Profile updated successfully!", "success")
         return redirect(url_for('main.professional_dashboard'))
 
@@ -50,8 +60,13 @@ def accept_service(service_id):
         flash("You cannot accept this service request.", "danger")
         return redirect(url_for('main.professional_dashboard'))
 
-    # Update the status to 'Accepted' for the specific service request
-    service_request.status = 'Accepted'
+    # Accept it only if it is still waiting; a closed or rejected request stays that way
+    old_status = service_request.status
+    if not service_request.transition('Accepted'):
+        db.session.rollback()
+        flash(f"This service request is {service_request.status} and can no longer be accepted.", "warning")
+        return redirect(url_for('main.professional_dashboard'))
+    record_status_change(service_request, old_status, 'Accepted')
     db.session.commit()
 
     flash("Service request accepted successfully!", "success")
@@ -70,9 +85,15 @@ def reject_service(service_id):
         flash("You cannot reject this service request.", "danger")
         return redirect(url_for('main.professional_dashboard'))
 
-    # Update the status to 'Rejected' for the specific service request
-    service_request.status = 'Rejected'
+    # Reject it only if it is still open
+    old_status = service_request.status
+    if not service_request.transition('Rejected', close_date=datetime.utcnow()):
+        db.session.rollback()
+        flash(f"This service request is {service_request.status} and can no longer be rejected.", "warning")
+        return redirect(url_for('main.professional_dashboard'))
+    record_status_change(service_request, old_status, 'Rejected')
     db.session.commit()
+    matcher.request_closed(professional_id)
 
     flash("Service request rejected successfully!", "success")
     return redirect(url_for('main.professional_dashboard'))
@@ -80,10 +101,13 @@ def reject_service(service_id):
 
 # Search functionality route
 @professional_bp.route('/professional_dashboard/search', methods=['GET'])
+@query_budget(3)  # one more when this worker's catalog snapshot is cold
+@conditional_view('service_requests', 'users', 'service')
 def search():
     search_by = request.args.get('search_by')
     query = request.args.get('query', '').strip().lower()
-    services = Service.query.all()
+    reader = read_session()
+    services = catalog.services()
 
     # Get the logged-in professional's ID
     prof_id = session.get('prof_id')  # Assuming `prof_id` is stored in the session
@@ -92,62 +116,54 @@ def search():
         flash("Please log in to view your data.", "danger")
         return redirect(url_for('customer.login'))
 
-    if search_by == "customers":
-        # Search for customers associated with the logged-in professional's service requests
-        results = (
-            db.session.query(
-                ServiceRequest.req_id,
-                Service.name,
-                User.user_name,
-                User.contact,
-                User.address,
-                User.pincode,
-                ServiceRequest.close_date,
-                ServiceRequest.status,
-            )
-            .join(ServiceRequest, ServiceRequest.user_id == User.user_id)
-            .filter(
-                ServiceRequest.prof_id == prof_id,  # Restrict to logged-in professional
-                db.or_(
-                    Service.name.contains(query),  # Search by service name
-                    User.user_name.contains(query),  # Search by customer name
-                    User.address.contains(query),  # Search by location
-                    User.pincode.contains(query),  # Search by pincode
-                    ServiceRequest.status.contains(query)  # Search by status
-                )
-            )
-            .all()
+    # Both modes list the professional's own requests, best full-text match first
+    requests = (
+        reader.query(
+            ServiceRequest.req_id,
+            Service.name,
+            User.user_name,
+            User.contact,
+            User.address,
+            User.pincode,
+            ServiceRequest.close_date,
+            ServiceRequest.status,
+            ServiceRequest.rating,
         )
-    elif search_by == "requests":
-        # Search for service requests by multiple filters and fetch additional details
+        .join(User, ServiceRequest.user_id == User.user_id)  # Join with User table
+        .outerjoin(Service, ServiceRequest.service_id == Service.service_id)  # Join with Service table
+        .filter(ServiceRequest.prof_id == prof_id)  # Restrict to logged-in professional
+    )
+
+    if not fts_query(query) or search_by not in ("customers", "requests"):
+        results = []
+    elif search_by == "customers":
+        # Search by customer name, location or pincode
+        customers = fts_match('users_fts', query)
         results = (
-            db.session.query(
-                ServiceRequest.req_id,
-                Service.name,
-                User.user_name,
-                User.contact,
-                User.address,
-                User.pincode,
-                ServiceRequest.close_date,
-                ServiceRequest.status,
-                ServiceRequest.rating,
-            )
-            .join(User, ServiceRequest.user_id == User.user_id)  # Join with User table
-            .join(Service, ServiceRequest.service_id == Service.service_id)  # Join with Service table
-            .filter(
-                ServiceRequest.prof_id == prof_id,  # Restrict to logged-in professional
-                db.or_(
-                    Service.name.contains(query),  # Search by service name
-                    User.user_name.contains(query),  # Search by customer name
-                    User.address.contains(query),  # Search by location
-                    User.pincode.contains(query),  # Search by pincode
-                    ServiceRequest.status.contains(query)  # Search by status
-                )
-            )
+            requests
+            .join(customers, ServiceRequest.user_id == customers.c.rowid)
+            .order_by(customers.c.rank, ServiceRequest.req_id.desc())
+            .limit(SEARCH_RESULT_LIMIT)
             .all()
         )
     else:
-        results = []
+        # Search by status, or by service name or customer name, location or pincode
+        status = match_status(query, ['Requested', 'Accepted', 'Rejected', 'Closed'])
+        if status:
+            requests = requests.filter(ServiceRequest.status == status).order_by(ServiceRequest.req_id.desc())
+        else:
+            customers = fts_match('users_fts', query)
+            service_matches = fts_match('service_fts', query)
+            requests = (
+                requests
+                .outerjoin(customers, ServiceRequest.user_id == customers.c.rowid)
+                .outerjoin(service_matches, ServiceRequest.service_id == service_matches.c.rowid)
+                .filter(db.or_(customers.c.rowid.isnot(None), service_matches.c.rowid.isnot(None)))
+                # bm25 ranks are negative, so matching both tables sorts first
+                .order_by(db.func.coalesce(customers.c.rank, 0) + db.func.coalesce(service_matches.c.rank, 0),
+                          ServiceRequest.req_id.desc())
+            )
+        results = requests.limit(SEARCH_RESULT_LIMIT).all()
 
     # Pass results and query back to the template
     return render_template(
@@ -159,8 +175,25 @@ def search():
     )
 
 @professional_bp.route('/professional_dashboard/summary', methods=['GET'])
+@query_budget(3)
+@conditional_view('request_rollups', 'rating_rollups')
 def summary():
-    return render_template('service_panel/summary.html')
+    prof_id = session.get('prof_id')
+    if not prof_id:
+        flash("You must be logged in to view your summary.", "danger")
+        return redirect(url_for('main.login'))
+
+    # Read straight from the rollups instead of counting service_requests
+    counts = status_counts('professional', prof_id)
+    histogram, rating_total, rating_average = rating_histogram('professional', prof_id)
+    return render_template(
+        'service_panel/summary.html',
+        counts=counts,
+        total=sum(counts.values()),
+        histogram=histogram,
+        rating_total=rating_total,
+        rating_average=rating_average
+    )
 
 
 
@@ -0,0 +1,86 @@
+# query_budget.py
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a view runs more SQL statements than its budget allows."""
+
+
+def query_budget(limit):
+    """Cap the number of SQL statements a view may run while the guard is enabled.
+
+    A budget can also be set (or overridden) per endpoint with the
+    ``QUERY_BUDGETS`` config mapping, e.g. ``{'customer.dashboard': 3}``.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def _start_counting():
+    # Hooks registered before the guard (such as the principal lookup) are not part of the view's budget
+    g.query_count = 0
+
+
+def _budget_for(endpoint):
+    budgets = current_app.config.get('QUERY_BUDGETS') or {}
+    if endpoint in budgets:
+        return budgets[endpoint]
+    view = current_app.view_functions.get(endpoint)
+    return getattr(view, 'query_budget', current_app.config.get('QUERY_BUDGET_DEFAULT'))
+
+
+def _check_budget(response):
+    enabled = current_app.config.get('QUERY_BUDGET_ENABLED')
+    if enabled is None:
+        enabled = current_app.debug or current_app.testing
+    if not enabled or request.endpoint is None:
+        return response
+
+    budget = _budget_for(request.endpoint)
+    if budget is None:
+        return response
+    if response.is_streamed:
+        # Streamed templates run their queries while the body is sent: check before each chunk goes out
+        response.response = _checked_stream(response.response, request.endpoint, budget, g._get_current_object())
+    else:
+        _enforce(request.endpoint, budget, g.get('query_count', 0))
+    return response
+
+
+def _checked_stream(chunks, endpoint, budget, counts):
+    # An over-budget stream stops before the chunk that went over is sent
+    try:
+        for chunk in chunks:
+            _enforce(endpoint, budget, counts.get('query_count', 0))
+            yield chunk
+        _enforce(endpoint, budget, counts.get('query_count', 0))
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _enforce(endpoint, budget, count):
+    if count > budget:
+        raise QueryBudgetExceeded(f"{endpoint} ran {count} SQL statements, budget is {budget}")
+
+
+def init_query_budget(app):
+    """Count SQL statements per request and fail requests that go over budget.
+
+    The guard is on in debug and testing mode unless ``QUERY_BUDGET_ENABLED``
+    says otherwise. Counting starts when the guard's own ``before_request`` hook
+    runs, so register it after app-wide hooks that should not be charged to views.
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+    app.before_request(_start_counting)
+    app.after_request(_check_budget)
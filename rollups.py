@@ -0,0 +1,273 @@
+# rollups.py
+"""Incrementally maintained summary counts behind the three summary pages.
+
+Routes call :func:`record_status_change` and :func:`record_rating` before they
+commit. Each call queues a background job (see jobs.py) in the same
+transaction as the request change, so the route only pays for one insert.
+The job applies the change later as a single multi-row
+``INSERT ... ON CONFLICT DO UPDATE``, in the same transaction that marks the
+job done, so every change is counted exactly once. The summary pages lag a
+committed change by as long as the job takes to run, normally well under a
+second.
+
+The same rating job keeps each professional's ``rating_count``,
+``rating_sum`` and Bayesian ``rating_score`` current, for the top-rated
+lists.
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects.sqlite import insert
+
+from jobs import enqueue, job
+from models import (db, bayesian_rating, ArchivedServiceRequest, Job, RequestRollup, RatingRollup,
+                    ServiceProfessional, REQUEST_HISTORY_COLUMNS)
+
+REQUEST_STATUSES = ['Requested', 'Accepted', 'Rejected', 'Closed']
+RATINGS = [1, 2, 3, 4, 5]
+
+
+def _upsert(model, value_column, rows):
+    if not rows:
+        return
+    stmt = insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dimension', 'key', value_column],
+        set_={'count': model.count + stmt.excluded.count},
+    )
+    db.session.execute(stmt)
+
+
+def _request_keys(service_request):
+    keys = [('all', ''), ('service', service_request.service_id), ('customer', service_request.user_id)]
+    if service_request.prof_id is not None:
+        keys.append(('professional', service_request.prof_id))
+    return [(dimension, str(key)) for dimension, key in keys if key is not None]
+
+
+def record_status_change(service_request, old_status, new_status, when=None):
+    """Move ``service_request`` from ``old_status`` (None for a new booking) to ``new_status``."""
+    if old_status == new_status:
+        return
+    enqueue('rollups.status', {
+        'keys': _request_keys(service_request),
+        'day': (when or datetime.utcnow()).date().isoformat(),
+        'old': old_status,
+        'new': new_status,
+    })
+
+
+def record_rating(service_request, rating, old_rating=None):
+    """Add ``rating`` (replacing ``old_rating``, if any) to the rating histograms."""
+    keys = [('all', ''), ('service', service_request.service_id), ('professional', service_request.prof_id)]
+    enqueue('rollups.rating', {
+        'keys': [(dimension, str(key)) for dimension, key in keys if key is not None],
+        'rating': rating,
+        'old': old_rating,
+    })
+
+
+@job('rollups.status')
+def _apply_status_change(payload):
+    old_status, new_status = payload['old'], payload['new']
+    rows = [{'dimension': 'day', 'key': payload['day'], 'status': new_status, 'count': 1}]
+    for dimension, key in payload['keys']:
+        rows.append({'dimension': dimension, 'key': key, 'status': new_status, 'count': 1})
+        if old_status:
+            rows.append({'dimension': dimension, 'key': key, 'status': old_status, 'count': -1})
+    _upsert(RequestRollup, 'status', rows)
+
+
+@job('rollups.rating')
+def _apply_rating(payload):
+    rows = []
+    for dimension, key in payload['keys']:
+        rows.append({'dimension': dimension, 'key': key, 'rating': payload['rating'], 'count': 1})
+        if payload['old']:
+            rows.append({'dimension': dimension, 'key': key, 'rating': payload['old'], 'count': -1})
+    _upsert(RatingRollup, 'rating', rows)
+
+    prof_ids = [int(key) for dimension, key in payload['keys'] if dimension == 'professional']
+    count_delta = 0 if payload['old'] else 1
+    sum_delta = payload['rating'] - (payload['old'] or 0)
+    if prof_ids and (count_delta or sum_delta):
+        rating_count = ServiceProfessional.rating_count + count_delta
+        rating_sum = ServiceProfessional.rating_sum + sum_delta
+        db.session.execute(
+            db.update(ServiceProfessional)
+            .where(ServiceProfessional.prof_id == prof_ids[0])
+            .values(rating_count=rating_count, rating_sum=rating_sum,
+                    rating_score=bayesian_rating(rating_sum, rating_count))
+        )
+
+
+# --- Reading ----------------------------------------------------------------
+
+def status_counts(dimension, key=''):
+    """``{status: count}`` for one rollup key, with every status present."""
+    counts = dict.fromkeys(REQUEST_STATUSES, 0)
+    rows = (
+        db.session.query(RequestRollup.status, RequestRollup.count)
+        .filter(RequestRollup.dimension == dimension, RequestRollup.key == str(key))
+        .all()
+    )
+    counts.update(rows)
+    return counts
+
+
+def status_counts_by_key(dimension):
+    """``{key: {status: count}}`` for every key in a (small) dimension."""
+    table = {}
+    rows = (
+        db.session.query(RequestRollup.key, RequestRollup.status, RequestRollup.count)
+        .filter(RequestRollup.dimension == dimension)
+        .all()
+    )
+    for key, status, count in rows:
+        table.setdefault(key, dict.fromkeys(REQUEST_STATUSES, 0))[status] = count
+    return table
+
+
+def daily_counts(days=14):
+    """``[(iso_date, {status: count})]`` for the last ``days`` days, oldest first."""
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    table = {
+        (start + timedelta(days=i)).isoformat(): dict.fromkeys(REQUEST_STATUSES, 0)
+        for i in range(days)
+    }
+    rows = (
+        db.session.query(RequestRollup.key, RequestRollup.status, RequestRollup.count)
+        .filter(RequestRollup.dimension == 'day', RequestRollup.key >= start.isoformat())
+        .all()
+    )
+    for day, status, count in rows:
+        if day in table:
+            table[day][status] = count
+    return sorted(table.items())
+
+
+def top_keys(dimension, status='Closed', limit=10):
+    """``[(key, count)]`` with the most requests in ``status``, read off the rank index."""
+    return (
+        db.session.query(RequestRollup.key, RequestRollup.count)
+        .filter(RequestRollup.dimension == dimension, RequestRollup.status == status, RequestRollup.count > 0)
+        .order_by(RequestRollup.count.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def rating_histogram(dimension, key=''):
+    """``(histogram, total, average)`` for one rating rollup key."""
+    histogram = dict.fromkeys(RATINGS, 0)
+    rows = (
+        db.session.query(RatingRollup.rating, RatingRollup.count)
+        .filter(RatingRollup.dimension == dimension, RatingRollup.key == str(key))
+        .all()
+    )
+    histogram.update(rows)
+    total = sum(histogram.values())
+    average = sum(r * c for r, c in histogram.items()) / total if total else None
+    return histogram, total, average
+
+
+def average_ratings(dimension):
+    """``{key: average}`` for every key in a (small) rating dimension."""
+    sums = {}
+    rows = (
+        db.session.query(RatingRollup.key, RatingRollup.rating, RatingRollup.count)
+        .filter(RatingRollup.dimension == dimension)
+        .all()
+    )
+    for key, rating, count in rows:
+        total, weighted = sums.get(key, (0, 0))
+        sums[key] = (total + count, weighted + rating * count)
+    return {key: weighted / total for key, (total, weighted) in sums.items() if total}
+
+
+# --- Rebuilding -------------------------------------------------------------
+
+def _all_requests(conn):
+    """A FROM clause over every request: archived requests still count towards the rollups."""
+    if not db.inspect(conn).has_table(ArchivedServiceRequest.__tablename__):
+        return 'service_requests'  # before migration 9
+    columns = ', '.join(REQUEST_HISTORY_COLUMNS)
+    return (f'(SELECT {columns} FROM service_requests '
+            f'UNION ALL SELECT {columns} FROM {ArchivedServiceRequest.__tablename__})')
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from ``service_requests`` and its archive with one pass of GROUP BYs.
+
+    Only needed once for an existing database (or to repair drift). Past
+    transitions have no timestamp of their own, so the 'day' rollup counts each
+    booking on ``requested_date``, closures on ``close_date`` and other current
+    statuses on ``requested_date``.
+
+    Rollup jobs still queued are already reflected in ``service_requests``, so
+    they are marked done instead of being applied on top.
+    """
+    if db.inspect(conn).has_table(Job.__tablename__):
+        conn.execute(
+            db.update(Job)
+            .where(Job.kind.in_(['rollups.status', 'rollups.rating']), Job.status.in_(['queued', 'running']))
+            .values(status='done', locked_until=None, finished_at=datetime.utcnow())
+        )
+    requests = _all_requests(conn)
+    conn.exec_driver_sql('DELETE FROM request_rollups')
+    conn.exec_driver_sql('DELETE FROM rating_rollups')
+
+    for dimension, key_expr in [('all', "''"), ('service', 'service_id'),
+                                ('professional', 'prof_id'), ('customer', 'user_id')]:
+        conn.exec_driver_sql(
+            f"INSERT INTO request_rollups (dimension, key, status, count) "
+            f"SELECT '{dimension}', CAST({key_expr} AS TEXT), status, COUNT(*) FROM {requests} "
+            f"WHERE {key_expr} IS NOT NULL GROUP BY {key_expr}, status"
+        )
+    conn.exec_driver_sql(
+        "INSERT INTO request_rollups (dimension, key, status, count) "
+        "SELECT 'day', day, status, COUNT(*) FROM ("
+        f"  SELECT date(requested_date) AS day, 'Requested' AS status FROM {requests}"
+        "  UNION ALL"
+        "  SELECT date(CASE WHEN status = 'Closed' THEN close_date ELSE requested_date END), status"
+        f"  FROM {requests} WHERE status != 'Requested') "
+        "WHERE day IS NOT NULL GROUP BY day, status"
+    )
+
+    for dimension, key_expr in [('all', "''"), ('service', 'service_id'), ('professional', 'prof_id')]:
+        conn.exec_driver_sql(
+            f"INSERT INTO rating_rollups (dimension, key, rating, count) "
+            f"SELECT '{dimension}', CAST({key_expr} AS TEXT), rating, COUNT(*) FROM {requests} "
+            f"WHERE rating IS NOT NULL AND {key_expr} IS NOT NULL GROUP BY {key_expr}, rating"
+        )
+
+    columns = {column['name'] for column in db.inspect(conn).get_columns(ServiceProfessional.__tablename__)}
+    if 'rating_score' in columns:  # added by migration 8, after the first rebuild
+        rebuild_professional_ratings(conn)
+
+
+def rebuild_professional_ratings(conn):
+    """Recompute every professional's rating count, sum and score from all requests."""
+    conn.execute(db.update(ServiceProfessional).values(rating_count=0, rating_sum=0))
+    conn.exec_driver_sql(
+        "UPDATE service_professionals SET rating_count = r.n, rating_sum = r.total "
+        f"FROM (SELECT prof_id, COUNT(*) AS n, SUM(rating) AS total FROM {_all_requests(conn)} "
+        "      WHERE rating IS NOT NULL AND prof_id IS NOT NULL GROUP BY prof_id) AS r "
+        "WHERE service_professionals.prof_id = r.prof_id"
+    )
+    conn.execute(db.update(ServiceProfessional).values(
+        rating_score=bayesian_rating(ServiceProfessional.rating_sum, ServiceProfessional.rating_count)
+    ))
+
+
+rollups_cli = AppGroup('rollups', help='Maintain the summary rollup tables.')
+
+
+@rollups_cli.command('rebuild')
+def rebuild_command():
+    """Recompute all rollups from the service_requests table and its archive."""
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn)
+    click.echo('Rollups rebuilt.')
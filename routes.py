@@ -1,6 +1,13 @@
 # routes.py
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session
-from models import db, User, ServiceProfessional, Service, ServiceRequest
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session, jsonify, current_app
+from catalog import catalog
+from conditional import conditional_view
+from archive import include_archived
+from models import (db, User, ServiceProfessional, Service, ServiceRequest, OPEN_REQUEST_STATUSES,
+                    HISTORY_REQUEST_STATUSES, request_history_model)
+from pagination import keyset_paginate, page_args
+from query_budget import query_budget
+from sqlite_profile import read_session
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
@@ -11,6 +18,19 @@ main = Blueprint('main', __name__)
 def homepage():
     return render_template('homepage.html')
 
+@main.route('/services.json')
+@query_budget(1)
+def service_catalog():
+    # Served from the in-process catalog; the ETag only changes when an admin edits a service
+    snapshot = catalog.snapshot()
+    if request.if_none_match.contains(snapshot.etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(version=snapshot.version, services=snapshot.as_dicts())
+    response.set_etag(snapshot.etag)
+    response.cache_control.no_cache = True  # always revalidate; a 304 is nearly free
+    return response
+
 @main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -124,7 +144,7 @@ def prof_register():
             return redirect(url_for('main.prof_register'))
 
     # Fetch service types from the database
-    services = Service.query.all()
+    services = catalog.services()
     return render_template('prof_register.html', services=services)
 
 
@@ -160,11 +180,13 @@ def login():
             # Store user details in session
             if role == "customer" or role == "admin":
                 # For 'User' table roles
+                session.pop('prof_id', None)
                 session['user_id'] = user.user_id
                 session['username'] = user.username
                 session['role'] = role
             elif role == "service_professional":
                 # For 'ServiceProfessional' table
+                session.pop('user_id', None)
                 session['prof_id'] = user.prof_id
                 session['username'] = user.username
                 session['role'] = role
@@ -188,31 +210,17 @@ def customer_dashboard():
     return redirect(url_for('customer.dashboard'))
 
 @main.route('/professional_dashboard')
+@query_budget(2)
+@conditional_view('service_requests', 'users', 'service')
 def professional_dashboard():
-    services = Service.query.all()
     prof_id = session.get('prof_id')
     if not prof_id:
         flash("You must be logged in to view your dashboard.", "danger")
         return redirect(url_for('main.login'))
 
-    # Fetch requested services for the logged-in professional
-    today_services = (
-        db.session.query(
-            ServiceRequest.req_id,
-            User.user_name,
-            User.contact,
-            User.address,
-            User.pincode,
-            ServiceRequest.status
-        )
-        .join(User, ServiceRequest.user_id == User.user_id)
-        .filter(ServiceRequest.prof_id == prof_id, ServiceRequest.status == 'Requested')
-        .all()
-    )
-
-    # Fetch accepted services for the logged-in professional
-    accepted_services = (
-        db.session.query(
+    # Fetch all open requests for the logged-in professional in one pass and split them by status
+    open_services = (
+        read_session().query(
             ServiceRequest.req_id,
             Service.name,
             User.user_name,
@@ -222,56 +230,58 @@ def professional_dashboard():
             ServiceRequest.status
         )
         .join(User, ServiceRequest.user_id == User.user_id)
-        .join(Service, ServiceRequest.service_id == Service.service_id)
-        .filter(ServiceRequest.prof_id == prof_id, ServiceRequest.status == 'Accepted')
+        .outerjoin(Service, ServiceRequest.service_id == Service.service_id)
+        .filter(ServiceRequest.prof_id == prof_id, ServiceRequest.status.in_(OPEN_REQUEST_STATUSES))
+        .order_by(ServiceRequest.req_id)
         .all()
     )
+    today_services = [service for service in open_services if service.status == 'Requested']
+    accepted_services = [service for service in open_services if service.status == 'Accepted']
 
-    # Fetch rejected services for the logged-in professional
-    rejected_services = (
-        db.session.query(
-            ServiceRequest.req_id,
-            Service.name,
-            User.user_name,
-            User.contact,
-            User.address,
-            User.pincode,
-            ServiceRequest.status
-        )
-        .join(User, ServiceRequest.user_id == User.user_id)
-        .join(Service, ServiceRequest.service_id == Service.service_id)
-        .filter(ServiceRequest.prof_id == prof_id, ServiceRequest.status == 'Rejected')
-        .all()
+    return render_template(
+        'service_panel/professional_dashboard.html',
+        today_services=today_services,
+        accepted_services=accepted_services
     )
 
-    # Fetch closed services for the logged-in professional
-    closed_services = (
-        db.session.query(
-            ServiceRequest.req_id,
-            User.user_name,
+
+@main.route('/professional_dashboard/history')
+@query_budget(2)
+@conditional_view('service_requests', 'users', 'service')
+def professional_history():
+    prof_id = session.get('prof_id')
+    if not prof_id:
+        flash("You must be logged in to view your dashboard.", "danger")
+        return redirect(url_for('main.login'))
+
+    status = request.args.get('status', 'Closed')
+    if status not in HISTORY_REQUEST_STATUSES:
+        status = 'Closed'
+
+    # Closed and rejected requests only grow, so page through them newest first;
+    # the archived ones too only when asked for
+    archived = include_archived()
+    history = request_history_model(archived)
+    history_query = (
+        read_session().query(
+            history.req_id,
             Service.name,
+            User.user_name,
             User.contact,
             User.address,
             User.pincode,
-            ServiceRequest.close_date,
-            ServiceRequest.status,
-            ServiceRequest.rating,
-            ServiceRequest.remarks
+            history.close_date,
+            history.status,
+            history.rating,
+            history.remarks
         )
-        .join(User, ServiceRequest.user_id == User.user_id)
-        .join(Service, ServiceRequest.service_id == Service.service_id)
-        .filter(ServiceRequest.prof_id == prof_id, ServiceRequest.status == 'Closed')
-        .all()
+        .join(User, history.user_id == User.user_id)
+        .outerjoin(Service, history.service_id == Service.service_id)
+        .filter(history.prof_id == prof_id, history.status == status)
     )
+    page = keyset_paginate(history_query, history.req_id, **page_args(default_sort='desc'))
 
-    return render_template(
-        'service_panel/professional_dashboard.html',
-        today_services=today_services,
-        accepted_services=accepted_services,
-        rejected_services=rejected_services,
-        closed_services=closed_services,
-        services=services
-    )
+    return render_template('service_panel/history.html', page=page, status=status, archived=archived)
 
 
 @main.route('/admin_dashboard')
@@ -0,0 +1,75 @@
+# search_index.py
+"""SQLite FTS5 full-text index behind the admin, customer and professional search pages.
+
+Each indexed table gets an external-content FTS5 table (the text is not stored
+twice) and insert/update/delete triggers that keep it in sync, so every write
+path - ORM, bulk SQL or a manual sqlite3 session - updates the index in the
+same transaction.
+"""
+import re
+
+from models import db
+
+# Hard cap on rows a search page renders
+SEARCH_RESULT_LIMIT = 100
+
+# fts table -> (content table, rowid column, indexed columns)
+FTS_TABLES = {
+    'service_fts': ('service', 'service_id', ('name', 'description')),
+    'users_fts': ('users', 'user_id', ('user_name', 'address', 'pincode')),
+    'professionals_fts': ('service_professionals', 'prof_id', ('prof_name', 'service_type', 'address', 'pincode')),
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def create_search_index(conn):
+    """Create the FTS5 tables and sync triggers, then build them from the content tables."""
+    for fts, (table, rowid, columns) in FTS_TABLES.items():
+        cols = ', '.join(columns)
+        new_vals = ', '.join(f'new.{c}' for c in columns)
+        old_vals = ', '.join(f'old.{c}' for c in columns)
+
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{cols}, content='{table}', content_rowid='{rowid}', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts} (rowid, {cols}) VALUES (new.{rowid}, {new_vals}); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_vals}); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_vals}); "
+            f"INSERT INTO {fts} (rowid, {cols}) VALUES (new.{rowid}, {new_vals}); END"
+        )
+        conn.exec_driver_sql(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    words = _WORD.findall(text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def fts_match(fts, text):
+    """Subquery of ``(rowid, rank)`` for rows of ``fts`` matching ``text``; lower rank is better."""
+    table = db.table(fts, db.column('rowid'), db.column('rank'))
+    match = db.literal_column(fts).op('MATCH')(db.bindparam(f'{fts}_q', fts_query(text), unique=True))
+    return db.select(table.c.rowid, table.c.rank).where(match).subquery()
+
+
+def match_status(text, statuses):
+    """Return the status from ``statuses`` that ``text`` names (case-insensitive), if any."""
+    text = (text or '').strip().lower()
+    for status in statuses:
+        if status.lower() == text:
+            return status
+    return None
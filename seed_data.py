@@ -0,0 +1,217 @@
+# seed_data.py
+"""Seeded generator of realistic, synthetic ``services.db`` fixtures for benchmarking.
+
+The same ``seed`` and sizes always produce the same database. The data is
+skewed the way real traffic is:
+
+* pincodes cluster into a few dozen cities of very different sizes;
+* a minority of customers books most requests;
+* a few services dominate demand;
+* professionals are mostly APPROVED;
+* requests older than two weeks are nearly all Closed (rated, mostly 4-5) or
+  Rejected, while recent ones are still Requested or Accepted;
+* a customer never has two open requests for the same service.
+
+Every account shares one password, hashed once. Rows are inserted with plain
+executemany in large transactions. Indexes, the search index, the rollups
+and the change counters are then built by the normal schema migrations.
+"""
+import math
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from werkzeug.security import generate_password_hash
+
+from migrations import upgrade
+from models import db
+
+SERVICES = [
+    # (name, base price, relative demand)
+    ('Cleaning Services', 799, 18), ('Plumbing', 499, 14), ('Electrical Services', 449, 13),
+    ('Appliance Repair', 599, 11), ('Pest Control', 999, 8), ('Painting Services', 2499, 6),
+    ('AC Servicing', 699, 9), ('Carpentry', 549, 6), ('Salon at Home', 899, 7),
+    ('Home Security Services', 1499, 3), ('Laundry', 299, 4), ('Gardening', 399, 2),
+]
+CITIES = [
+    'Mumbai', 'Delhi', 'Bengaluru', 'Hyderabad', 'Ahmedabad', 'Chennai', 'Kolkata', 'Pune', 'Jaipur',
+    'Surat', 'Lucknow', 'Kanpur', 'Nagpur', 'Indore', 'Thane', 'Bhopal', 'Visakhapatnam', 'Patna',
+    'Vadodara', 'Ghaziabad', 'Ludhiana', 'Agra', 'Nashik', 'Ranchi', 'Meerut', 'Rajkot', 'Varanasi',
+    'Srinagar', 'Amritsar', 'Allahabad', 'Coimbatore', 'Madurai', 'Jodhpur', 'Raipur', 'Kochi', 'Mysuru',
+]
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Vihaan', 'Arjun', 'Sai', 'Reyansh', 'Krishna', 'Ishaan', 'Rohan',
+    'Ananya', 'Diya', 'Aadhya', 'Saanvi', 'Pari', 'Meera', 'Kavya', 'Riya', 'Nisha', 'Priya',
+    'Rahul', 'Amit', 'Suresh', 'Ramesh', 'Vikram', 'Neha', 'Pooja', 'Sneha', 'Anjali', 'Deepa',
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Patel', 'Reddy', 'Nair', 'Iyer', 'Gupta', 'Singh', 'Kumar', 'Das',
+    'Mehta', 'Joshi', 'Rao', 'Pillai', 'Chopra', 'Malhotra', 'Bose', 'Mukherjee', 'Khan', 'Shah',
+]
+STREETS = ['MG Road', 'Station Road', 'Park Street', 'Main Road', 'Temple Street', 'Lake View', 'Market Lane',
+           'Gandhi Nagar', 'Nehru Colony', 'Ring Road']
+REMARKS = [None, None, 'Great work', 'On time and professional', 'Okay', 'Could be better', 'Excellent service',
+           'Left the place clean', 'Took longer than expected']
+RATING_WEIGHTS = [3, 5, 12, 35, 45]  # 1..5 stars
+PROFESSIONAL_STATUS_WEIGHTS = {'APPROVED': 80, 'PENDING': 12, 'REJECTED': 8}
+RECENT_DAYS = 14
+HISTORY_DAYS = 365
+INSERT_CHUNK = 20000
+
+
+class _Cities:
+    """Zipf-sized cities, each a 3-digit pincode area with a few dozen local pincodes."""
+
+    def __init__(self, rng):
+        prefixes = rng.sample(range(110, 856), len(CITIES))
+        self.cities = []
+        for rank, (name, prefix) in enumerate(zip(CITIES, prefixes), 1):
+            locals_ = [f'{prefix}{n:03d}' for n in rng.sample(range(1, 999), rng.randint(15, 60))]
+            self.cities.append((name, str(prefix), locals_))
+        self.cum_weights = _cumulative(1 / rank ** 1.1 for rank in range(1, len(self.cities) + 1))
+
+    def pick(self, rng):
+        name, prefix, locals_ = rng.choices(self.cities, cum_weights=self.cum_weights)[0]
+        # Pincodes inside a city are skewed too: the centre is denser than the suburbs
+        return name, prefix, locals_[int(len(locals_) * rng.random() ** 2)]
+
+
+def _cumulative(weights):
+    total, cumulative = 0.0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _person(rng, cities):
+    city, prefix, pincode = cities.pick(rng)
+    name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+    address = f'{rng.randint(1, 999)}, {rng.choice(STREETS)}, {city}'
+    contact = f'{rng.choice("6789")}{rng.randrange(10 ** 9):09d}'
+    return name, address, contact, pincode, prefix
+
+
+def _insert(conn, table, columns, rows):
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    for start in range(0, len(rows), INSERT_CHUNK):
+        conn.exec_driver_sql(sql, rows[start:start + INSERT_CHUNK])
+
+
+def _generate_requests(rng, count, customers, professionals, now):
+    """Yield service_requests rows; ``customers`` is ``[(user_id, prefix)]``."""
+    service_cum = _cumulative(demand for _, _, demand in SERVICES)
+    # A lognormal activity level per customer: most book rarely, a few book a lot
+    customer_cum = _cumulative(rng.lognormvariate(0, 1.2) for _ in customers)
+    by_city, by_service = {}, {}
+    for prof_id, service_index, prefix in professionals:
+        by_city.setdefault((service_index, prefix), []).append(prof_id)
+        by_service.setdefault(service_index, []).append(prof_id)
+
+    open_pairs = set()
+    history = timedelta(days=HISTORY_DAYS).total_seconds()
+    for _ in range(count):
+        user_id, prefix = rng.choices(customers, cum_weights=customer_cum)[0]
+        service_index = rng.choices(range(len(SERVICES)), cum_weights=service_cum)[0]
+        local = by_city.get((service_index, prefix))
+        pool = local if local and rng.random() < 0.85 else by_service.get(service_index)
+        prof_id = rng.choice(pool) if pool else None
+
+        # Bookings grow over time, so recent requests outnumber old ones
+        age = history * (1 - math.sqrt(rng.random()))
+        requested = now - timedelta(seconds=age)
+        if prof_id is None:
+            status = 'Requested'
+        elif age > RECENT_DAYS * 86400:
+            status = 'Closed' if rng.random() < 0.85 else 'Rejected'
+        else:
+            status = rng.choices(['Requested', 'Accepted', 'Closed', 'Rejected'], weights=[35, 30, 25, 10])[0]
+        service_id = service_index + 1
+        if status in ('Requested', 'Accepted'):
+            if (user_id, service_id) in open_pairs:
+                status = 'Closed' if prof_id else 'Rejected'
+            else:
+                open_pairs.add((user_id, service_id))
+
+        rating = remarks = None
+        close_date = requested
+        if status == 'Closed':
+            rating = rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0]
+            remarks = rng.choice(REMARKS)
+            close_date = requested + timedelta(hours=rng.uniform(2, 96))
+        yield (user_id, service_id, prof_id, status, rating, remarks, requested, min(close_date, now))
+
+
+def seed_database(path, users=100_000, professionals=10_000, requests=1_000_000, seed=42,
+                  password='password', echo=print):
+    """Create a new SQLite database at ``path`` filled with synthetic data."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)  # fixed, so the same seed gives the same rows on any day
+    password_hash = generate_password_hash(password)
+    cities = _Cities(rng)
+
+    engine = create_engine(f'sqlite:///{os.path.abspath(path)}')
+
+    @event.listens_for(engine, 'connect')
+    def _fast_load(dbapi_conn, _):
+        # A throwaway fixture: no need to survive a crash while it is written
+        dbapi_conn.execute('PRAGMA journal_mode = OFF')
+        dbapi_conn.execute('PRAGMA synchronous = OFF')
+
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        echo(f'Seeding {len(SERVICES)} services')
+        _insert(conn, 'service', ['service_id', 'name', 'description', 'base_price', 'image', 'date_created'], [
+            (i, name, f'{name} by verified professionals near you.', price,
+             'static/uploads/default-service-image.jpg', now - timedelta(days=HISTORY_DAYS))
+            for i, (name, price, _) in enumerate(SERVICES, 1)
+        ])
+
+        echo(f'Seeding {users} customers')
+        customers, rows = [], [(1, 'admin', password_hash, 'Admin User', 'Head Office', '9000000000', '110001',
+                                'Active', 'admin', now - timedelta(days=HISTORY_DAYS))]
+        for user_id in range(2, users + 2):
+            name, address, contact, pincode, prefix = _person(rng, cities)
+            status = 'Blocked' if rng.random() < 0.01 else 'Active'
+            joined = now - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+            rows.append((user_id, f'customer{user_id}', password_hash, name, address, contact, pincode,
+                         status, 'customer', joined))
+            customers.append((user_id, prefix))
+        _insert(conn, 'users', ['user_id', 'username', 'password', 'user_name', 'address', 'contact', 'pincode',
+                                'status', 'role', 'date_created'], rows)
+
+        echo(f'Seeding {professionals} professionals')
+        approved, rows = [], []
+        service_cum = _cumulative(demand for _, _, demand in SERVICES)
+        for prof_id in range(1, professionals + 1):
+            name, address, contact, pincode, prefix = _person(rng, cities)
+            service_index = rng.choices(range(len(SERVICES)), cum_weights=service_cum)[0]
+            status = rng.choices(list(PROFESSIONAL_STATUS_WEIGHTS), weights=PROFESSIONAL_STATUS_WEIGHTS.values())[0]
+            joined = now - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+            rows.append((prof_id, f'pro{prof_id}', password_hash, name, SERVICES[service_index][0],
+                         f'{rng.randint(0, 25)} years', address, contact, pincode, joined, status,
+                         'service_professional'))
+            if status == 'APPROVED':
+                approved.append((prof_id, service_index, prefix))
+        _insert(conn, 'service_professionals', ['prof_id', 'username', 'password', 'prof_name', 'service_type',
+                                                'experience', 'address', 'contact', 'pincode', 'date_created',
+                                                'status', 'role'], rows)
+
+        echo(f'Seeding {requests} service requests')
+        columns = ['user_id', 'service_id', 'prof_id', 'status', 'rating', 'remarks', 'requested_date', 'close_date']
+        batch = []
+        for row in _generate_requests(rng, requests, customers, approved, now):
+            batch.append(row)
+            if len(batch) == INSERT_CHUNK:
+                _insert(conn, 'service_requests', columns, batch)
+                batch = []
+        _insert(conn, 'service_requests', columns, batch)
+
+    echo('Building indexes, search index and rollups')
+    upgrade(engine)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('ANALYZE')
+    engine.dispose()
@@ -0,0 +1,160 @@
+# sqlite_profile.py
+"""Engine profile for running the app on SQLite with concurrent workers.
+
+Every pooled connection gets the ``SQLITE_*`` pragmas below when it is
+opened: a WAL journal (readers never block the writer and vice versa),
+``synchronous=NORMAL`` (safe with WAL, one fsync per checkpoint instead of per
+commit), a busy timeout so writers queue for the lock instead of failing with
+"database is locked", plus memory-mapped I/O and a larger page cache.
+
+With ``SQLITE_READONLY_POOL`` on, a second pool opens the same file with
+``mode=ro``; :func:`read_session` hands out a session bound to it for pages
+that only read (dashboards and search). It falls back to ``db.session`` for
+in-memory or non-SQLite databases.
+
+Usage::
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(app.config)
+    db.init_app(app)
+    init_sqlite(app)
+
+Servers that fork workers after loading the app call :func:`dispose_engines`
+in each worker (see gunicorn.conf.py).
+"""
+from flask import current_app
+from flask.globals import app_ctx
+from flask_sqlalchemy.query import Query
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from models import db
+
+SQLITE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHE_SIZE_KB': 64 * 1024,
+    'SQLITE_POOL_SIZE': 10,
+    'SQLITE_MAX_OVERFLOW': 10,
+    'SQLITE_POOL_TIMEOUT': 10,
+    'SQLITE_READONLY_POOL': True,
+    'SQLITE_READONLY_POOL_SIZE': 10,
+}
+
+
+def _is_file_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def sqlite_engine_options(config):
+    """``SQLALCHEMY_ENGINE_OPTIONS`` with pool settings for multi-threaded workers.
+
+    Options already present in the config win over the profile.
+    """
+    for key, value in SQLITE_DEFAULTS.items():
+        config.setdefault(key, value)
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if not config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+        return options
+
+    options.setdefault('pool_size', config['SQLITE_POOL_SIZE'])
+    options.setdefault('max_overflow', config['SQLITE_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['SQLITE_POOL_TIMEOUT'])
+    connect_args = options.setdefault('connect_args', {})
+    # The driver's own lock wait, in seconds; the busy_timeout pragma below matches it
+    connect_args.setdefault('timeout', config['SQLITE_BUSY_TIMEOUT_MS'] / 1000)
+    # Pooled connections are handed to whichever worker thread checks them out
+    connect_args.setdefault('check_same_thread', False)
+    return options
+
+
+def _pragmas(config, readonly=False):
+    pragmas = [
+        ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT_MS'])),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('mmap_size', int(config['SQLITE_MMAP_SIZE'])),
+        ('cache_size', -int(config['SQLITE_CACHE_SIZE_KB'])),  # negative means KiB, not pages
+    ]
+    if readonly:
+        pragmas.append(('query_only', 'ON'))
+    else:
+        # The journal mode is stored in the file, so only the writer pool sets it
+        pragmas.insert(1, ('journal_mode', config['SQLITE_JOURNAL_MODE']))
+    return pragmas
+
+
+def _on_connect(pragmas):
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+    return apply
+
+
+class _ReadPool:
+    def __init__(self, engine):
+        self.engine = engine
+        self.session = scoped_session(
+            sessionmaker(bind=engine, query_cls=Query, autoflush=False),
+            scopefunc=lambda: id(app_ctx._get_current_object()),
+        )
+
+
+def init_sqlite(app):
+    """Apply the pragma profile to the app's engines and open the read-only pool."""
+    with app.app_context():
+        engine = db.engine
+    if not _is_file_sqlite(engine.url):
+        return
+
+    event.listen(engine, 'connect', _on_connect(_pragmas(app.config)))
+
+    if not app.config['SQLITE_READONLY_POOL']:
+        return
+    path = engine.url.database  # already absolute, resolved against the instance folder
+    if path.startswith('file:'):
+        path = path[len('file:'):]
+    url = engine.url.set(database=f'file:{path}', query={'mode': 'ro', 'uri': 'true'})
+    options = sqlite_engine_options(app.config)
+    reader = create_engine(
+        url,
+        pool_size=app.config['SQLITE_READONLY_POOL_SIZE'],
+        max_overflow=options.get('max_overflow', 10),
+        pool_timeout=options.get('pool_timeout', 30),
+        connect_args=options.get('connect_args', {}),
+    )
+    event.listen(reader, 'connect', _on_connect(_pragmas(app.config, readonly=True)))
+    pool = _ReadPool(reader)
+    app.extensions['sqlite_read_pool'] = pool
+
+    @app.teardown_appcontext
+    def _remove_read_session(exc):
+        pool.session.remove()
+
+
+def dispose_engines(app):
+    """Drop pooled connections inherited from a parent process, in a freshly forked worker.
+
+    SQLite connections must not be used across a fork. ``close=False`` leaves
+    the parent's connections alone and just gives this process new pools.
+    """
+    with app.app_context():
+        engines = list(db.engines.values())
+    pool = app.extensions.get('sqlite_read_pool')
+    if pool:
+        engines.append(pool.engine)
+    for engine in engines:
+        engine.dispose(close=False)
+
+
+def read_session():
+    """Session for read-only views: the read-only pool when enabled, else ``db.session``.
+
+    Objects loaded through it must not be modified or added to ``db.session``.
+    """
+    pool = current_app.extensions.get('sqlite_read_pool')
+    return pool.session if pool else db.session
@@ -0,0 +1,29 @@
+# stamps.py
+"""Stamp files that tell every worker process a per-process cache is stale.
+
+A writer replaces the stamp after committing; readers compare it with the
+stamp they loaded under, which costs one ``stat()``. The file is replaced
+rather than rewritten, so its inode changes even on filesystems with coarse
+modification times.
+"""
+import os
+import time
+
+
+def read_stamp(path):
+    """An opaque value that changes whenever ``path`` is touched; None if it does not exist."""
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        stat = None
+    return (stat.st_ino, stat.st_mtime_ns) if stat else None
+
+
+def touch_stamp(path):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as stamp:
+        stamp.write(str(time.time_ns()))
+    os.replace(temp_path, path)
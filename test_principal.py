@@ -0,0 +1,32 @@
+# test_principal.py
+"""The principal cache across worker processes, each simulated by its own PrincipalCache."""
+from app import create_app
+from models import db, User
+from principal import PrincipalCache
+
+
+def test_block_in_one_worker_is_seen_by_another(tmp_path):
+    stamp_path = str(tmp_path / 'principals.stamp')
+    app = create_app({
+        'TESTING': True,
+        'JOBS_WORKER_THREADS': 0,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "principal.db"}',
+        'PRINCIPAL_STAMP_PATH': stamp_path,
+    })
+    admin_worker = PrincipalCache(ttl=30, stamp_path=stamp_path)
+    other_worker = PrincipalCache(ttl=30, stamp_path=stamp_path)
+
+    with app.app_context():
+        db.create_all()
+        customer = User(username='c@example.com', password='x', user_name='C', address='1 Road',
+                        contact='1234567890', pincode='411001', role='customer', status='Active')
+        db.session.add(customer)
+        db.session.commit()
+
+        assert not other_worker.get('user', customer.user_id).is_blocked  # cached for the next 30 seconds
+
+        customer.status = 'Blocked'
+        db.session.commit()
+        admin_worker.invalidate('user', customer.user_id)
+
+        assert other_worker.get('user', customer.user_id).is_blocked
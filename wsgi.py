@@ -0,0 +1,13 @@
+# wsgi.py
+"""WSGI entry point for production servers.
+
+    APP_ENV=production SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+The profile defaults to ``production`` here; see config.py for the
+settings it reads from the environment.
+"""
+import os
+
+from app import create_app
+
+app = create_app(os.environ.get('APP_ENV', 'production'))